@@ -0,0 +1,72 @@
+#
+# Run a batch of saved TMD-2 workspaces without a screen.
+#
+#   python Tmd2Batch.py [--max-steps N] [--workers N] [--no-cycles] path [path ...]
+#
+# Each path can be a .tmd2 or .tmd2v2 file, a directory of them or a glob pattern. Every
+# workspace is run from its saved position until it halts, reaches an undefined
+# transition, is found to be in a cycle or reaches the step limit. The files are spread across a pool of
+# processes and one JSON line is printed per file as it finishes.
+#
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+
+import engine
+
+# Default step limit for each workspace.
+MAX_STEPS = 100000000
+
+# Names for the runFast results in the output.
+RESULTS = {'H': 'halted', 'E': 'undefined', 'L': 'limit', 'C': 'cycle'}
+
+# Load and run a single workspace. Called in the worker processes.
+def runFile(filename, maxSteps, detectCycles):
+    report = {'file': filename}
+    try:
+        machine = engine.TuringMachine()
+        machine.loadFile(filename)
+        machine.compileStateTable()
+        result = machine.runFast(maxSteps=maxSteps, detectCycles=detectCycles)
+    except Exception as ex:
+        report['result'] = 'failed'
+        report['error'] = str(ex)
+        return report
+
+    # A halt during the MOVE step means the tape head ran into an end marker ('b').
+    if result == 'H' and machine.currentStep == 'MOVE':
+        report['result'] = 'boundary'
+    else:
+        report['result'] = RESULTS[result]
+    report['steps'] = machine.steps
+    if result == 'C':
+        report['cycleStep'] = machine.cycleStep
+        report['period'] = machine.cyclePeriod
+    report['ones'] = machine.tape.counts[1]
+    report['sigma'] = machine.tape.getNonBlankCount()
+    report['state'] = machine.currentState
+    report['head'] = machine.tapeHead
+    report['time'] = round(machine.elapsed, 6)
+    return report
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Run TMD-2 workspaces without a screen.')
+    parser.add_argument('paths', nargs='+', help='.tmd2 or .tmd2v2 files, directories or glob patterns')
+    parser.add_argument('--max-steps', type=int, default=MAX_STEPS, help='step limit for each file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--no-cycles', action='store_true', help='do not stop machines that are found to be in a cycle')
+    options = parser.parse_args(arguments)
+
+    filenames = engine.findFiles(options.paths)
+    if not filenames:
+        parser.error('no workspace files found')
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options.workers) as executor:
+        futures = [executor.submit(runFile, filename, options.max_steps, not options.no_cycles) for filename in filenames]
+        for future in concurrent.futures.as_completed(futures):
+            print(json.dumps(future.result()), flush=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,310 @@
+#
+# Enumerate n state, k symbol TMD-2 machines for busy beaver searches.
+#
+#   python Tmd2Beaver.py --states 4 --symbols 2 --output bb4.jsonl
+#
+# Machines are built in tree normal form. Every machine starts with all transitions
+# undefined and is run until it needs one, and only then are the choices for that
+# transition added. New states and symbols are only introduced in order (state and
+# symbol renaming symmetry) and the first move is always to the right (mirror symmetry),
+# so no machine is generated twice.
+#
+# The top of the tree is expanded into shards which are searched in a pool of processes.
+# Every halting machine, every machine found to be in a cycle and every machine that
+# reaches the step limit is written to the output file as a JSON line holding a state
+# table in the usual .tmd2 format. Finished
+# shards are recorded in a checkpoint file next to the output so that an interrupted
+# search picks up where it left off when it is run again with the same options.
+#
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import sys
+
+import engine
+
+# Default step limit before a machine is treated as non halting.
+MAX_STEPS = 100000
+
+# How often to check for cycles. Much more often than the console does, as most of the
+# machines only run for a few steps.
+CYCLE_CHECK_STEPS = 1000
+
+# How many steps to look for translated cycles in, how many cells behind the edge of the
+# tape are kept to compare, and how many of the last times the head reached a new cell at
+# each end are compared against.
+TRANSLATED_CYCLE_STEPS = 1000
+TRANSLATED_CYCLE_WINDOW = 256
+TRANSLATED_CYCLE_RECORDS = 100
+
+# Default number of shards to split the search into.
+SHARDS = 256
+
+# The shard holding the results found while the shards themselves were being built.
+ROOT_SHARD = -1
+
+# Return a copy of the state table passed.
+def copyTable(table):
+    return {key: list(value) for key, value in table.items()}
+
+# Run a state table from a blank tape. Machines still running after TRANSLATED_CYCLE_STEPS
+# steps are checked for translated cycles before being run on to maxSteps.
+def simulate(table, maxSteps):
+    machine = engine.TuringMachine()
+    machine.stateTable = table
+    machine.compileStateTable()
+    result = machine.runFast(maxSteps=min(maxSteps, TRANSLATED_CYCLE_STEPS), pollSteps=CYCLE_CHECK_STEPS)
+    if result == 'L' and maxSteps > TRANSLATED_CYCLE_STEPS:
+        cycle = findTranslatedCycle(machine, TRANSLATED_CYCLE_STEPS)
+        if cycle != None:
+            machine.cycleStep, machine.cyclePeriod = cycle
+            return machine, 'C'
+        result = machine.runFast(maxSteps=maxSteps, pollSteps=CYCLE_CHECK_STEPS)
+    return machine, result
+
+# Look for a translated cycle in the first steps steps of the compiled machine passed, run
+# again from a blank tape. A machine that keeps moving off one end of the tape leaves a
+# growing trail behind it, so its configuration never repeats exactly. Instead each time
+# the head reaches a new cell at an end of the tape, it is compared with the earlier times
+# it reached a new cell at that end in the same state. If the cells behind the edge match
+# back as far as the head went between the two times, the machine will do the same again
+# from here on, one shift further along, for ever. The machine has to run for steps steps
+# without halting or reaching an undefined transition, and the tables searched here never
+# use 'b'. Returns (step, period) for the first cycle found, or None.
+def findTranslatedCycle(machine, steps):
+    nextStates = machine.compiledNextStates
+    writeValues = machine.compiledWriteSymbols
+    moveDeltas = machine.compiledMoveDeltas
+    margin = steps + TRANSLATED_CYCLE_WINDOW
+    tape = bytearray(2 * margin + 1)
+    head = margin
+    state = 0
+
+    # The head position before each step, the furthest cell reached at each end, and for
+    # each end the (state, step, edge, cells behind the edge) each time it was reached.
+    heads = []
+    edges = {1: head, -1: head}
+    records = {1: [], -1: []}
+    for step in range(steps):
+        heads.append(head)
+        index = state + tape[head]
+        tape[head] = writeValues[index]
+        delta = moveDeltas[index]
+        head += delta
+        state = nextStates[index]
+        if (head - edges[delta]) * delta <= 0:
+            continue
+        edges[delta] = head
+        if delta > 0:
+            behind = tape[head-TRANSLATED_CYCLE_WINDOW:head][::-1]
+        else:
+            behind = tape[head+1:head+1+TRANSLATED_CYCLE_WINDOW]
+
+        # Walk back through the earlier times, keeping track of how far back the head has
+        # been since each one.
+        extreme = min if delta > 0 else max
+        furthest = head
+        since = step + 1
+        for lastState, lastStep, lastEdge, lastBehind in reversed(records[delta]):
+            furthest = extreme(furthest, extreme(heads[lastStep:since]))
+            since = lastStep
+            if lastState != state:
+                continue
+            reach = (lastEdge - furthest) * delta
+            if reach <= TRANSLATED_CYCLE_WINDOW and behind[:reach] == lastBehind[:reach]:
+                return step + 1, step + 1 - lastStep
+        records[delta].append((state, step + 1, head, behind))
+        del records[delta][:-TRANSLATED_CYCLE_RECORDS]
+    return None
+
+# Count the 1s on the tape.
+def countOnes(machine):
+    return machine.tape.counts[1]
+
+# Run the state table passed. Returns a list of child state tables if it reaches an
+# undefined transition, plus a list of the results for any machines that are finished.
+def expand(table, states, symbols, maxSteps):
+    machine, result = simulate(table, maxSteps)
+    if result == 'L':
+        return [], [{'result': 'limit', 'steps': machine.steps, 'ones': countOnes(machine), 'table': table}]
+    if result == 'C':
+        return [], [{'result': 'cycle', 'steps': machine.cycleStep, 'period': machine.cyclePeriod, 'table': table}]
+    if result == 'H':
+        return [], [{'result': 'halted', 'steps': machine.steps, 'ones': countOnes(machine), 'table': table}]
+
+    # Find the states and symbols the machine uses so far.
+    usedStates = ['A']
+    usedSymbols = ['0', '1']
+    for transition in table.values():
+        if transition[1] != ' ':
+            if not transition[3] in usedStates and transition[3] != 'H':
+                usedStates.append(transition[3])
+            if not transition[1] in usedSymbols:
+                usedSymbols.append(transition[1])
+    gotos = sorted(usedStates)
+    if len(usedStates) < states:
+        gotos.append(engine.STATE_NAMES[len(usedStates)])
+    writes = sorted(usedSymbols)
+    if len(usedSymbols) < symbols:
+        writes.append(str(len(usedSymbols)))
+
+    state = machine.currentState
+    read = machine.currentTransition[0]
+    key = state + read
+    if machine.steps == 0:
+        # The first move is always to the right, and staying in A would run off along the blank tape.
+        moves = 'R'
+        gotos = [goto for goto in gotos if goto != 'A']
+    else:
+        moves = 'LR'
+
+    children = []
+    for write in writes:
+        for move in moves:
+            for goto in gotos:
+                child = copyTable(table)
+                child[key] = [read, write, move, goto]
+                children.append(child)
+
+    # Halting here always takes one more step. Writing a 1 gives the most ones.
+    child = copyTable(table)
+    child[key] = [read, '1', 'R', 'H']
+    ones = countOnes(machine)
+    if machine.tape[machine.tapeHead] != 1:
+        ones += 1
+    finished = [{'result': 'halted', 'steps': machine.steps + 1, 'ones': ones, 'table': child}]
+    return children, finished
+
+# Search the tree below the state table passed. Called in the worker processes.
+def searchShard(shard, table, states, symbols, maxSteps):
+    results = []
+    stack = [table]
+    while stack:
+        children, finished = expand(stack.pop(), states, symbols, maxSteps)
+        results += finished
+        stack += reversed(children)
+    for result in results:
+        result['shard'] = shard
+    return shard, results
+
+# Expand the top of the tree breadth first until there are enough nodes to share out.
+# Returns the shard state tables and the results found on the way.
+def buildShards(states, symbols, maxSteps, shards):
+    root = engine.TuringMachine().stateTable
+    queue = collections.deque([root])
+    results = []
+    while queue and len(queue) < shards:
+        children, finished = expand(queue.popleft(), states, symbols, maxSteps)
+        results += finished
+        queue += children
+    for result in results:
+        result['shard'] = ROOT_SHARD
+    return list(queue), results
+
+# Load the checkpoint for the output file. Returns the finished shards, or None if there
+# is no checkpoint for these options.
+def loadCheckpoint(checkpointName, options):
+    if not os.path.exists(checkpointName):
+        return None
+    f = open(checkpointName, "r")
+    checkpoint = json.load(f)
+    f.close()
+    if checkpoint['options'] != options:
+        raise ValueError('Checkpoint ' + checkpointName + ' was made with different options.')
+    return set(checkpoint['done'])
+
+# Record the finished shards. The file is replaced in one go so it is never half written.
+def saveCheckpoint(checkpointName, options, done):
+    f = open(checkpointName + '.tmp', "w")
+    json.dump({'options': options, 'done': sorted(done)}, f)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(checkpointName + '.tmp', checkpointName)
+
+# Drop any results from shards that were not finished when the search stopped.
+def trimResults(outputName, done):
+    f = open(outputName, "r")
+    lines = [line for line in f if line.strip() and json.loads(line)['shard'] in done]
+    f.close()
+    f = open(outputName, "w")
+    f.writelines(lines)
+    f.close()
+
+# Write the results for a shard and flush them to disk.
+def writeResults(output, results):
+    for result in results:
+        output.write(json.dumps(result) + '\n')
+    output.flush()
+    os.fsync(output.fileno())
+
+# Summarise the results in the output file.
+def summarise(outputName):
+    summary = {'halted': 0, 'cycle': 0, 'limit': 0, 'maxSteps': 0, 'maxOnes': 0}
+    f = open(outputName, "r")
+    for line in f:
+        result = json.loads(line)
+        summary[result['result']] += 1
+        if result['result'] == 'halted':
+            summary['maxSteps'] = max(summary['maxSteps'], result['steps'])
+            summary['maxOnes'] = max(summary['maxOnes'], result['ones'])
+    f.close()
+    return summary
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Enumerate TMD-2 machines for busy beaver searches.')
+    parser.add_argument('--states', type=int, required=True, help='number of states (1-6)')
+    parser.add_argument('--symbols', type=int, default=2, help='number of symbols (2-6)')
+    parser.add_argument('--max-steps', type=int, default=MAX_STEPS, help='step limit before a machine is treated as non halting')
+    parser.add_argument('--shards', type=int, default=SHARDS, help='number of shards to split the search into')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--output', required=True, help='JSON lines file for the results')
+    parser.add_argument('--restart', action='store_true', help='ignore any checkpoint and start again')
+    options = parser.parse_args(arguments)
+    if not 1 <= options.states <= len(engine.STATE_NAMES):
+        parser.error('--states must be between 1 and 6')
+    if not 2 <= options.symbols <= 6:
+        parser.error('--symbols must be between 2 and 6')
+
+    # Everything that changes the shards has to match to resume from a checkpoint.
+    searchOptions = {'states': options.states, 'symbols': options.symbols,
+                     'maxSteps': options.max_steps, 'shards': options.shards}
+    checkpointName = options.output + '.checkpoint'
+    done = None
+    if not options.restart:
+        try:
+            done = loadCheckpoint(checkpointName, searchOptions)
+        except ValueError as ex:
+            parser.error(str(ex) + ' Use --restart to start again.')
+    if done != None and not os.path.exists(options.output):
+        # The results from the finished shards have gone, so they have to be searched again.
+        done = None
+    if done == None:
+        done = set()
+        open(options.output, "w").close()
+    else:
+        trimResults(options.output, done)
+
+    shards, rootResults = buildShards(options.states, options.symbols, options.max_steps, options.shards)
+    output = open(options.output, "a")
+    if not ROOT_SHARD in done:
+        writeResults(output, rootResults)
+        done.add(ROOT_SHARD)
+        saveCheckpoint(checkpointName, searchOptions, done)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options.workers) as executor:
+        futures = [executor.submit(searchShard, shard, table, options.states, options.symbols, options.max_steps)
+                   for shard, table in enumerate(shards) if not shard in done]
+        for future in concurrent.futures.as_completed(futures):
+            shard, results = future.result()
+            writeResults(output, results)
+            done.add(shard)
+            saveCheckpoint(checkpointName, searchOptions, done)
+    output.close()
+
+    print(json.dumps(summarise(options.output)))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,32 @@
+import array
+import functools
+import math
+import os
+import re
+import threading
+import time
 import pygame
 import virtualKeyboard
+import engine
+import glyphs
+import scheduler
 
+# The camera and OCR modules are only imported when SCAN is first pressed, as importing
+# them starts up the camera.
 hasCamera = False
 
-if hasCamera:
-    import camera
-    import ocr
+# The tape minimap is drawn with NumPy. It is left out if NumPy is not installed.
+try:
+    import numpy
+    import pygame.surfarray
+    hasNumpy = True
+except ImportError:
+    hasNumpy = False
 
 # Initialize the PyGame environment.
 pygame.init()
 
-#Set a periodic timer for demo mode.
+#Set a periodic timer for demo mode. setDemoRate changes it to suit the demo speed.
 TIMEREVENT = pygame.USEREVENT+1
 pygame.time.set_timer(TIMEREVENT, 1000)
 pygame.key.set_repeat(1,300)
@@ -31,6 +47,69 @@ gotoSymbols = ['A', 'B', 'C', 'D', 'E', 'F', 'H', ' ']
 # If true state machine will run without stopping, otherwise state machine will run one step at a time.
 runState = 'STEP'
 
+# If true RUN mode stops when the machine is found to be repeating itself.
+detectCycles = True
+
+# RUN mode runs the engine on a background thread. The main loop shows the tape, state and
+# step count as it goes, RUN_FRAME_RATE times a second, and finishes the run off once the
+# thread stops. Setting runHalt asks the engine to stop at its next poll.
+RUN_FRAME_RATE = 10
+runThread = None
+runHalt = threading.Event()
+runResult = None
+runShownState = None
+
+# DEMO mode speed in phases (READ, WRITE, MOVE and GOTO) a second, from DEMO_MIN_RATE to
+# DEMO_MAX_RATE. Up to DEMO_PHASE_RATE each phase is shown on the timer. Above it the
+# phases are collapsed into whole steps, which are run with the engine at the start of each
+# frame, so the speed holds up however long the frames take to draw. DEMO_MAX_FRAME_TIME
+# limits how far the steps catch up after a pause.
+DEMO_MIN_RATE = 0.25
+DEMO_MAX_RATE = 40000
+DEMO_PHASE_RATE = 8
+DEMO_MAX_FRAME_TIME = 0.25
+demoRate = 1
+demoTime = 0
+demoCarry = 0
+
+# The state and column of the transition shown for whole steps, or None.
+demoShown = None
+
+# Set while the demo speed slider is being dragged.
+demoSliderDrag = False
+
+# The demo speed slider: the track and the space to the right of it for the speed.
+DEMO_SLIDER_WIDTH = 110
+DEMO_SLIDER_HEIGHT = 16
+DEMO_SLIDER_KNOB_RADIUS = 7
+DEMO_SPEED_WIDTH = 100
+
+# If true the tape slides from cell to cell rather than jumping.
+animateTape = True
+
+# The tape strip, the tape position of its first cell and the symbol drawn in each of its
+# cells (None if the cell has not been drawn).
+tapeStrip = None
+tapeStripFirst = 0
+tapeStripSymbols = []
+
+# How far in pixels the tape is drawn to the right of where the tape head puts it, how fast
+# it is moving after being flicked in pixels a second and when it was last moved. tapeDrag
+# holds the state of a press on the tape while the pointer is down.
+tapeOffset = 0
+tapeVelocity = 0
+lastTapeFrame = 0
+tapeDrag = None
+
+# The tape position of the first minimap column, the number of cells in each column and
+# the range of cells and tape version it was last drawn for.
+minimapStart = 0
+minimapScale = 1
+minimapKey = None
+
+# The tape version and used cells the minimap last looked at, as (version, start, cells).
+minimapCells = None
+
 # Set to True if the play button was pressed.
 playPressed = False
 stateMachineRunning = False
@@ -38,27 +117,27 @@ stateMachineRunning = False
 # Set to true when a step has been setup and is waiting for the play button to be pressed.
 stepReady = False
 
-# Start of state machine running code.
-currentState ='A'
-currentStep = 'READ'
-
-# The current transition being processed.
-currentTransition = None
-
-# Clock required by GUI manager.
-clock = pygame.time.Clock()
-
 # Only process mouse over events if the pointer has actually moved.
 lastMousePosition = (0, 0)
 
-# Keep track of the tape movement direction for the last transition.
-lastMoveDirection = ' '
-
 # Last file name loaded or saved.
 lastFilename = ''
 
-# Dictionary to hold the finite state table.
-stateTable = {}
+# The step count and conditions to stop a run at, as last entered.
+breakText = ''
+
+# Forms of the conditions that can be entered, e.g. 'ones >= 100'. With no comparison
+# the value has to reach the number given.
+BREAK_CONDITION = re.compile(r'\s*(step|head|ones|sigma)\s*(>=|<=|==|=|>|<)?\s*(-?\d+)\s*$')
+
+# Seconds a state table column has to be held down to set or clear a breakpoint on it.
+LONG_PRESS_TIME = 0.6
+
+# The state table cell being held down, waiting to see if it is a long press.
+panelPress = None
+
+# The tape, state transition table and running state of the machine.
+machine = engine.TuringMachine()
 
 # Remember where the individual state panel pieces (A, B, C, D, E, F) have been drawn.
 statePanelOffsets = {}
@@ -66,11 +145,6 @@ statePanelOffsets = {}
 # Remember where all of the panel labels have been drawn.
 panelLabelPositions = {}
 
-# Tape values will be stored here.
-TAPE_NUMBER_CELLS = 100000
-tape = bytearray(TAPE_NUMBER_CELLS)
-tapeHead  = int(TAPE_NUMBER_CELLS / 2) # The read/write position on the tape
-
 # Color constants.
 BLACK = 0, 0, 0
 GREY = 128, 128, 128
@@ -87,6 +161,9 @@ screen = pygame.display.set_mode(SCREEN_SIZE, SCREEN_ATTRIBUTES)
 pygame.display.set_caption('TMD-2')
 screen.fill(WHITE)
 
+# Areas of the screen that have been drawn on since the display was last updated.
+dirtyRects = []
+
 # Tape constants.
 TAPE_START_X = 70
 TAPE_START_Y = 70
@@ -101,6 +178,46 @@ TAPE_CELL_HEIGHT = 90
 TAPE_CELL_FONT_SIZE = 70
 TAPE_CELL_NUMBER_FONT_SIZE = 20
 
+# Number of rendered cell numbers and whole tape cells kept for reuse. Enough for every
+# symbol in the cells on the screen and either side of them, without growing as the tape
+# is run along.
+CELL_NUMBER_CACHE_SIZE = 256
+CELL_CACHE_SIZE = 256
+
+# The tape is drawn on an off screen strip holding TAPE_STRIP_MARGIN cells either side of
+# the ones showing. Moving the tape is then one blit from the strip, plus drawing any cells
+# that have come into view or changed.
+TAPE_STRIP_MARGIN = TAPE_CELLS
+TAPE_STRIP_CELLS = TAPE_CELLS + 2 * TAPE_STRIP_MARGIN
+
+# Tape scrolling. Animations and a tape left to settle cover half the remaining distance
+# every TAPE_SCROLL_HALF_LIFE seconds. A flicked tape keeps TAPE_FRICTION of its speed after
+# a second and stops below TAPE_MIN_VELOCITY pixels a second. The pointer has to move
+# TAPE_DRAG_DISTANCE pixels before a press on the tape becomes a drag.
+TAPE_SCROLL_HALF_LIFE = 0.04
+TAPE_FRICTION = 0.05
+TAPE_MIN_VELOCITY = 60
+TAPE_DRAG_DISTANCE = 8
+
+# The minimap under the tape shows all of the used tape, one pixel column per cell or per
+# group of cells, with the cells in the tape window marked.
+MINIMAP_START_X = TAPE_START_X
+MINIMAP_START_Y = TAPE_START_Y + TAPE_HEIGHT + 8
+MINIMAP_WIDTH = TAPE_WIDTH
+MINIMAP_HEIGHT = 14
+
+# Minimap colors for the symbols 0 - 5 and b.
+MINIMAP_COLORS = [WHITE, BLACK, (64, 64, 64), (104, 104, 104), (144, 144, 144), (184, 184, 184), DARK_PURPLE]
+
+# How much of its color a column of mostly blank cells keeps.
+MINIMAP_FADE = 0.3
+
+# Run statistics, shown above the right hand end of the tape.
+STATS_START_X = 450
+STATS_START_Y = 25
+STATS_WIDTH = SCREEN_WIDTH - 30 - STATS_START_X
+STATS_HEIGHT = 20
+
 # Finite state transition table single state constants.
 PANEL_CELL_WIDTH = 20
 PANEL_CELL_HEIGHT = 25
@@ -114,93 +231,118 @@ PANEL_ROWS = 5
 PANEL_CELL_FONT_SIZE = 27
 PANEL_LABEL_FONT_SIZE = 25
 
-# Create a font for the tiny cell numbers.
-cellNumberFont = pygame.font.SysFont('arialbold', TAPE_CELL_NUMBER_FONT_SIZE)
-
-# Cache the tape symbols needed.
-cellFont = pygame.font.SysFont('arial', TAPE_CELL_FONT_SIZE)
-cellSymbols = {
-    0:cellFont.render('0', True, BLACK, WHITE),
-    1:cellFont.render('1', True, BLACK, WHITE),
-    2:cellFont.render('2', True, BLACK, WHITE),
-    3:cellFont.render('3', True, BLACK, WHITE),
-    4:cellFont.render('4', True, BLACK, WHITE),
-    5:cellFont.render('5', True, BLACK, WHITE),
-    6:cellFont.render('b', True, BLACK, WHITE)
+# The file the rendered symbols are kept in between runs.
+GLYPH_CACHE = 'glyphs.cache'
+
+# The images for the buttons.
+BUTTON_IMAGES = ['left_arrow.png', 'left_arrow_light.png', 'right_arrow.png', 'right_arrow_light.png',
+                 'down_arrow.png', 'down_arrow_light.png', 'reset.png', 'reset_light.png',
+                 'halt.png', 'halt_light.png', 'halted.png', 'play.png', 'play_light.png',
+                 'running.png', 'running_light.png', 'radio.png', 'radio_light.png', 'radio_selected.png']
+
+# The tape symbols needed.
+cellSymbolTexts = {
+    0:('0', BLACK, WHITE),
+    1:('1', BLACK, WHITE),
+    2:('2', BLACK, WHITE),
+    3:('3', BLACK, WHITE),
+    4:('4', BLACK, WHITE),
+    5:('5', BLACK, WHITE),
+    6:('b', BLACK, WHITE)
     }
 
-# Cache the panel cell symbols needed.
-panelCellFont = pygame.font.SysFont('arialbold', PANEL_CELL_FONT_SIZE)
-panelCellSymbols = {
-    '0':panelCellFont.render('0', True, BLACK, WHITE),
-    '1':panelCellFont.render('1', True, BLACK, WHITE),
-    '2':panelCellFont.render('2', True, BLACK, WHITE),
-    '3':panelCellFont.render('3', True, BLACK, WHITE),
-    '4':panelCellFont.render('4', True, BLACK, WHITE),
-    '5':panelCellFont.render('5', True, BLACK, WHITE),
-    'b':panelCellFont.render('b', True, BLACK, WHITE),
-    'L':panelCellFont.render('L', True, BLACK, WHITE),
-    'R':panelCellFont.render('R', True, BLACK, WHITE),
-    'A':panelCellFont.render('A', True, BLACK, WHITE),
-    'B':panelCellFont.render('B', True, BLACK, WHITE),
-    'C':panelCellFont.render('C', True, BLACK, WHITE),
-    'D':panelCellFont.render('D', True, BLACK, WHITE),
-    'E':panelCellFont.render('E', True, BLACK, WHITE),
-    'F':panelCellFont.render('F', True, BLACK, WHITE),
-    'H':panelCellFont.render('H', True, BLACK, WHITE),
-    '0_':panelCellFont.render('0', True, PURPLE, WHITE),
-    '1_':panelCellFont.render('1', True, PURPLE, WHITE),
-    '2_':panelCellFont.render('2', True, PURPLE, WHITE),
-    '3_':panelCellFont.render('3', True, PURPLE, WHITE),
-    '4_':panelCellFont.render('4', True, PURPLE, WHITE),
-    '5_':panelCellFont.render('5', True, PURPLE, WHITE),
-    'b_':panelCellFont.render('b', True, PURPLE, WHITE),
-    'L_':panelCellFont.render('L', True, PURPLE, WHITE),
-    'R_':panelCellFont.render('R', True, PURPLE, WHITE),
-    'A_':panelCellFont.render('A', True, PURPLE, WHITE),
-    'B_':panelCellFont.render('B', True, PURPLE, WHITE),
-    'C_':panelCellFont.render('C', True, PURPLE, WHITE),
-    'D_':panelCellFont.render('D', True, PURPLE, WHITE),
-    'E_':panelCellFont.render('E', True, PURPLE, WHITE),
-    'F_':panelCellFont.render('F', True, PURPLE, WHITE),
-    'H_':panelCellFont.render('H', True, PURPLE, WHITE),
-    ' ':panelCellFont.render('   ', True, BLACK, WHITE),
-    ' _':panelCellFont.render('   ', True, BLACK, WHITE),
-    '?':panelCellFont.render('?', True, BLACK, WHITE),
-    '?_':panelCellFont.render('?', True, PURPLE, WHITE)
+# The panel cell symbols needed.
+panelCellSymbolTexts = {
+    '0':('0', BLACK, WHITE),
+    '1':('1', BLACK, WHITE),
+    '2':('2', BLACK, WHITE),
+    '3':('3', BLACK, WHITE),
+    '4':('4', BLACK, WHITE),
+    '5':('5', BLACK, WHITE),
+    'b':('b', BLACK, WHITE),
+    'L':('L', BLACK, WHITE),
+    'R':('R', BLACK, WHITE),
+    'A':('A', BLACK, WHITE),
+    'B':('B', BLACK, WHITE),
+    'C':('C', BLACK, WHITE),
+    'D':('D', BLACK, WHITE),
+    'E':('E', BLACK, WHITE),
+    'F':('F', BLACK, WHITE),
+    'H':('H', BLACK, WHITE),
+    '0_':('0', PURPLE, WHITE),
+    '1_':('1', PURPLE, WHITE),
+    '2_':('2', PURPLE, WHITE),
+    '3_':('3', PURPLE, WHITE),
+    '4_':('4', PURPLE, WHITE),
+    '5_':('5', PURPLE, WHITE),
+    'b_':('b', PURPLE, WHITE),
+    'L_':('L', PURPLE, WHITE),
+    'R_':('R', PURPLE, WHITE),
+    'A_':('A', PURPLE, WHITE),
+    'B_':('B', PURPLE, WHITE),
+    'C_':('C', PURPLE, WHITE),
+    'D_':('D', PURPLE, WHITE),
+    'E_':('E', PURPLE, WHITE),
+    'F_':('F', PURPLE, WHITE),
+    'H_':('H', PURPLE, WHITE),
+    ' ':('   ', BLACK, WHITE),
+    ' _':('   ', BLACK, WHITE),
+    '?':('?', BLACK, WHITE),
+    '?_':('?', PURPLE, WHITE)
     }
 
-# Cache the panel label symbols and positions needed.
-panelLabelFont = pygame.font.SysFont('arialbold', PANEL_LABEL_FONT_SIZE)
-panelLabelSymbols = {
-    'READ':panelLabelFont.render('READ', True, BLACK, WHITE),
-    'WRITE':panelLabelFont.render('WRITE', True, BLACK, WHITE),
-    'MOVE':panelLabelFont.render('MOVE', True, BLACK, WHITE),
-    'GOTO':panelLabelFont.render('GOTO', True, BLACK, WHITE),
-    'STEP':panelLabelFont.render('STEP', True, BLACK, WHITE),
-    'RUN':panelLabelFont.render('RUN', True, BLACK, WHITE),
-    'DEMO':panelLabelFont.render('DEMO', True, BLACK, WHITE),
-    'LOAD':panelLabelFont.render('LOAD', True, DARK_PURPLE, WHITE),
-    'SAVE':panelLabelFont.render('SAVE', True, DARK_PURPLE, WHITE),
-    'SCAN':panelLabelFont.render('SCAN', True, DARK_PURPLE, WHITE),
-    'EXIT':panelLabelFont.render('X', True, DARK_PURPLE, WHITE),
-    'READ_':panelLabelFont.render('READ', True, PURPLE, WHITE),
-    'WRITE_':panelLabelFont.render('WRITE', True, PURPLE, WHITE),
-    'MOVE_':panelLabelFont.render('MOVE', True, PURPLE, WHITE),
-    'GOTO_':panelLabelFont.render('GOTO', True, PURPLE, WHITE),
-    'STEP_':panelLabelFont.render('STEP', True, PURPLE, WHITE),
-    'RUN_':panelLabelFont.render('RUN', True, PURPLE, WHITE),
-    'DEMO_':panelLabelFont.render('DEMO', True, PURPLE, WHITE),
-    'LOAD_':panelLabelFont.render('LOAD', True, PURPLE, WHITE),
-    'SAVE_':panelLabelFont.render('SAVE', True, PURPLE, WHITE),
-    'SCAN_':panelLabelFont.render('SCAN', True, PURPLE, WHITE),
-    'EXIT_':panelLabelFont.render('X', True, PURPLE, WHITE)
+# The panel label symbols needed.
+panelLabelSymbolTexts = {
+    'READ':('READ', BLACK, WHITE),
+    'WRITE':('WRITE', BLACK, WHITE),
+    'MOVE':('MOVE', BLACK, WHITE),
+    'GOTO':('GOTO', BLACK, WHITE),
+    'STEP':('STEP', BLACK, WHITE),
+    'RUN':('RUN', BLACK, WHITE),
+    'DEMO':('DEMO', BLACK, WHITE),
+    'LOAD':('LOAD', DARK_PURPLE, WHITE),
+    'SAVE':('SAVE', DARK_PURPLE, WHITE),
+    'SCAN':('SCAN', DARK_PURPLE, WHITE),
+    'EXIT':('X', DARK_PURPLE, WHITE),
+    'BREAK':('BREAK', DARK_PURPLE, WHITE),
+    'READ_':('READ', PURPLE, WHITE),
+    'WRITE_':('WRITE', PURPLE, WHITE),
+    'MOVE_':('MOVE', PURPLE, WHITE),
+    'GOTO_':('GOTO', PURPLE, WHITE),
+    'STEP_':('STEP', PURPLE, WHITE),
+    'RUN_':('RUN', PURPLE, WHITE),
+    'DEMO_':('DEMO', PURPLE, WHITE),
+    'LOAD_':('LOAD', PURPLE, WHITE),
+    'SAVE_':('SAVE', PURPLE, WHITE),
+    'SCAN_':('SCAN', PURPLE, WHITE),
+    'EXIT_':('X', PURPLE, WHITE),
+    'BREAK_':('BREAK', PURPLE, WHITE)
     }
+
+# Render the symbols, or load them from the glyph cache if they are there.
+symbols = glyphs.loadSymbols(GLYPH_CACHE, {
+    'cell': ('arial', TAPE_CELL_FONT_SIZE, cellSymbolTexts),
+    'panelCell': ('arialbold', PANEL_CELL_FONT_SIZE, panelCellSymbolTexts),
+    'panelLabel': ('arialbold', PANEL_LABEL_FONT_SIZE, panelLabelSymbolTexts),
+    })
+cellSymbols = symbols['cell']
+panelCellSymbols = symbols['panelCell']
+panelLabelSymbols = symbols['panelLabel']
+
+# Return the font for the tiny cell numbers and the stats.
+def getCellNumberFont():
+    return glyphs.getFont('arialbold', TAPE_CELL_NUMBER_FONT_SIZE)
+
+# Return the font for the panel labels and dialogs.
+def getPanelLabelFont():
+    return glyphs.getFont('arialbold', PANEL_LABEL_FONT_SIZE)
+
 ##### Function and classes.
 # Implement a generic dialog box.
 class Dialog(pygame.sprite.Sprite):
     
-    def __init__(self, screen, title, message, buttonLabels, font, textBox):
+    # The text box starts with the text passed, or the last file name if there is none.
+    def __init__(self, screen, title, message, buttonLabels, font, textBox, text=None):
         super(Dialog, self).__init__()
         self.screen = screen
         self.title = title
@@ -208,15 +350,16 @@ class Dialog(pygame.sprite.Sprite):
         self.buttonLabels = buttonLabels
         self.font = font
         self.textBox = textBox
+        self.startText = text
         self.cursor = self.font.render('_    ', True, DARK_PURPLE, WHITE)
         self.textBoxRect = None
         
     def update(self):
         if self.textBox:
             showText = self.font.render(self.text, True, BLACK, WHITE)
-            self.screen.blit(showText, (self.panelX+self.textX, self.panelY + self.textY))
-            self.screen.blit(self.cursor, (self.panelX+self.textX+showText.get_width(), self.panelY + self.textY))
-            pygame.display.flip()
+            markDirty(self.screen.blit(showText, (self.panelX+self.textX, self.panelY + self.textY)))
+            markDirty(self.screen.blit(self.cursor, (self.panelX+self.textX+showText.get_width(), self.panelY + self.textY)))
+            updateScreen()
         
     def run(self):
         global lastFilename
@@ -262,7 +405,10 @@ class Dialog(pygame.sprite.Sprite):
             textY = int(panelHeight/2)
             pygame.draw.rect(self.panel, PURPLE, (textX, textY, textWidth, textHeight), 2)
             self.textBoxRect = pygame.Rect(textX+self.panelX, textY+self.panelY, textWidth, textHeight)
-            self.text=lastFilename
+            if self.startText == None:
+                self.text=lastFilename
+            else:
+                self.text=self.startText
             self.textX = textX + 10
             self.textY = textY + 5 
             self.update()          
@@ -285,6 +431,13 @@ class Dialog(pygame.sprite.Sprite):
             button['rect'] = pygame.Rect(self.panelX + startX, self.panelY + startY, 
                                   image.get_width(), image.get_height())
         
+        # Only the dialog responds to the mouse while it is showing.
+        hitMap = createHitMap()
+        if self.textBox:
+            addHitTarget(hitMap, ('textbox',), self.textBoxRect)
+        for button in dialogButtons:
+            addHitButton(hitMap, button)
+        
         # Show the dialog box on the main screen
         self.screen.blit(self.panel, (self.panelX, self.panelY))
         
@@ -295,33 +448,35 @@ class Dialog(pygame.sprite.Sprite):
         # Update the sprite variables.
         self.surf = self.panel
         self.rect = self.surf.get_rect()
-        pygame.display.flip()
+        markDirty(self.screen.get_rect())
+        updateScreen()
         
         # Handle events till mouse is clicked pressed.
         done = False
         buttonClicked = None
         while not done:
             # Check the event queue. 
-            for event in pygame.event.get():
+            for event in scheduler.getEvents():
                 if event.type == pygame.MOUSEBUTTONDOWN:
-                    if self.textBox != None:
-                        if self.textBoxRect.collidepoint(event.pos):
-                            vkeybd = virtualKeyboard.VirtualKeyboard(screen)
-                            result = vkeybd.run(self.text)
-                            if result != None:
-                                self.text = result
-                                self.update()
-                    for button in dialogButtons:
-                        if buttonOnClick(button, event):
-                            buttonClicked = button['name']
-                            if self.textBox:
-                                lastFilename = self.text
-                            done = True
-                            break # Break out of for loop.
+                    target = getHitTarget(hitMap, event.pos)
+                    if target == None:
+                        continue
+                    if target[0] == 'textbox':
+                        vkeybd = virtualKeyboard.VirtualKeyboard(screen)
+                        result = vkeybd.run(self.text)
+                        if result != None:
+                            self.text = result
+                            self.update()
+                    elif buttonOnClick(target[1], event):
+                        buttonClicked = target[1]['name']
+                        if self.textBox and self.startText == None:
+                            lastFilename = self.text
+                        done = True
+                        break # Break out of for loop.
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_RETURN:
                         buttonClicked = dialogButtons[0]['name']
-                        if self.textBox:
+                        if self.textBox and self.startText == None:
                             lastFilename = self.text
                         done = True
                         break
@@ -337,17 +492,29 @@ class Dialog(pygame.sprite.Sprite):
                             if len(self.text) < 35:
                                 self.text += event.unicode
                     self.update()
-            if checkForMouseovers(dialogButtons):
-                pygame.display.flip()
+            if checkForMouseovers(hitMap, dialogButtons):
+                updateScreen()
             
         self.kill()
-        self.screen.blit(saveScreen, (0,0))
+        markDirty(self.screen.blit(saveScreen, (0,0)))
         
         if self.textBox:
             return buttonClicked,self.text.strip()
         else:
             return buttonClicked
         
+# Remember that the area of the screen passed has been drawn on. Returns the area so that
+# it can wrap a blit.
+def markDirty(rect):
+    dirtyRects.append(rect)
+    return rect
+
+# Show the areas of the screen that have been drawn on since the last update.
+def updateScreen():
+    if dirtyRects:
+        pygame.display.update(dirtyRects)
+        del dirtyRects[:]
+
 # Used to setup the screen controls.
 def createButton(name, button, image, imageLight, position, callback):
     button["name"] = name
@@ -357,121 +524,165 @@ def createButton(name, button, image, imageLight, position, callback):
     button["callback"] = callback
     button["highlighted"] = False
 
+# Create an empty hit test map for the screen. Every pixel holds the number of the target
+# drawn there, so whatever is under the pointer is found with a single lookup. The buttons
+# that have been highlighted on the screen are kept with it, so that they can be put back
+# to normal once the pointer moves.
+def createHitMap():
+    return {'pixels': array.array('H', bytes(2 * SCREEN_WIDTH * SCREEN_HEIGHT)), 'targets': [None], 'highlighted': []}
+
+# Add a target to the hit map covering the area passed. If an image is passed, the pixels
+# that show up white when it is drawn are left out, so that only the shape itself is hit.
+def addHitTarget(hitMap, target, rect, image=None):
+    pixels = hitMap['pixels']
+    hitMap['targets'].append(target)
+    number = len(hitMap['targets']) - 1
+    area = rect.clip(screen.get_rect())
+    if image == None:
+        row = array.array('H', [number]) * area.width
+        for y in range(area.top, area.bottom):
+            pixels[y * SCREEN_WIDTH + area.left:y * SCREEN_WIDTH + area.right] = row
+        return
+    drawn = pygame.Surface(rect.size)
+    drawn.fill(WHITE)
+    drawn.blit(image, (0, 0))
+    for y in range(area.top, area.bottom):
+        for x in range(area.left, area.right):
+            if drawn.get_at((x - rect.left, y - rect.top))[:3] != WHITE:
+                pixels[y * SCREEN_WIDTH + x] = number
+
+# Add a button to the hit map. The arrow buttons only respond on the arrow itself.
+def addHitButton(hitMap, button):
+    if button['name'] == 'left' or button['name'] == 'right' or button['name'] == 'down':
+        addHitTarget(hitMap, ('button', button), button['rect'], button['image'])
+    else:
+        addHitTarget(hitMap, ('button', button), button['rect'])
+
+# Return the target at the screen position passed, or None.
+def getHitTarget(hitMap, position):
+    x, y = position
+    if x < 0 or y < 0 or x >= SCREEN_WIDTH or y >= SCREEN_HEIGHT:
+        return None
+    return hitMap['targets'][hitMap['pixels'][y * SCREEN_WIDTH + x]]
+
 # When a button is clicked redirects to the buttons callback function.
 def buttonOnClick(button, event):
     if event.button == 1:
-        if button["rect"].collidepoint(event.pos):
-            # Make sure we are actually on the button.
-            pixel = screen.get_at(event.pos)
-            if pixel == (255,255,255,255)  and (button['name'] == 'left' or button['name'] == 'right' or button['name'] == 'down'):
-                return False
-            if button["callback"] != None:
-                button["callback"](button)
-            else:
-                return True
+        if button["callback"] != None:
+            button["callback"](button)
+        else:
+            return True
     return False
     
-# Highlight buttons when the mouse is over them.   
-def checkForMouseovers(buttons):
+# Highlight the button the mouse is over. Only the buttons passed respond.
+def checkForMouseovers(hitMap, buttons):
     global lastMousePosition
     changed = False
     # Check for mouse over button.
     pointer = pygame.mouse.get_pos() # (x, y) location of pointer in every frame.
     if pointer != lastMousePosition:
         lastMousePosition = pointer
-        for button in buttons:
-            pixel = screen.get_at(pointer)
-            
-            # Lock out the tape buttons when running a program.
-            if stateMachineRunning and (button['name'] == 'left' or button['name'] == 'right' or button['name'] == 'down'):
-                continue
-            
-            # If pointer is inside the button rectangle and is not white or black...
-            if button['rect'].collidepoint(pointer):
-                # Check the arrow keys for white space.
-                if pixel == (255,255,255,255)  and (button['name'] == 'left' or button['name'] == 'right' or button['name'] == 'down'):
-                    if button['highlighted'] == True:
-                        showButton(button)
-                        changed = True
-                else:
-                    if button['highlighted'] == False:
-                        showButton(button, True)
-                        changed = True
-            else:
-                if button['highlighted'] == True:
-                    showButton(button)
-                    changed = True
+        target = getHitTarget(hitMap, pointer)
+        button = None
+        if target != None and target[0] == 'button' and target[1] in buttons:
+            button = target[1]
+        
+        # Lock out the tape buttons when running a program.
+        highlighted = []
+        for lastButton in hitMap['highlighted']:
+            if lastButton is button or isTapeButtonLocked(lastButton):
+                highlighted.append(lastButton)
+            elif lastButton['highlighted'] == True:
+                showButton(lastButton)
+                changed = True
+        if button != None and not isTapeButtonLocked(button):
+            if button['highlighted'] == False:
+                showButton(button, True)
+                changed = True
+            if not any(lastButton is button for lastButton in highlighted):
+                highlighted.append(button)
+        hitMap['highlighted'] = highlighted
     return changed
 
+# Highlight a button on the screen from code. Like a mouse over highlight it is taken off
+# when the pointer next moves.
+def highlightButton(button):
+    showButton(button, True)
+    if not any(lastButton is button for lastButton in screenHitMap['highlighted']):
+        screenHitMap['highlighted'].append(button)
+
+# The tape buttons do not respond while a program is running.
+def isTapeButtonLocked(button):
+    return stateMachineRunning and (button['name'] == 'left' or button['name'] == 'right' or button['name'] == 'down')
+
 # Handle the left button mouse press.
 def pushButtonLeft(_):
-    global tapeHead
-    if tapeHead < TAPE_NUMBER_CELLS - int(TAPE_CELLS/2) - 1:
-        tapeHead += 1
-        drawTape()
+    machine.tapeHead += 1
+    showTapeMove(1)
 
 # Handle the right button mouse press. 
 def pushButtonRight(_):
-    global tapeHead
-    if tapeHead > int(TAPE_CELLS/2) + 1:
-        tapeHead -= 1
-        drawTape()
+    machine.tapeHead -= 1
+    showTapeMove(-1)
 
 # Handle the down button mouse press.
 def pushButtonDown(_):
-    tape[tapeHead] = (tape[tapeHead] + 1) % 7;
-    drawTapeCell(tapeHead, int(TAPE_CELLS/2))
+    machine.tape[machine.tapeHead] = (machine.tape[machine.tapeHead] + 1) % 7;
+    drawTape()
 
 # Handle the reset button mouse press.    
 def pushButtonReset(_):
     # Clear the tape.
     resetRuntime(True)
     setStartingMode()
-    pygame.display.flip()
+    updateScreen()
     
     # Check before clearing the state transition table.
-    dialog = Dialog(screen, 'Warning', 'Are you sure that you want to clear the State Transition Table?', ['YES','NO'], panelLabelFont, False)
+    dialog = Dialog(screen, 'Warning', 'Are you sure that you want to clear the State Transition Table?', ['YES','NO'], getPanelLabelFont(), False)
     answer = dialog.run()
 
     # Clear the events queue.
     if answer == 'YES':
-        clearStateTable()
+        machine.clearStateTable()
+        machine.breakpoints.clear()
     redrawStateTable() 
 
 # Set the state machine to it's initial position (A-READ) but not running. 
 # Optionally clear the tape to blanks (0) and center the tape head.   
 def resetRuntime(resetTape = False):
     if resetTape:
-        clearTape()
+        machine.clearTape()
+        stopTape()
         drawTape()
     resetPanelLabels()
     resetState('A', 'READ')
+    drawStats()
 
 # Set the running state.
 def resetState(state, step):
-    global currentState 
-    global currentStep
     global stepReady
     global playPressed
     global stateMachineRunning
-    currentState = state
-    currentStep = step
+    machine.resetState(state, step)
     stepReady = False
     playPressed = False
     stateMachineRunning = False
 
 # Make sure that all of the panel labels for the state passed are not highlighted.
 def resetPanelLabels():
-    global currentState 
-    drawPanelState(currentState)
-    drawPanelLabel(currentState, 'READ')
-    drawPanelLabel(currentState, 'WRITE')
-    drawPanelLabel(currentState, 'MOVE')
-    drawPanelLabel(currentState, 'GOTO')
+    drawPanelState(machine.currentState)
+    drawPanelLabel(machine.currentState, 'READ')
+    drawPanelLabel(machine.currentState, 'WRITE')
+    drawPanelLabel(machine.currentState, 'MOVE')
+    drawPanelLabel(machine.currentState, 'GOTO')
 
 # Handle the halt button mouse press.
 def pushButtonHalt(_):
-    haltStateMachine()
+    # A background run stops at its next poll and is finished off by the main loop.
+    if runThread != None:
+        runHalt.set()
+    else:
+        haltStateMachine()
 
 # Switch the play button to green (running) and the halt button to normal.
 def setRunningMode():
@@ -481,7 +692,7 @@ def setRunningMode():
     else:   
         playButton['image'] = highlightRunningImage
     playButton['imageLight'] = highlightRunningImage
-    showButton(playButton, True)
+    highlightButton(playButton)
     
     # Make sure that the halt button is set to normal mode.
     haltButton['image'] = haltImage
@@ -510,6 +721,14 @@ def pushButtonPlay(_):
     global stateMachineRunning
     
     if stateMachineRunning == False:
+        # Parse the state table once up front rather than on every step.
+        try:
+            machine.compileStateTable()
+        except ValueError as ex:
+            dialog = Dialog(screen, 'Error', str(ex), ['OK'], getPanelLabelFont(), False)
+            dialog.run()
+            return
+        
         # Play highlighted, halt normal. 
         setRunningMode()
         # Start the state machine running.
@@ -520,44 +739,43 @@ def pushButtonPlay(_):
 # Pop up a dialog with the error message from the exception passed.    
 def showErrorMessage(ex):
     msg = str(ex)
-    index = msg.index(']')+1
-    msg = msg[index:len(msg)]
-    dialog = Dialog(screen, 'Error', msg, ['OK'], panelLabelFont, False)
+    # Drop the "[Errno n]" from the start of system errors.
+    if msg.startswith('[Errno') and ']' in msg:
+        msg = msg[msg.index(']')+1:].strip()
+    dialog = Dialog(screen, 'Error', msg, ['OK'], getPanelLabelFont(), False)
     dialog.run()  
 
 # Handle the load label button mouse press.
 def pushButtonLoad(_):
-    global stateTable
-    global tape
-    global tapeHead
-    global currentState
-    global currentStep
-    global currentTransition
-    
-    dialog = Dialog(screen, 'Load', 'Enter the name of the file to load from then press OK.', ['OK', 'CANCEL'], panelLabelFont, True)
+    dialog = Dialog(screen, 'Load', 'Enter the name of the file to load from then press OK.', ['OK', 'CANCEL'], getPanelLabelFont(), True)
     buttonPressed,filename = dialog.run()
     
     if buttonPressed == 'OK' and filename != None:
         try:
-            f = open(filename+'.tmd2',"r")
-            saveText = f.read()
-            f.close()
-            save = eval(saveText)
-            compressed = save['tape']
-            decodeTape(compressed)
-            stateTable = save['table']
-            tapeHead = save['tapehead']
-            state = save['state']
-            step = save['step']
-            currentTransition = save['transition']
+            # Prefer the binary format, but older text saves still load.
+            if os.path.exists(filename+engine.BINARY_EXTENSION):
+                machine.loadFile(filename+engine.BINARY_EXTENSION)
+            else:
+                machine.loadFile(filename+'.tmd2')
+            state = machine.currentState
+            step = machine.currentStep
+            steps = machine.steps
+            elapsed = machine.elapsed
             
+            stopTape()
             drawTape()
+            machine.breakpoints.clear()
             redrawStateTable()
             showButton(loadButton)
             
             resetPanelLabels()
             resetState(state, step)
-            if currentTransition !=  None:
+            
+            # Carry on counting from the saved run.
+            machine.steps = steps
+            machine.elapsed = elapsed
+            drawStats()
+            if machine.currentTransition !=  None:
                 drawPanelState(state, True)
                 drawPanelLabel(state, step, True)
             
@@ -568,93 +786,24 @@ def pushButtonLoad(_):
             # Clear the events queue.
             pygame.event.clear()
 
-# Create a text file with the current tape and state machine information.          
-def dumpWorkspace():
-    global tape
-    global stateTable
-    
-    # Build the output string here.
-    workspace = ""
-    
-    # Find the position of the first non zero symbol on the tape.
-    for start in range(0, TAPE_NUMBER_CELLS-1):
-        if tape[start] != 0:
-            break
-    # Find the position of the last non zero symbol on the tape.
-    for end in range(TAPE_NUMBER_CELLS-1, 0, -1):
-        if tape[end] != 0:
-            break
-        
-    # Show the range of non blank (zero) cells.   
-    workspace += "Showing tape from cell {0} to cell {1}.\n".format(start-int(TAPE_NUMBER_CELLS/2), end-int(TAPE_NUMBER_CELLS/2))
-    for pos in range(0, len(workspace)-1):
-        workspace += '~'
-    workspace += '\n'
-    # Show the tape and count the number of each symbol.
-    counts = {}
-    counts['0'] = 0
-    counts['1'] = 0
-    counts['2'] = 0
-    counts['3'] = 0
-    counts['4'] = 0
-    counts['5'] = 0
-    counts['6'] = 0
-    
-    for pos in range(start, end+1):
-        counts[str(tape[pos])] += 1
-        if tape[pos] == 6:
-            workspace += "| b "
-        else:
-            workspace += "| {0} ".format(str(tape[pos]))
-    workspace += "|\n\nCounts\n~~~~~~\n"
-    
-    for key, value in counts.items():
-        if key == '6':
-            key = 'b'
-        workspace += key + ': ' + str(value) + '\n'
-    
-    workspace += '\nState Transition Table\n~~~~~~~~~~~~~~~~~~~~~~\n'
-    for state in ('A', 'B', 'C', 'D','E','F'):
-        workspace += '            '+state+'\n'
-        for row in range(0, 4):
-            for col in range(0,6):
-                value = stateTable[state+str(col)][row]
-                if value == ' ':
-                    value = '-'
-                workspace += '| ' + value + ' '   
-            workspace += '|\n'
-        workspace += '\n'
-    return workspace
-
 if hasCamera:
     def pushButtonScan(_):
         scanTable()
 
 # Handle the save label button mouse press.
 def pushButtonSave(_):
-    global stateTable
-    dialog = Dialog(screen, 'Save', 'Enter the name of the file to save to then press OK.', ['OK', 'CANCEL'], panelLabelFont, True)
+    dialog = Dialog(screen, 'Save', 'Enter the name of the file to save to then press OK.', ['OK', 'CANCEL'], getPanelLabelFont(), True)
     buttonPressed, filename = dialog.run()
     # Clear the events queue.
     pygame.event.clear()
     if buttonPressed == 'OK' and filename != None:
-        compressed = encodeTape()
         try:
             # Save the raw tape and state transition table.
-            save = {}
-            save['tape'] = compressed
-            save['table'] = stateTable
-            save['tapehead'] = tapeHead
-            save['state'] = currentState
-            save['step'] = currentStep
-            save['transition'] = currentTransition
-            f = open(filename+'.tmd2',"w")
-            f.write( str(save) )
-            f.close()
+            machine.saveFile(filename+engine.BINARY_EXTENSION)
             
             # Save a readable version of the tape and state transition table.
             f = open(filename+'.txt',"w")
-            f.write( dumpWorkspace() )
+            f.write( machine.dumpWorkspace() )
             f.close()
             
             showButton(saveButton)
@@ -662,9 +811,68 @@ def pushButtonSave(_):
         except Exception as ex:
             showErrorMessage(ex)
 
+# Handle the break label button mouse press. Asks for the step count and conditions to stop
+# a run at, separated by commas.
+def pushButtonBreak(_):
+    global breakText
+    dialog = Dialog(screen, 'Break', 'Enter e.g. step 1000, head <= -20, ones >= 50 then press OK.', ['OK', 'CANCEL'], getPanelLabelFont(), True, breakText)
+    buttonPressed, text = dialog.run()
+    # Clear the events queue.
+    pygame.event.clear()
+    if buttonPressed == 'OK':
+        try:
+            setBreakConditions(text)
+            breakText = text
+        except ValueError as ex:
+            dialog = Dialog(screen, 'Error', str(ex), ['OK'], getPanelLabelFont(), False)
+            dialog.run()
+    showButton(breakButton)
+
+# Set the machine to stop at the step count and conditions in the text passed. Blank text
+# clears them.
+def setBreakConditions(text):
+    breakStep = None
+    conditions = []
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        match = BREAK_CONDITION.match(part)
+        if match == None:
+            raise ValueError('Cannot break at ' + part.strip() + '.')
+        name, comparison, number = match.group(1), match.group(2), int(match.group(3))
+        if comparison == None:
+            comparison = '>='
+        elif comparison == '=':
+            comparison = '=='
+        if name == 'step':
+            # The step count only goes up, so a run can only stop as it reaches a number.
+            if comparison == '>':
+                number += 1
+            elif comparison != '>=' and comparison != '==':
+                raise ValueError('Cannot break at ' + part.strip() + ', the step count only goes up.')
+            breakStep = number
+        else:
+            conditions.append((name, comparison, number))
+    machine.breakStep = breakStep
+    machine.breakConditions = conditions
+
 # Handle the exit label button mouse press.
 def pushButtonExit(_):
+    quitConsole()
+
+# Stop any background run and shut down pygame. The run is waited for first so that it
+# cannot wake the screen once pygame has gone. The cached fonts and cell images go with
+# pygame, so that nothing uses them if the console is started again in the same process.
+def quitConsole():
     global done
+    global runThread
+    if runThread != None:
+        runHalt.set()
+        runThread.join()
+        runThread = None
+    getCellImage.cache_clear()
+    getCellNumberImage.cache_clear()
+    glyphs.getFont.cache_clear()
     pygame.quit()
     done = True
 
@@ -730,86 +938,276 @@ def pushButtonDemo(button):
                 showButton(button)
         runState = 'DEMO'
 
-# Draw the symbol from the tape at tapePosition to the screen at cellPosition.
-def drawTapeCell(tapePosition, cellPosition):
-    # Draw the symbol at the tape position passed.
-    symbol = tape[tapePosition]
-    symbolImage = cellSymbols[symbol]
-    screen.blit(symbolImage, 
-                (int((TAPE_START_X + cellPosition * TAPE_CELL_WIDTH) + (TAPE_CELL_WIDTH - symbolImage.get_width())/2), 
-                 int(TAPE_START_Y + (TAPE_CELL_HEIGHT - symbolImage.get_height())/5*4)))
-    # Create a cell number.
+# Render the cell number shown at the top of the tape cell at tapePosition.
+@functools.lru_cache(maxsize=CELL_NUMBER_CACHE_SIZE)
+def getCellNumberImage(tapePosition):
     numberPanel = pygame.Surface((40,12))
     numberPanel.fill(WHITE)
-    numberText = cellNumberFont.render(str(tapePosition-int(TAPE_NUMBER_CELLS/2)), True, BLACK, WHITE)
+    numberText = getCellNumberFont().render(str(tapePosition), True, BLACK, WHITE)
     numberPanel.blit(numberText, (0,0))
-    screen.blit(numberPanel, (TAPE_START_X + cellPosition * TAPE_CELL_WIDTH + 5, TAPE_START_Y + 5))
+    return numberPanel
+
+# Render the symbol and cell number for a tape cell as one image. Returns the image and
+# its position within the cell.
+@functools.lru_cache(maxsize=CELL_CACHE_SIZE)
+def getCellImage(symbol, tapePosition):
+    symbolImage = cellSymbols[symbol]
+    symbolRect = symbolImage.get_rect(topleft=(int(TAPE_START_X + (TAPE_CELL_WIDTH - symbolImage.get_width())/2) - TAPE_START_X, 
+                                               int(TAPE_START_Y + (TAPE_CELL_HEIGHT - symbolImage.get_height())/5*4) - TAPE_START_Y))
+    numberImage = getCellNumberImage(tapePosition)
+    numberRect = numberImage.get_rect(topleft=(5, 5))
+    cellRect = symbolRect.union(numberRect)
+    cellImage = pygame.Surface(cellRect.size)
+    cellImage.fill(WHITE)
+    cellImage.blit(symbolImage, symbolRect.move(-cellRect.x, -cellRect.y))
+    cellImage.blit(numberImage, numberRect.move(-cellRect.x, -cellRect.y))
+    return cellImage, cellRect.topleft
+
+# Draw the tape cell at tapePosition, with its borders, onto the tape strip.
+def drawStripCell(tapePosition):
+    index = tapePosition - tapeStripFirst
+    symbol = machine.tape[tapePosition]
+    cell = tapeStrip.subsurface((index * TAPE_CELL_WIDTH, 0, TAPE_CELL_WIDTH, TAPE_HEIGHT))
+    cell.fill(WHITE)
+    pygame.draw.line(cell, BLACK, (0, 0), (0, TAPE_CELL_HEIGHT), TAPE_BORDER_WIDTH)
+    pygame.draw.line(cell, BLACK, (TAPE_CELL_WIDTH, 0), (TAPE_CELL_WIDTH, TAPE_CELL_HEIGHT), TAPE_BORDER_WIDTH)
+    cellImage, offset = getCellImage(symbol, tapePosition)
+    cell.blit(cellImage, offset)
+    tapeStripSymbols[index] = symbol
+
+# Make sure the tape strip covers the tape positions from first to last, moving it along
+# the tape if it does not. Cells already drawn are scrolled across rather than redrawn.
+def placeTapeStrip(first, last):
+    global tapeStripFirst
+    global tapeStripSymbols
+    if first >= tapeStripFirst and last < tapeStripFirst + TAPE_STRIP_CELLS:
+        return
+    newFirst = (first + last) // 2 - TAPE_STRIP_CELLS // 2
+    shift = newFirst - tapeStripFirst
+    if shift > 0 and shift < TAPE_STRIP_CELLS:
+        tapeStrip.scroll(-shift * TAPE_CELL_WIDTH, 0)
+        tapeStripSymbols = tapeStripSymbols[shift:] + [None] * shift
+    elif shift < 0 and -shift < TAPE_STRIP_CELLS:
+        tapeStrip.scroll(-shift * TAPE_CELL_WIDTH, 0)
+        tapeStripSymbols = [None] * -shift + tapeStripSymbols[:shift]
+    else:
+        tapeStripSymbols = [None] * TAPE_STRIP_CELLS
+    tapeStripFirst = newFirst
+
+# Forget everything drawn on the tape strip.
+def clearTapeStrip():
+    global tapeStripSymbols
+    tapeStripSymbols = [None] * TAPE_STRIP_CELLS
 
 # Draw the button passed onto the screen with optional highlighting.
 def showButton(button, highlight=False):
     if highlight:
-        screen.blit(button["imageLight"], button["rect"])
+        markDirty(screen.blit(button["imageLight"], button["rect"]))
         button["highlighted"] = True
     else:
-        screen.blit(button["image"], button["rect"])
+        markDirty(screen.blit(button["image"], button["rect"]))
         button["highlighted"] = False
 
 # Draw the whole tape onto the screen
 def drawTape():
-    # Show the tape characters.
-    cellPosition = 0;
-    for i in range(tapeHead-int(TAPE_CELLS/2),tapeHead+int(TAPE_CELLS/2)+1):
-        drawTapeCell(i, cellPosition)
-        cellPosition+=1
-
-# Run length encode the tape for saving.
-def encodeTape():
-    compressed = ''
-    start = 0
-    cell = tape[0]
-    for pos in range(1, TAPE_NUMBER_CELLS):
-        if tape[pos] != cell or pos == TAPE_NUMBER_CELLS-1:
-            count = pos - start
-            if count > 5:
-                compressed += '[' + str(count) + ']' + str(cell)
-            else:
-                for i in range(start, pos):
-                    compressed += str(tape[i])
-            start = pos
-            cell = tape[pos]
-    return compressed      
-
-# Decode the run length encoding passed into the tape.
-def decodeTape(compressed):
-    tapePos = 0
-    pos =  0 
-    while pos < len(compressed):
-        if compressed[pos] == '[':
-            pos += 1
-            countStr = ''
-            while compressed[pos] != ']': 
-                countStr += compressed[pos]
-                pos += 1
-            pos += 1
-            count = int(countStr)
-            while count > 0:
-                tape[tapePos] = int(compressed[pos])
-                tapePos += 1
-                count -= 1
-            pos += 1
-        else:
-            tape[tapePos] = int(compressed[pos])
-            tapePos += 1
-            pos += 1
+    # Bring the tape strip up to date for the cells showing, including any cells showing
+    # part way through a scroll.
+    first = machine.tapeHead - int(TAPE_CELLS/2)
+    offsetCells = math.ceil(abs(tapeOffset) / TAPE_CELL_WIDTH)
+    placeTapeStrip(first - offsetCells, first + TAPE_CELLS + offsetCells - 1)
+    for i in range(first - offsetCells, first + TAPE_CELLS + offsetCells):
+        if tapeStripSymbols[i - tapeStripFirst] != machine.tape[i]:
+            drawStripCell(i)
+    
+    # Show the tape characters inside the tape frame.
+    sourceX = (first - tapeStripFirst) * TAPE_CELL_WIDTH - round(tapeOffset)
+    markDirty(screen.blit(tapeStrip, tapeWindow, 
+                          tapeWindow.move(sourceX - TAPE_START_X, -TAPE_START_Y)))
+    if hasNumpy:
+        drawMinimap()
+    drawStats()
+
+# Return the range of tape positions for the minimap to show: the cells from start to end
+# plus the cells from first to last in the tape window.
+def getMinimapRange(start, end, first, last):
+    if start < end:
+        return min(start, first), max(end, last)
+    return first, last
+
+# Draw the minimap under the tape. The columns are only worked out again when the tape
+# has changed or the tape window has moved outside of the cells already shown.
+def drawMinimap():
+    global minimapStart
+    global minimapScale
+    global minimapKey
+    global minimapCells
+    first = machine.tapeHead - int(TAPE_CELLS/2)
+    last = first + TAPE_CELLS
+    # Look at the used cells again only when the tape has changed. The version is read
+    # first so that a change made part way through by a run is picked up next time.
+    version = machine.tape.version
+    if minimapCells == None or minimapCells[0] != version:
+        minimapCells = (version,) + machine.tape.getUsedCells()
+    _, start, cells = minimapCells
+    low, high = getMinimapRange(start, start + len(cells), first, last)
+    key = (low, high, version)
+    if key != minimapKey:
+        minimapKey = key
         
-# Set the tape to all blanks (0).
-def clearTape():
-    # 0 will be the blank character.
-    global tape
-    global tapeHead
-    for i in range(0, TAPE_NUMBER_CELLS):
-        tape[i] = 0
-    tapeHead = int(TAPE_NUMBER_CELLS / 2) 
+        # Stretch a short tape across the minimap. Otherwise each column shows the highest
+        # symbol in its group of cells, faded by how many of the cells are blank. A column
+        # with any marks in it is never faded all the way out.
+        span = high - low
+        if span <= MINIMAP_WIDTH:
+            minimapScale = span / MINIMAP_WIDTH
+            size = span
+        else:
+            minimapScale = math.ceil(span / MINIMAP_WIDTH)
+            size = math.ceil(span / minimapScale) * minimapScale
+        values = numpy.zeros(size, numpy.uint8)
+        values[start - low:start - low + len(cells)] = numpy.frombuffer(cells, numpy.uint8)
+        shade = numpy.ones(MINIMAP_WIDTH)
+        if span <= MINIMAP_WIDTH:
+            columns = values[numpy.arange(MINIMAP_WIDTH) * span // MINIMAP_WIDTH]
+        else:
+            groups = values.reshape(-1, minimapScale)
+            columns = numpy.zeros(MINIMAP_WIDTH, numpy.uint8)
+            columns[:len(groups)] = groups.max(axis=1)
+            shade[:len(groups)] = MINIMAP_FADE + (1 - MINIMAP_FADE) * numpy.count_nonzero(groups, axis=1) / minimapScale
+        minimapStart = low
+        pixels = (255 - (255 - minimapPalette[columns]) * shade[:, numpy.newaxis]).astype(numpy.uint8)
+        pygame.surfarray.blit_array(minimapImage, numpy.repeat(pixels[:, numpy.newaxis, :], MINIMAP_HEIGHT, axis=1))
+    
+    # Show the minimap with the cells in the tape window marked.
+    markDirty(screen.blit(minimapImage, minimapRect))
+    pygame.draw.rect(screen, BLACK, minimapRect, 1)
+    left = MINIMAP_START_X + int((first - minimapStart) / minimapScale)
+    right = MINIMAP_START_X + int((last - minimapStart) / minimapScale)
+    pygame.draw.rect(screen, PURPLE, (left, MINIMAP_START_Y, max(right - left, 2), MINIMAP_HEIGHT), 2)
+
+# Move the tape window to the part of the tape shown at the minimap position passed.
+def jumpToMinimap(position):
+    column = position[0] - MINIMAP_START_X
+    machine.tapeHead = minimapStart + int((column + 0.5) * minimapScale)
+    stopTape()
+    drawTape()
+
+# Show the tape moving by the number of cells passed after the tape head has been moved.
+def showTapeMove(cells):
+    global tapeOffset
+    global lastTapeFrame
+    if animateTape:
+        limit = (TAPE_STRIP_MARGIN - 1) * TAPE_CELL_WIDTH
+        tapeOffset = max(-limit, min(limit, tapeOffset + cells * TAPE_CELL_WIDTH))
+        lastTapeFrame = time.perf_counter()
+    drawTape()
+
+# Move the tape by the number of pixels passed, moving the tape head each time the tape
+# passes half way across a cell.
+def scrollTape(pixels):
+    global tapeOffset
+    tapeOffset += pixels
+    while tapeOffset >= TAPE_CELL_WIDTH / 2:
+        machine.tapeHead -= 1
+        tapeOffset -= TAPE_CELL_WIDTH
+    while tapeOffset < -TAPE_CELL_WIDTH / 2:
+        machine.tapeHead += 1
+        tapeOffset += TAPE_CELL_WIDTH
+
+# Returns True if the tape is still scrolling, sliding or settling into place.
+def isTapeMoving():
+    return tapeVelocity != 0 or tapeOffset != 0
+
+# Stop the tape where it is with the tape head cell in place.
+def stopTape():
+    global tapeOffset
+    global tapeVelocity
+    tapeOffset = 0
+    tapeVelocity = 0
+
+# Move the tape on by one frame while it slides after a flick or settles into place.
+def animateTapeFrame():
+    global tapeOffset
+    global tapeVelocity
+    global lastTapeFrame
+    now = time.perf_counter()
+    seconds = min(now - lastTapeFrame, 1 / scheduler.FRAME_RATE)
+    lastTapeFrame = now
+    if tapeDrag != None or not isTapeMoving():
+        return
+    if tapeVelocity != 0:
+        scrollTape(tapeVelocity * seconds)
+        tapeVelocity *= TAPE_FRICTION ** seconds
+        if abs(tapeVelocity) < TAPE_MIN_VELOCITY:
+            tapeVelocity = 0
+    else:
+        tapeOffset *= 0.5 ** (seconds / TAPE_SCROLL_HALF_LIFE)
+        if abs(tapeOffset) < 0.5:
+            tapeOffset = 0
+    drawTape()
+
+# The pointer has been pressed on the tape cell at cellPosition. positionY is 0 for the
+# upper half of the cell and 1 for the lower half. A press on a moving tape stops it.
+def startTapeDrag(position, cellPosition, positionY):
+    global tapeDrag
+    tap = (cellPosition, positionY)
+    if isTapeMoving():
+        stopTape()
+        drawTape()
+        tap = None
+    tapeDrag = {'startX': position[0], 'lastX': position[0], 'lastTime': time.perf_counter(),
+                'velocity': 0, 'dragging': False, 'tap': tap}
+
+# The pointer has moved while pressed on the tape. Once it has moved far enough the tape
+# follows it.
+def dragTape(position):
+    if not tapeDrag['dragging']:
+        if abs(position[0] - tapeDrag['startX']) < TAPE_DRAG_DISTANCE:
+            return
+        tapeDrag['dragging'] = True
+    now = time.perf_counter()
+    pixels = position[0] - tapeDrag['lastX']
+    seconds = now - tapeDrag['lastTime']
+    if seconds > 0:
+        tapeDrag['velocity'] = tapeDrag['velocity'] / 2 + pixels / seconds / 2
+    tapeDrag['lastX'] = position[0]
+    tapeDrag['lastTime'] = now
+    scrollTape(pixels)
+    drawTape()
+
+# The pointer has been let go after a press on the tape. A drag leaves the tape sliding at
+# the speed it was moving. Returns the tape cell and half of it for a press that was not a
+# drag, otherwise None.
+def endTapeDrag():
+    global tapeDrag
+    global tapeVelocity
+    global lastTapeFrame
+    drag = tapeDrag
+    tapeDrag = None
+    if not drag['dragging']:
+        return drag['tap']
+    lastTapeFrame = time.perf_counter()
+    if lastTapeFrame - drag['lastTime'] < 0.1 and abs(drag['velocity']) >= TAPE_MIN_VELOCITY:
+        tapeVelocity = drag['velocity']
+    return None
+
+# Change the symbol in the tape cell showing at cellPosition, down if positionY is 0,
+# otherwise up.
+def changeTapeCell(cellPosition, positionY):
+    # Find the cell position on the tape.
+    tapePosition = machine.tapeHead - int(TAPE_CELLS/2) + cellPosition
+    if positionY == 0:
+        machine.tape[tapePosition] = (machine.tape[tapePosition] - 1) % 7;
+    else:
+        machine.tape[tapePosition] = (machine.tape[tapePosition] + 1) % 7;
+    drawTape()
+
+# Show the step count, the number of non blank cells (sigma) and the time spent running.
+def drawStats():
+    text = 'Steps: {0}   Sigma: {1}   Time: {2:.2f}s'.format(machine.steps, machine.tape.getNonBlankCount(), machine.elapsed)
+    statsImage = getCellNumberFont().render(text, True, BLACK, WHITE)
+    fillRect = screen.fill(WHITE, statsRect)
+    markDirty(fillRect.union(screen.blit(statsImage, (statsRect.right - statsImage.get_width(), statsRect.top))))
 
 # Set the play button to normal and the halt button to halted (red).
 def setHaltedMode():
@@ -900,7 +1298,7 @@ def drawPanelLabel(state, label, highlight=False):
     else:
         symbolImage = panelLabelSymbols[label]
     position = panelLabelPositions[label+state]
-    screen.blit(symbolImage, position)
+    markDirty(screen.blit(symbolImage, position))
 
 # Draw the state name passed at the top of the appropriate panel with optional highlighting.
 def drawPanelState(state, highlight=False):
@@ -909,7 +1307,7 @@ def drawPanelState(state, highlight=False):
     else:
         symbolImage = panelCellSymbols[state]
     position = panelLabelPositions[state] 
-    screen.blit(symbolImage, position)
+    markDirty(screen.blit(symbolImage, position))
 
 # Draw the symbol passed into the appropriate state transition table cell with optional highlighting.
 def drawStateSymbol(state, row, column, symbol, highlight=False):
@@ -918,35 +1316,129 @@ def drawStateSymbol(state, row, column, symbol, highlight=False):
         symbolImage =  panelCellSymbols[symbol+'_']
     else:
         symbolImage =  panelCellSymbols[symbol]
-    screen.blit(panelCellSymbols[' '], # Clear the cell
+    markDirty(screen.blit(panelCellSymbols[' '], # Clear the cell
                 (int(startX + (PANEL_CELL_WIDTH + PANEL_BORDER_WIDTH)*column + PANEL_CELL_WIDTH/2 - symbolImage.get_width()/3.5 - 1), 
-                 int(startY + (PANEL_CELL_HEIGHT + PANEL_BORDER_WIDTH)*row + PANEL_CELL_HEIGHT/2 - 2 - symbolImage.get_height()/3.5)))
-    screen.blit(symbolImage, 
+                 int(startY + (PANEL_CELL_HEIGHT + PANEL_BORDER_WIDTH)*row + PANEL_CELL_HEIGHT/2 - 2 - symbolImage.get_height()/3.5))))
+    markDirty(screen.blit(symbolImage, 
                 (int(startX + (PANEL_CELL_WIDTH + PANEL_BORDER_WIDTH)*column + PANEL_CELL_WIDTH/2 - symbolImage.get_width()/3.5), 
-                 int(startY + (PANEL_CELL_HEIGHT + PANEL_BORDER_WIDTH)*row + PANEL_CELL_HEIGHT/2 - 2 - symbolImage.get_height()/3.5)))
+                 int(startY + (PANEL_CELL_HEIGHT + PANEL_BORDER_WIDTH)*row + PANEL_CELL_HEIGHT/2 - 2 - symbolImage.get_height()/3.5))))
+    if row == 1:
+        drawBreakpoint(state, column)
 
-# Set the state transition table data structure to default values.
-def clearStateTable():
-    for state in ('A', 'B', 'C', 'D', 'E', 'F'):
-        for value in ('0', '1', '2', '3', '4', '5'):
-            stateTable[state+value] = [value, ' ', ' ', ' ']
-    currentTransition = None
+# Show whether there is a breakpoint on a state table column with a bar along the bottom of
+# its read cell.
+def drawBreakpoint(state, column):
+    startX,startY,_,_ = statePanelOffsets[state]
+    barRect = pygame.Rect(startX + (PANEL_CELL_WIDTH + PANEL_BORDER_WIDTH)*column + 3, 
+                          startY + (PANEL_CELL_HEIGHT + PANEL_BORDER_WIDTH) + PANEL_CELL_HEIGHT - 4, 
+                          PANEL_CELL_WIDTH - 4, 3)
+    if state+str(column) in machine.breakpoints:
+        markDirty(screen.fill(DARK_PURPLE, barRect))
+    else:
+        markDirty(screen.fill(WHITE, barRect))
+
+# Set or clear the breakpoint on a state table column. The run stops before the transition
+# in the column, the next time it is reached.
+def toggleBreakpoint(state, column):
+    key = state+str(column)
+    if key in machine.breakpoints:
+        machine.breakpoints.remove(key)
+    else:
+        machine.breakpoints.add(key)
+    drawBreakpoint(state, column)
+    
+    # The table is only compiled when play is pressed, so bring it up to date for a
+    # program that is being stepped through.
+    if stateMachineRunning:
+        machine.compileStateTable()
+
+# A state table cell has been pressed. What it does is only known once it is let go, or
+# held down long enough to set a breakpoint.
+def startPanelPress(target, offset):
+    global panelPress
+    panelPress = {'target': target, 'offset': offset, 'time': time.perf_counter()}
+
+# Set or clear the breakpoint on the column held down, if it has been held down long
+# enough and the pointer has stayed on it.
+def checkPanelPress():
+    global panelPress
+    if time.perf_counter() - panelPress['time'] < LONG_PRESS_TIME:
+        return
+    _, state, _, col = panelPress['target']
+    if getHitTarget(screenHitMap, pygame.mouse.get_pos()) == panelPress['target']:
+        toggleBreakpoint(state, col)
+    panelPress = None
+
+# A state table cell has been let go. Returns the cell and which way to change it for a
+# short press, otherwise None.
+def endPanelPress():
+    global panelPress
+    press = panelPress
+    panelPress = None
+    if press == None:
+        return None
+    _, state, row, col = press['target']
+    return state, row, col, press['offset']
+
+# Change the symbol in a state table cell to the next (offset 1) or previous (offset -1) one.
+def changePanelCell(state, row, col, offset):
+    # Read symbols. Only the last column can be changed in the read row.
+    if row == 1 and col == 5:
+        value = machine.stateTable[state+str(col)][0]
+        size = len(readSymbols)
+        pos = readSymbols.index(value)
+        index = (pos+offset) % size
+        value = readSymbols[index]
+        machine.stateTable[state+str(col)][0] = value
+        drawStateSymbol(state, 1, 5, value) 
+        # Special case for 'b'.
+        if value == 'b':
+            machine.stateTable[state+str(col)][1] = value
+            drawStateSymbol(state, 2, 5, value) 
+        else:
+            machine.stateTable[state+str(col)][1] = ' '
+            drawStateSymbol(state, 2, 5, ' ') 
+    elif row == 2:
+        value = machine.stateTable[state+str(col)][1]
+        if value != 'b':
+            size = len(writeSymbols)
+            pos = writeSymbols.index(value)
+            index = (pos+offset) % size
+            value = writeSymbols[index]
+            machine.stateTable[state+str(col)][1] = value
+            drawStateSymbol(state, 2, col, value)
+    elif row == 3:
+        value = machine.stateTable[state+str(col)][2]
+        size = len(moveSymbols)
+        pos = moveSymbols.index(value)
+        index = (pos+offset) % size
+        value = moveSymbols[index]
+        machine.stateTable[state+str(col)][2] = value
+        drawStateSymbol(state, 3, col, value) 
+    elif row == 4:
+        value = machine.stateTable[state+str(col)][3]
+        size = len(gotoSymbols)
+        pos = gotoSymbols.index(value)
+        index = (pos+offset) % size
+        value = gotoSymbols[index]
+        machine.stateTable[state+str(col)][3] = value
+        drawStateSymbol(state, 4, col, value)
 
 # Draw the symbols from the state transition table structure to the screen.  
 def redrawStateTable():
     for state in ('A', 'B', 'C', 'D', 'E', 'F'):
         for value in ('0', '1', '2', '3', '4', '5'):
-            drawStateSymbol(state, 1, int(value), stateTable[state+value][0])
-            drawStateSymbol(state, 2, int(value), stateTable[state+value][1])
-            drawStateSymbol(state, 3, int(value), stateTable[state+value][2])
-            drawStateSymbol(state, 4, int(value), stateTable[state+value][3])
+            drawStateSymbol(state, 1, int(value), machine.stateTable[state+value][0])
+            drawStateSymbol(state, 2, int(value), machine.stateTable[state+value][1])
+            drawStateSymbol(state, 3, int(value), machine.stateTable[state+value][2])
+            drawStateSymbol(state, 4, int(value), machine.stateTable[state+value][3])
 
 # Show the active transition column of the state table.
 def highlightTransition(state, transition):
     if transition[0] == 'b':
         col = 5
     else:
-        col = int(currentTransition[0])
+        col = int(transition[0])
     drawStateSymbol(state, 1, col, transition[0], True)
     drawStateSymbol(state, 2, col, transition[1], True)
     drawStateSymbol(state, 3, col, transition[2], True)
@@ -954,100 +1446,181 @@ def highlightTransition(state, transition):
     
 # Show the transition not defined error.
 def showStateTableError():
-    msg = 'Transition ' + currentState + currentTransition[0] + ' is not defined. Resetting to start state.'
-    dialog = Dialog(screen, 'Warning', msg, ['OK'], panelLabelFont, False)
+    msg = 'Transition ' + machine.currentState + machine.currentTransition[0] + ' is not defined. Resetting to start state.'
+    dialog = Dialog(screen, 'Warning', msg, ['OK'], getPanelLabelFont(), False)
     dialog.run()
     
-def runFast():
-    global tape
-    global tapeHead
-    global stateTable
-    global currentTransition
-    global currentState
-    global currentStep
-    global lastMoveDirection
+# Show the message for a machine that was found to be in a cycle.
+def showCycleMessage():
+    msg = 'Non-halting: cycle of period ' + str(machine.cyclePeriod) + ' found at step ' + str(machine.cycleStep) + '.'
+    dialog = Dialog(screen, 'Warning', msg, ['OK'], getPanelLabelFont(), False)
+    dialog.run()
     
-    # Check halt button for mouse over.
-    buttons = []
-    buttons.append(haltButton)
-           
-    # Pre-compute boundary conditions.
-    LEFT_STOP = int(TAPE_CELLS/2) + 1
-    RIGHT_STOP = TAPE_NUMBER_CELLS - int(TAPE_CELLS/2) - 1
-
-    loops = 0
-    while True:   
-        # Read
-        value = tape[tapeHead]
-        if value == 6:
-            currentTransition = stateTable[currentState+'5']
-        else:
-            currentTransition = stateTable[currentState+str(value)]
-        
-        # Check for invalid state transition table.  
-        if currentTransition[1] == ' ' or currentTransition[2] == ' ' or currentTransition[3] == ' ':
-            currentStep = 'READ'
-            return 'E'
-        
-        # Write. Do not write over a 'b'.
-        if currentTransition[1] != 'b':
-            tape[tapeHead] = int(currentTransition[1])
-            
-        # Move. Check for boundary conditions.
-        if currentTransition[0] == 'b' and currentTransition[2] == lastMoveDirection:
-            # Cannot go past a boundary.
-            currentStep = 'MOVE'
-            return 'H'
-        
-        if currentTransition[2] != 'R':
-            if tapeHead < RIGHT_STOP:
-                tapeHead += 1
-            else:
-                # Out of bounds.
-                currentStep = 'MOVE'
-                return 'H'
-        else:
-            if tapeHead > LEFT_STOP:
-                tapeHead -= 1
-            else:
-                # Out of bounds.
-                currentStep = 'MOVE'
-                return 'H'
-        
-        # Goto. Set the new state.
-        if currentTransition[3] == 'H':
-            currentStep = 'GOTO'
-            return 'H'
-        else:
-            currentState = currentTransition[3]
-        
-        # Periodically check for mouse events.
-        loops += 1;
-        if loops % 100000 == 0:
-                
-            # See if any button needs to be highlighted.
-            if checkForMouseovers(buttons):
-                pygame.display.flip()
-            
-            # Watch for the halt button pressed.
-            for event in pygame.event.get():
-                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and haltButton["rect"].collidepoint(event.pos):
-                    currentTransition = None
-                    currentStep = 'READ'
-                    return 'H'
+# Run the machine at full speed. Called on the background thread.
+def runMachine():
+    global runResult
+    try:
+        runResult = machine.runFast(runHalt.is_set, detectCycles=detectCycles, pollInterval=engine.POLL_INTERVAL)
+    finally:
+        scheduler.wake()
+
+# Start running the machine on the background thread.
+def startRun():
+    global runThread
+    global runResult
+    runHalt.clear()
+    runResult = None
+    runThread = threading.Thread(target=runMachine, daemon=True)
+    runThread.start()
+
+# Show the tape, current state and step count while the machine runs in the background.
+def drawRunProgress():
+    global runShownState
+    drawTape()
+    state = machine.currentState
+    if state != runShownState:
+        if runShownState != None:
+            drawPanelState(runShownState)
+        drawPanelState(state, True)
+        runShownState = state
+
+# Wait for the background run to stop and show how it ended.
+def finishRun():
+    global runThread
+    global runShownState
+    runThread.join()
+    runThread = None
+    if runShownState != None:
+        drawPanelState(runShownState)
+        runShownState = None
+    if runResult == 'E':
+        showStateTableError()
+    elif runResult == 'C':
+        showCycleMessage()
+    elif runResult == 'B':
+        stopAtBreakpoint()
+        return
+    haltStateMachine()
 
+# Carry on from a breakpoint in STEP mode, showing the transition the machine stopped before.
+def stopAtBreakpoint():
+    pushButtonStep(None)
+    setRunningMode()
+    drawTape()
+    highlightTransition(machine.currentState, machine.lookupTransition())
+
+# Set the DEMO mode speed in phases a second. The timer only drives the demo while it shows
+# each phase.
+def setDemoRate(rate):
+    global demoRate
+    demoRate = max(DEMO_MIN_RATE, min(DEMO_MAX_RATE, rate))
+    if demoRate <= DEMO_PHASE_RATE:
+        pygame.time.set_timer(TIMEREVENT, round(1000 / demoRate))
+    else:
+        pygame.time.set_timer(TIMEREVENT, 0)
+    drawDemoSlider()
+
+# Draw the demo speed slider and the speed, in phases or steps a second. The slider is
+# logarithmic so the slow speeds get as much room as the fast ones.
+def drawDemoSlider():
+    markDirty(screen.fill(WHITE, demoSliderRect.inflate(DEMO_SLIDER_KNOB_RADIUS * 2, 0)))
+    pygame.draw.line(screen, GREY, demoSliderRect.midleft, demoSliderRect.midright, 3)
+    fraction = math.log(demoRate / DEMO_MIN_RATE) / math.log(DEMO_MAX_RATE / DEMO_MIN_RATE)
+    pygame.draw.circle(screen, DARK_PURPLE, 
+                       (round(demoSliderRect.left + fraction * demoSliderRect.width), demoSliderRect.centery), 
+                       DEMO_SLIDER_KNOB_RADIUS)
+    if demoRate <= DEMO_PHASE_RATE:
+        text = '{0:g} phases/s'.format(float('{0:.2g}'.format(demoRate)))
+    else:
+        text = '{0:g} steps/s'.format(float('{0:.2g}'.format(demoRate / 4)))
+    speedImage = getCellNumberFont().render(text, True, BLACK, WHITE)
+    markDirty(screen.fill(WHITE, demoSpeedRect))
+    screen.blit(speedImage, (demoSpeedRect.left, demoSpeedRect.centery - speedImage.get_height() // 2))
+
+# Set the demo speed from the pointer position on the slider.
+def slideDemoRate(position):
+    fraction = max(0, min(1, (position[0] - demoSliderRect.left) / demoSliderRect.width))
+    setDemoRate(DEMO_MIN_RATE * (DEMO_MAX_RATE / DEMO_MIN_RATE) ** fraction)
+
+# Highlight the transition the machine takes next while a fast demo runs, or with show
+# False, take the highlighting off again.
+def showDemoTransition(show=True):
+    global demoShown
+    if show:
+        transition = machine.lookupTransition()
+        if transition[0] == 'b':
+            col = 5
+        else:
+            col = int(transition[0])
+        if demoShown == (machine.currentState, col):
+            return
+    if demoShown != None:
+        shownState, shownCol = demoShown
+        drawPanelState(shownState)
+        for row in range(0, 4):
+            drawStateSymbol(shownState, row+1, shownCol, machine.stateTable[shownState+str(shownCol)][row])
+        demoShown = None
+    if show:
+        drawPanelState(machine.currentState, True)
+        highlightTransition(machine.currentState, transition)
+        demoShown = (machine.currentState, col)
+
+# Take the whole steps that are due for a fast demo and show where the machine got to.
+# However many steps there are, the frame is only drawn once.
+def demoFrame():
+    global demoTime
+    global demoCarry
+    global stepReady
+    global playPressed
+    now = time.perf_counter()
+    if demoShown == None:
+        # Take over from showing each phase.
+        resetPanelLabels()
+        showButton(downArrowButton)
+        stepReady = False
+        playPressed = False
+        demoTime = now
+        demoCarry = 0
+        showDemoTransition()
+    due = demoCarry + min(now - demoTime, DEMO_MAX_FRAME_TIME) * demoRate / 4
+    demoTime = now
+    steps = int(due)
+    demoCarry = due - steps
+    if steps == 0:
+        return
+    
+    moveFrom = machine.tapeHead
+    result = machine.runFast(maxSteps=machine.steps + steps, detectCycles=False)
+    showTapeMove(machine.tapeHead - moveFrom)
+    if result == 'L':
+        showDemoTransition()
+        return
+    showDemoTransition(False)
+    if result == 'B':
+        stopAtBreakpoint()
+    elif result == 'E':
+        showStateTableError()
+        resetRuntime()
+        setStartingMode()
+    else:
+        # Finish off a halting transition as the GOTO phase would have.
+        if machine.currentStep == 'GOTO':
+            machine.gotoStep()
+        haltStateMachine()
 
 if hasCamera:
     # Call the camera module to take a picture and scan for the transition table values.
     def scanTable():
+        import camera
+        import ocr
         saveScreen = screen.copy()
         result = camera.getImageStateTable(screen)
-        screen.blit(saveScreen, (0,0))
+        markDirty(screen.blit(saveScreen, (0,0)))
         
         if result:
-            clearStateTable()
+            machine.clearStateTable()
             redrawStateTable()
-            pygame.display.flip()
+            updateScreen()
             
             # Copy the OCR values into the state table.
             for state in ('A', 'B', 'C', 'D','E','F'):
@@ -1072,9 +1645,9 @@ if hasCamera:
                             value = '?'
                             changed = True
                         if not changed:
-                            stateTable[state+str(col)][row] = value
+                            machine.stateTable[state+str(col)][row] = value
                         drawStateSymbol(state, row+1, col, value, changed)
-                        pygame.display.flip()
+                        updateScreen()
                         
                         # Check for user exit.                       
                         for event in pygame.event.get():
@@ -1083,22 +1656,31 @@ if hasCamera:
                 
     
 ##### Screen setup.          
-# Draw the tape frame.
+# Area for the run statistics.
+statsRect = pygame.Rect(STATS_START_X, STATS_START_Y, STATS_WIDTH, STATS_HEIGHT)
+
+# Draw the tape frame. The cells inside it, and the lines between them, are drawn on the
+# tape strip and copied into the window inside the frame.
 tapeBorder = pygame.Rect(TAPE_START_X, TAPE_START_Y, TAPE_WIDTH, TAPE_HEIGHT)
 pygame.draw.rect(screen, BLACK, tapeBorder, TAPE_BORDER_WIDTH)
-for x in range(TAPE_CELLS-1):
-    pygame.draw.line(screen, BLACK, 
-                     ((x+1)*TAPE_CELL_WIDTH+TAPE_START_X, TAPE_START_Y), 
-                     ((x+1)*TAPE_CELL_WIDTH+TAPE_START_X, TAPE_CELL_HEIGHT+TAPE_START_Y), 
-                     TAPE_BORDER_WIDTH)
+tapeWindow = tapeBorder.inflate(-2*TAPE_BORDER_WIDTH, -2*TAPE_BORDER_WIDTH)
+tapeStrip = pygame.Surface((TAPE_STRIP_CELLS * TAPE_CELL_WIDTH, TAPE_HEIGHT))
+clearTapeStrip()
+# The minimap goes under the tape.
+minimapRect = pygame.Rect(MINIMAP_START_X, MINIMAP_START_Y, MINIMAP_WIDTH, MINIMAP_HEIGHT)
+if hasNumpy:
+    minimapImage = pygame.Surface(minimapRect.size, 0, 32)
+    minimapPalette = numpy.array(MINIMAP_COLORS, numpy.uint8)
 # Show the tape characters
-clearTape()
 drawTape()
     
+# The button images, all in one atlas in the display format.
+buttonImages = glyphs.loadAtlas(BUTTON_IMAGES)
+
 # Create and draw the tape controls. Left arrow.
 buttons = []
-image = pygame.image.load('left_arrow.png')
-highlightImage = pygame.image.load('left_arrow_light.png')
+image = buttonImages['left_arrow.png']
+highlightImage = buttonImages['left_arrow_light.png']
 buttonWidth, buttonHeight = image.get_rect().size
 leftArrowButton = {}
 createButton("left", leftArrowButton, image, highlightImage,
@@ -1108,8 +1690,8 @@ showButton(leftArrowButton)
 buttons.append(leftArrowButton)
 
 # Right arrow.
-image = pygame.image.load('right_arrow.png')
-highlightImage = pygame.image.load('right_arrow_light.png')
+image = buttonImages['right_arrow.png']
+highlightImage = buttonImages['right_arrow_light.png']
 buttonWidth, buttonHeight = image.get_rect().size
 rightArrowButton = {}
 createButton("right", rightArrowButton, image, highlightImage,
@@ -1119,8 +1701,8 @@ showButton(rightArrowButton)
 buttons.append(rightArrowButton)
 
 # Down arrow.
-image = pygame.image.load('down_arrow.png')
-highlightImage = pygame.image.load('down_arrow_light.png')
+image = buttonImages['down_arrow.png']
+highlightImage = buttonImages['down_arrow_light.png']
 buttonWidth, buttonHeight = image.get_rect().size
 downArrowButton = {}
 createButton("down", downArrowButton, image, highlightImage, 
@@ -1134,8 +1716,8 @@ buttonCenterX = SCREEN_WIDTH - int((SCREEN_WIDTH - (TAPE_START_X + PANEL_WIDTH*3
 buttonCenterY = SCREEN_HEIGHT - int((SCREEN_HEIGHT - PANEL_START_Y)/1.9)
 
 # Reset.
-image = pygame.image.load('reset.png')
-highlightImage = pygame.image.load('reset_light.png')
+image = buttonImages['reset.png']
+highlightImage = buttonImages['reset_light.png']
 buttonWidth, buttonHeight = image.get_rect().size
 resetButton = {}
 createButton("reset", resetButton, image, highlightImage, 
@@ -1145,9 +1727,9 @@ showButton(resetButton)
 buttons.append(resetButton)
 
 # Halt.
-haltImage = pygame.image.load('halt.png')
-haltHighlightImage = pygame.image.load('halt_light.png')
-haltedImage = pygame.image.load('halted.png')
+haltImage = buttonImages['halt.png']
+haltHighlightImage = buttonImages['halt_light.png']
+haltedImage = buttonImages['halted.png']
 buttonWidth, buttonHeight = haltImage.get_rect().size
 haltButton = {}
 createButton("halt", haltButton, haltImage, haltHighlightImage, 
@@ -1157,10 +1739,10 @@ showButton(haltButton)
 buttons.append(haltButton)
 
 # Play.
-playImage = pygame.image.load('play.png')
-playHighlightImage = pygame.image.load('play_light.png')
-runningImage = pygame.image.load('running.png')
-highlightRunningImage = pygame.image.load('running_light.png')
+playImage = buttonImages['play.png']
+playHighlightImage = buttonImages['play_light.png']
+runningImage = buttonImages['running.png']
+highlightRunningImage = buttonImages['running_light.png']
 playbuttonWidth, playbuttonHeight = playImage.get_rect().size
 playButton = {}
 createButton("play", playButton, playImage, playHighlightImage, 
@@ -1210,6 +1792,19 @@ if hasCamera:
     showButton(scanButton)
     buttons.append(scanButton)
 
+# Break. Goes after the scan button if there is one, otherwise after the save button.
+breakImage = panelLabelSymbols['BREAK']
+breakHighlightImage = panelLabelSymbols['BREAK_']
+breakButton = {}
+if hasCamera:
+    breakButtonX = scanButton['rect'].right + 20
+else:
+    breakButtonX = saveButton['rect'].right + 20
+createButton("break", breakButton, breakImage, breakHighlightImage, 
+              (breakButtonX, 20), pushButtonBreak)
+showButton(breakButton)
+buttons.append(breakButton)
+
 # Find the center of the step/run/demo "button" area. 
 imageButtonWidth = playbuttonWidth   # NOTE: using play button dimensions.
 imageButtonHeight = playbuttonHeight
@@ -1218,8 +1813,8 @@ stepRunCenterX = int(buttonCenterX - imageButtonWidth/1.5)
 stepRunCenterY = int(buttonCenterY + imageButtonHeight/2)
 
 # Run. Remember the images used for the run button.
-radioImage = pygame.image.load('radio.png')
-radioHighlightImage = pygame.image.load('radio_light.png')
+radioImage = buttonImages['radio.png']
+radioHighlightImage = buttonImages['radio_light.png']
 buttonWidth, buttonHeight = radioImage.get_rect().size
 runButton = {}
 createButton("run", runButton, radioImage, radioHighlightImage,
@@ -1233,8 +1828,8 @@ screen.blit(symbolImage,
                  int(stepRunCenterY - buttonHeight - buttonHeight/6)))
 
 # Step. Remember the images used for the step button.
-selectedRadioImage = pygame.image.load('radio_selected.png')
-selectedHighlightRadioImage = pygame.image.load('radio_selected.png')
+selectedRadioImage = buttonImages['radio_selected.png']
+selectedHighlightRadioImage = buttonImages['radio_selected.png']
 buttonWidth, buttonHeight = selectedRadioImage.get_rect().size
 stepButton = {}
 createButton("step", stepButton, selectedRadioImage, selectedHighlightRadioImage,
@@ -1248,8 +1843,8 @@ screen.blit(symbolImage,
                  int(stepRunCenterY + buttonHeight/6)))
 
 # Demo. 
-image = pygame.image.load('radio.png')
-highlightImage = pygame.image.load('radio_light.png')
+image = buttonImages['radio.png']
+highlightImage = buttonImages['radio_light.png']
 buttonWidth, buttonHeight = image.get_rect().size
 demoButton = {}
 createButton("demo", demoButton, image, highlightImage, 
@@ -1262,6 +1857,13 @@ screen.blit(symbolImage,
                 (int(stepRunCenterX - imageButtonWidth/6 + buttonWidth/4), 
                  int(stepRunCenterY + buttonHeight + buttonHeight/2)))
 
+# Demo speed slider, under the demo button and lined up with it.
+demoSliderRect = pygame.Rect(demoButton['rect'].centerx, demoButton['rect'].bottom + 12, 
+                             DEMO_SLIDER_WIDTH, DEMO_SLIDER_HEIGHT)
+demoSpeedRect = pygame.Rect(demoSliderRect.right + DEMO_SLIDER_KNOB_RADIUS + 8, demoSliderRect.top, 
+                            DEMO_SPEED_WIDTH, DEMO_SLIDER_HEIGHT)
+setDemoRate(demoRate)
+
 # Draw the state transition table.
 drawStatePanel(PANEL_START_X, PANEL_START_Y, 'A')
 drawStatePanel(PANEL_START_X + PANEL_WIDTH, PANEL_START_Y, 'B')
@@ -1271,181 +1873,214 @@ drawStatePanel(PANEL_START_X + PANEL_WIDTH, PANEL_START_Y + PANEL_HEIGHT, 'E')
 drawStatePanel(PANEL_START_X + PANEL_WIDTH * 2, PANEL_START_Y + PANEL_HEIGHT, 'F')
 
 # Show the default panel symbols.
-clearStateTable()
 redrawStateTable()
 
+# Build the hit test map for the main screen: the tape cells, the state table cells below
+# the state names and then the buttons.
+screenHitMap = createHitMap()
+if hasNumpy:
+    addHitTarget(screenHitMap, ('minimap',), minimapRect)
+for cellPosition in range(TAPE_CELLS):
+    addHitTarget(screenHitMap, ('tape', cellPosition), 
+                 pygame.Rect(TAPE_START_X + cellPosition * TAPE_CELL_WIDTH, TAPE_START_Y, TAPE_CELL_WIDTH, TAPE_HEIGHT).clip(tapeBorder))
+for state in statePanelOffsets:
+    panelBounds = statePanelOffsets[state]
+    for row in range(1, PANEL_ROWS):
+        for col in range(PANEL_COLUMNS):
+            cellRect = pygame.Rect(panelBounds[0] + (PANEL_CELL_WIDTH+PANEL_BORDER_WIDTH)*col, 
+                                   panelBounds[1] + (PANEL_CELL_HEIGHT+PANEL_BORDER_WIDTH)*row, 
+                                   PANEL_CELL_WIDTH+PANEL_BORDER_WIDTH, PANEL_CELL_HEIGHT+PANEL_BORDER_WIDTH)
+            addHitTarget(screenHitMap, ('panel', state, row, col), cellRect.clip(panelBounds))
+addHitTarget(screenHitMap, ('slider',), demoSliderRect.inflate(DEMO_SLIDER_KNOB_RADIUS * 2, 8))
+for button in buttons:
+    addHitButton(screenHitMap, button)
+
+# Everything has been drawn so show the whole screen the first time through.
+markDirty(screen.get_rect())
+
 ##### Main loop.
 # Process the PyGame events.
 done = False
 while not done:
+    # Wait for something to do. A run in the background is shown at its own frame rate, and
+    # a step that still has to be shown, a fast demo or a moving tape at the screen frame
+    # rate. Otherwise sleep until there is an event.
+    if runThread != None:
+        events = scheduler.getEvents(RUN_FRAME_RATE)
+    elif (stateMachineRunning and (not stepReady or (runState == 'DEMO' and demoRate > DEMO_PHASE_RATE))) or isTapeMoving():
+        events = scheduler.getEvents(scheduler.FRAME_RATE)
+    elif panelPress != None:
+        events = scheduler.getEvents(timeout=max(1, int((panelPress['time'] + LONG_PRESS_TIME - time.perf_counter()) * 1000)))
+    else:
+        events = scheduler.getEvents()
+    
     # Check the event queue. 
-    for event in pygame.event.get():
+    for event in events:
         if event.type == pygame.KEYDOWN:
             if event.key == pygame.K_ESCAPE:
-                pygame.quit()
-                done = True
+                quitConsole()
+            elif runThread != None:
+                continue
             elif event.key == pygame.K_LEFT:
                 pushButtonLeft(None)
             elif event.key == pygame.K_RIGHT:
                 pushButtonRight(None)
+            elif event.key == pygame.K_UP:
+                setDemoRate(demoRate * 2)
+            elif event.key == pygame.K_DOWN:
+                setDemoRate(demoRate / 2)
         elif event.type == pygame.QUIT:
-            pygame.quit()
-            done = True
+            quitConsole()
         elif event.type == TIMEREVENT:
             if runState == 'DEMO':
                 playPressed = True
+        elif event.type == pygame.MOUSEMOTION:
+            if tapeDrag != None:
+                dragTape(event.pos)
+            if demoSliderDrag:
+                slideDemoRate(event.pos)
+        elif event.type == pygame.MOUSEBUTTONUP:
+            demoSliderDrag = False
+            if tapeDrag != None:
+                tap = endTapeDrag()
+                if tap != None and not stateMachineRunning:
+                    changeTapeCell(*tap)
+            if panelPress != None:
+                press = endPanelPress()
+                if press != None and not stateMachineRunning:
+                    changePanelCell(*press)
         elif event.type == pygame.MOUSEBUTTONDOWN:
             
-            # First check all the buttons.
-            buttonOnClick(leftArrowButton, event)
-            buttonOnClick(rightArrowButton, event)
-            buttonOnClick(downArrowButton, event)
-            buttonOnClick(resetButton, event)
-            buttonOnClick(haltButton, event)
-            buttonOnClick(playButton, event)
-            buttonOnClick(runButton, event)
-            buttonOnClick(stepButton, event)
-            buttonOnClick(demoButton, event)
-            buttonOnClick(loadButton, event)
-            buttonOnClick(saveButton, event)
-            buttonOnClick(exitButton, event)
-            if hasCamera:
-                buttonOnClick(scanButton, event)
+            target = getHitTarget(screenHitMap, event.pos)
+            if target == None:
+                continue
+            
+            # Only halt and exit work while the machine runs in the background.
+            if runThread != None:
+                if target[0] == 'button' and (target[1] is haltButton or target[1] is exitButton):
+                    buttonOnClick(target[1], event)
+                continue
+            
+            # First check the buttons.
+            if target[0] == 'button':
+                buttonOnClick(target[1], event)
+            
+            # The demo speed can be changed at any time, by sliding or with the scroll wheel.
+            elif target[0] == 'slider':
+                if event.button == 4:
+                    setDemoRate(demoRate * 2)
+                elif event.button == 5:
+                    setDemoRate(demoRate / 2)
+                else:
+                    slideDemoRate(event.pos)
+                    demoSliderDrag = True
        
             # Do not allow the tape of state cells to be modified while running.
-            if not stateMachineRunning:
+            elif not stateMachineRunning:
                 # Check to see if a tape cell has been clicked.
-                if tapeBorder.collidepoint(event.pos):
-                    # Determine which cell.
-                    cellPosition = int((event.pos[0] - TAPE_START_X) / TAPE_CELL_WIDTH)
-                    # Find the cell position on the tape.
-                    tapePosition = tapeHead - int(TAPE_CELLS/2) + cellPosition
+                if target[0] == 'tape':
+                    cellPosition = target[1]
                     
                     # Check for scroll wheel event.
                     if event.button == 4 or event.button == 5:
                         # 4 means scrolling up 5 means scrolling down.
-                        positionY = event.button - 4
+                        changeTapeCell(cellPosition, event.button - 4)
                     else :
                         # See if the y position is in the upper or lower part of the cell.
+                        # The cell changes when the pointer is let go, unless the tape is
+                        # dragged instead.
                         positionY = int((event.pos[1] - TAPE_START_Y) / (TAPE_CELL_HEIGHT/2))
-                        
-                    if positionY == 0:
-                        tape[tapePosition] = (tape[tapePosition] - 1) % 7;
-                    else:
-                        tape[tapePosition] = (tape[tapePosition] + 1) % 7;
-                    drawTapeCell(tapePosition, cellPosition)
+                        startTapeDrag(event.pos, cellPosition, positionY)
+                
+                # Check to see if the minimap has been clicked.
+                elif target[0] == 'minimap':
+                    jumpToMinimap(event.pos)
                     
                 # Check to see if a state table cell has been clicked.
-                for state in statePanelOffsets:
-                    # Check each panel.
+                elif target[0] == 'panel':
+                    _, state, row, col = target
                     panelBounds = statePanelOffsets[state]
-                    if panelBounds.collidepoint(event.pos):
-                        # Found clicked panel, find out which cell.
-                        col = int((event.pos[0] - panelBounds[0])/(PANEL_CELL_WIDTH+PANEL_BORDER_WIDTH))
-                        row = int((event.pos[1] - panelBounds[1])/(PANEL_CELL_HEIGHT+PANEL_BORDER_WIDTH))
-                        
-                        # Determine if event in upper or lower part of cell.
-                        top = panelBounds[1]+(PANEL_CELL_HEIGHT+PANEL_BORDER_WIDTH)*(row)
-                        bottom = top + PANEL_CELL_HEIGHT
-                        middle = int((top + bottom) / 2)
-                        
-                        # If upper decrease the cell value, otherwise increase the cell value.
-                        # Also check for mouse wheel events.
-                        if event.button == 4:
-                            offset =-1
-                        elif event.button == 5:
-                            offset = 1
-                        elif event.pos[1] < middle:
-                            offset = -1
-                        else: 
-                            offset = 1
-                      
-                        # Read symbols. Only the last column can be changed in the read row.
-                        if row == 1 and col == 5:
-                            value = stateTable[state+str(col)][0]
-                            size = len(readSymbols)
-                            pos = readSymbols.index(value)
-                            index = (pos+offset) % size
-                            value = readSymbols[index]
-                            stateTable[state+str(col)][0] = value
-                            drawStateSymbol(state, 1, 5, value) 
-                            # Special case for 'b'.
-                            if value == 'b':
-                                stateTable[state+str(col)][1] = value
-                                drawStateSymbol(state, 2, 5, value) 
-                            else:
-                                stateTable[state+str(col)][1] = ' '
-                                drawStateSymbol(state, 2, 5, ' ') 
-                        elif row == 2:
-                            value = stateTable[state+str(col)][1]
-                            if value != 'b':
-                                size = len(writeSymbols)
-                                pos = writeSymbols.index(value)
-                                index = (pos+offset) % size
-                                value = writeSymbols[index]
-                                stateTable[state+str(col)][1] = value
-                                drawStateSymbol(state, 2, col, value)
-                        elif row == 3:
-                            value = stateTable[state+str(col)][2]
-                            size = len(moveSymbols)
-                            pos = moveSymbols.index(value)
-                            index = (pos+offset) % size
-                            value = moveSymbols[index]
-                            stateTable[state+str(col)][2] = value
-                            drawStateSymbol(state, 3, col, value) 
-                        elif row == 4:
-                            value = stateTable[state+str(col)][3]
-                            size = len(gotoSymbols)
-                            pos = gotoSymbols.index(value)
-                            index = (pos+offset) % size
-                            value = gotoSymbols[index]
-                            stateTable[state+str(col)][3] = value
-                            drawStateSymbol(state, 4, col, value)
-        
+                    
+                    # Determine if event in upper or lower part of cell.
+                    top = panelBounds[1]+(PANEL_CELL_HEIGHT+PANEL_BORDER_WIDTH)*(row)
+                    bottom = top + PANEL_CELL_HEIGHT
+                    middle = int((top + bottom) / 2)
+                    
+                    # If upper decrease the cell value, otherwise increase the cell value.
+                    # Also check for mouse wheel events, which change the cell straight away.
+                    if event.button == 4:
+                        changePanelCell(state, row, col, -1)
+                    elif event.button == 5:
+                        changePanelCell(state, row, col, 1)
+                    elif event.pos[1] < middle:
+                        startPanelPress(target, -1)
+                    else: 
+                        startPanelPress(target, 1)
+            
+            # Breakpoints can still be set while stepping through a program.
+            elif target[0] == 'panel' and event.button == 1:
+                startPanelPress(target, 0)
+    
     if done:
         break # Break out of the while loop.
     
+    # Slide the tape on.
+    if isTapeMoving():
+        animateTapeFrame()
+    
+    # See if a state table cell has been held down long enough to set a breakpoint.
+    if panelPress != None:
+        checkPanelPress()
+    
     # Highlight any buttons the mouse is over.
-    checkForMouseovers(buttons)
+    if runThread != None:
+        checkForMouseovers(screenHitMap, [haltButton, exitButton])
+    else:
+        checkForMouseovers(screenHitMap, buttons)
                 
     # Don't start running the state machine until play pressed.
     if stateMachineRunning == False:
         # Show the changes to the screen.
-        pygame.display.flip()
+        updateScreen()
         continue
     
-    # If RUN use the optimized method. 
+    # A fast demo takes whole steps each frame, once any transition part way through its
+    # phases has been finished off. Otherwise go back to showing each phase.
+    if runState == 'DEMO' and demoRate > DEMO_PHASE_RATE and machine.currentStep == 'READ':
+        demoFrame()
+        updateScreen()
+        continue
+    if demoShown != None:
+        showDemoTransition(False)
+    if runState == 'DEMO' and demoRate > DEMO_PHASE_RATE:
+        playPressed = True
+    
+    # If RUN use the optimized method on the background thread. 
     if runState == 'RUN':
-        # Show the play button in running mode.
-        pygame.display.flip()
-        
-        # Run the optimized state machine.
-        if runFast() == 'E':
-            showStateTableError()
-        haltStateMachine()
+        if runThread == None:
+            startRun()
+        elif runThread.is_alive() and runResult == None:
+            drawRunProgress()
+        else:
+            finishRun()
+        updateScreen()
         continue
             
     # Read.
-    if currentStep == 'READ':
+    if machine.currentStep == 'READ':
         if stepReady == False:
             # Highlight the state and read labels.
-            drawPanelLabel(currentState, 'READ', True)
-            drawPanelState(currentState, True)
+            drawPanelLabel(machine.currentState, 'READ', True)
+            drawPanelState(machine.currentState, True)
             
             # Highlight the tape head.
-            showButton(downArrowButton, True)
+            highlightButton(downArrowButton)
             
             # Indicate read ready for play press.
             stepReady = True
         if playPressed:
             # Read the symbol at the tape head position and determine the transition tuple.
-            value = tape[tapeHead]
-            if value == 6:
-                currentTransition = stateTable[currentState+'5']
-            else:
-                currentTransition = stateTable[currentState+str(value)]
-                
-            if currentTransition[1] == ' ' or currentTransition[2] == ' ' or currentTransition[3] == ' ':
+            if not machine.readStep():
                 
                 showStateTableError()
                 
@@ -1457,136 +2092,113 @@ while not done:
                 continue
                 
             # Highlight the transition column selected.
-            highlightTransition(currentState, currentTransition)
+            highlightTransition(machine.currentState, machine.currentTransition)
             
             # Set the READ label to normal.
-            drawPanelLabel(currentState, 'READ')
+            drawPanelLabel(machine.currentState, 'READ')
             
             # Advance to the next step.
-            currentStep = 'WRITE'
             playPressed = False
             stepReady = False
             
     # Write.
-    if currentStep == 'WRITE':
+    if machine.currentStep == 'WRITE':
         if stepReady == False:
             # Highlight the write label.
-            drawPanelLabel(currentState, 'WRITE', True)  
+            drawPanelLabel(machine.currentState, 'WRITE', True)  
              
             # Indicate write ready for play press.
             stepReady = True
         if playPressed:
-            # Update the tape with the new value. If is 'b' don't write,
-            if currentTransition[1] != 'b':
-                tape[tapeHead] = int(currentTransition[1])
+            # Update the tape with the new value.
+            machine.writeStep()
                 
             # Show the updated tape cell.
-            cellPosition = int(TAPE_CELLS/2)
-            drawTapeCell(tapeHead, cellPosition)
+            drawTape()
               
             # Set the WRITE label to normal.
-            drawPanelLabel(currentState, 'WRITE')
+            drawPanelLabel(machine.currentState, 'WRITE')
             
             # Remove highlight from tape head.
             showButton(downArrowButton)
                 
             # Advance to the next step.
-            currentStep = 'MOVE'
             playPressed = False
             stepReady = False
             
     # Move.
-    if currentStep == 'MOVE':
+    if machine.currentStep == 'MOVE':
         if stepReady == False:
             # Highlight the move label.
-            drawPanelLabel(currentState, 'MOVE', True)  
+            drawPanelLabel(machine.currentState, 'MOVE', True)  
             
             # Highlight the appropriate tape direction arrow.
-            if currentTransition[2] != 'R':
-                showButton(leftArrowButton, True)
+            if machine.currentTransition[2] != 'R':
+                highlightButton(leftArrowButton)
             else:
-                showButton(rightArrowButton, True)
+                highlightButton(rightArrowButton)
              
             # Indicate write ready for play press.
             stepReady = True
         
         if playPressed:
-            # Check for boundary conditions.
-            if currentTransition[0] == 'b' and currentTransition[2] == lastMoveDirection:
+            # Move the tape, checking for boundary conditions.
+            moveFrom = machine.tapeHead
+            if not machine.moveStep():
                 # Cannot go past a boundary.
                 haltStateMachine()
             else:  
-                # Move the tape.
-                if currentTransition[2] != 'R':
-                    if tapeHead < TAPE_NUMBER_CELLS - int(TAPE_CELLS/2) - 1:
-                        tapeHead += 1
-                    else:
-                        # Out of bounds.
-                        haltStateMachine()
-                    button = leftArrowButton
-                else:
-                    if tapeHead > int(TAPE_CELLS/2) + 1:
-                        tapeHead -= 1
-                    else:
-                        # Out of bounds.
-                        haltStateMachine()
-                    button = rightArrowButton
-                    
                 # Set the tape arrow button to normal.
-                showButton(button)
+                if machine.lastMoveDirection != 'R':
+                    showButton(leftArrowButton)
+                else:
+                    showButton(rightArrowButton)
                 
                 # Set the MOVE label to normal.
-                drawPanelLabel(currentState, 'MOVE')
+                drawPanelLabel(machine.currentState, 'MOVE')
                 
                 # Show the updated tape.
-                drawTape()
-                    
-                # Record the last move direction.
-                lastMoveDirection = currentTransition[2]
+                showTapeMove(machine.tapeHead - moveFrom)
                 
                 # Advance to the next step.
-                currentStep = 'GOTO'
                 playPressed = False
                 stepReady = False
     
     # Goto.
-    if currentStep == 'GOTO':
+    if machine.currentStep == 'GOTO':
         if stepReady == False:
             # Highlight the move label.
-            drawPanelLabel(currentState, 'GOTO', True)  
+            drawPanelLabel(machine.currentState, 'GOTO', True)  
              
             # Indicate write ready for play press.
             stepReady = True
         if playPressed:
+            transition = machine.currentTransition
                 
             # Set the MOVE label and state to normal.
-            drawPanelLabel(currentState, 'GOTO')
-            drawPanelState(currentState)
+            drawPanelLabel(machine.currentState, 'GOTO')
+            drawPanelState(machine.currentState)
             
             # Set the transition column selected to normal.
-            if currentTransition[0] == 'b':
+            if transition[0] == 'b':
                 col = 5
             else:
-                col = int(currentTransition[0])
-            drawStateSymbol(currentState, 1, col, currentTransition[0])
-            drawStateSymbol(currentState, 2, col, currentTransition[1])
-            drawStateSymbol(currentState, 3, col, currentTransition[2])
-            drawStateSymbol(currentState, 4, col, currentTransition[3])
+                col = int(transition[0])
+            drawStateSymbol(machine.currentState, 1, col, transition[0])
+            drawStateSymbol(machine.currentState, 2, col, transition[1])
+            drawStateSymbol(machine.currentState, 3, col, transition[2])
+            drawStateSymbol(machine.currentState, 4, col, transition[3])
             
             # Set the new state.
-            if currentTransition[3] == 'H':
+            if not machine.gotoStep():
                 haltStateMachine()
-            else:
-                currentState = currentTransition[3]
                 
             # Clear the current transition.
-            currentTransition = None
+            machine.currentTransition = None
             
             # Advance to the next step.
-            currentStep = 'READ'
             playPressed = False
             stepReady = False
            
     # Show the changes to the screen.
-    pygame.display.flip()
-    clock.tick(60)
\ No newline at end of file
+    updateScreen()
\ No newline at end of file
@@ -0,0 +1,45 @@
+#
+# Convert TMD-2 workspaces saved in the old text format to the binary .tmd2v2 format.
+#
+#   python Tmd2Convert.py [--force] path [path ...]
+#
+# Each path can be a .tmd2 file, a directory of .tmd2 files or a glob pattern. The
+# converted workspace is written next to the original, which is left in place.
+#
+import argparse
+import os
+import sys
+
+import engine
+
+# Convert a single workspace. Returns the name of the new file.
+def convertFile(filename, force):
+    newFilename = os.path.splitext(filename)[0] + engine.BINARY_EXTENSION
+    if os.path.exists(newFilename) and not force:
+        raise ValueError(newFilename + ' already exists.')
+    machine = engine.TuringMachine()
+    machine.loadFile(filename)
+    machine.saveFile(newFilename)
+    return newFilename
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Convert TMD-2 workspaces to the binary format.')
+    parser.add_argument('paths', nargs='+', help='.tmd2 files, directories or glob patterns')
+    parser.add_argument('--force', action='store_true', help='replace existing .tmd2v2 files')
+    options = parser.parse_args(arguments)
+
+    filenames = engine.findFiles(options.paths, ('.tmd2',))
+    if not filenames:
+        parser.error('no .tmd2 files found')
+
+    failed = 0
+    for filename in filenames:
+        try:
+            print(filename + ' -> ' + convertFile(filename, options.force))
+        except Exception as ex:
+            print(filename + ': ' + str(ex), file=sys.stderr)
+            failed += 1
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
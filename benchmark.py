@@ -0,0 +1,455 @@
+#
+# Benchmarks for the TMD-2.
+#
+#   python benchmark.py [--repeat N] [name ...]
+#
+# With no names every benchmark is run. Each benchmark prints the best of N timings for
+# each of the cases it covers.
+#
+import argparse
+import os
+import random
+import runpy
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import engine
+
+# Default number of times each case is timed.
+REPEAT = 5
+
+# Run the console until it first updates the screen, then exit.
+FIRST_FRAME_SCRIPT = '''
+import os, runpy, pygame
+pygame.display.update = lambda *rects: os._exit(0)
+runpy.run_path('Tmd2Console.py', run_name='Tmd2Console')
+'''
+
+# The console's glyph cache file.
+GLYPH_CACHE = 'glyphs.cache'
+
+# Number of cells on the sparse and dense test tapes.
+TAPE_CELLS = 1000000
+
+# A binary counter using 1 and 2 for the bits. It never halts or repeats, and unlike the
+# busy beavers it spends most of its time on single steps rather than runs of a symbol.
+COUNTER_TABLE = {
+    'A0': ['0', '2', 'R', 'B'],
+    'A1': ['1', '2', 'R', 'B'],
+    'A2': ['2', '1', 'L', 'A'],
+    'B0': ['0', '0', 'L', 'A'],
+    'B1': ['1', '1', 'R', 'B'],
+    'B2': ['2', '2', 'R', 'B'],
+}
+
+# Steps to run the counter for.
+COUNTER_STEPS = 5000000
+
+# Seconds into a run at which the polling benchmark asks the machine to halt.
+HALT_TIME = 0.3
+
+# Number of times the tape is drawn for each drawTape timing.
+DRAW_TAPE_CALLS = 1000
+
+# Number of times every button is highlighted for each mouse-over timing.
+BUTTON_CALLS = 100
+
+# Steps beaver5 is run for before timing the demo, and the number of demo frames timed.
+DEMO_START_STEPS = 10000000
+DEMO_FRAMES = 100
+
+# Directory of scanned tables for the template matching benchmark. Each is a PNG of the table
+# as ocr.doOCR leaves it ('5 dilated.png' when debugging), with a .txt file of the same name
+# holding the 18 symbols of each row on a line and _ for blank cells. None are included, so
+# unless some are added the benchmark measures made up tables.
+OCR_SAMPLES = 'ocrsamples'
+
+# Number of made up tables to match when there are no scanned ones, and their size.
+SYNTHETIC_SAMPLES = 10
+SYNTHETIC_SIZE = 1800, 1200
+
+# Return the best time in seconds over repeat calls of the function passed.
+def bestTime(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - startTime)
+    return best
+
+# Print the timing for one case.
+def report(name, seconds, note=''):
+    print('{0:<36} {1:>10.3f} ms  {2}'.format(name, seconds * 1000, note))
+
+# Return a machine with a few short marks spread thinly over the tape.
+def sparseMachine():
+    machine = engine.TuringMachine()
+    rand = random.Random(1)
+    for _ in range(200):
+        position = rand.randrange(-TAPE_CELLS // 2, TAPE_CELLS // 2)
+        for offset in range(rand.randrange(1, 20)):
+            machine.tape[position + offset] = rand.randrange(1, 6)
+    return machine
+
+# Return a machine with random symbols in every cell, the worst case for run length encoding.
+def denseMachine():
+    machine = engine.TuringMachine()
+    rand = random.Random(2)
+    machine.tape.setCells(-TAPE_CELLS // 2, bytes(rand.randrange(3) for _ in range(TAPE_CELLS)))
+    return machine
+
+# Return the machine in beaver5.tmd2 run until it halts.
+def beaverMachine():
+    machine = engine.TuringMachine()
+    machine.loadFile(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'beaver5.tmd2'))
+    machine.compileStateTable()
+    machine.runFast()
+    return machine
+
+# Return a machine set up to run the binary counter.
+def counterMachine():
+    machine = engine.TuringMachine()
+    machine.stateTable.update(COUNTER_TABLE)
+    machine.compileStateTable()
+    return machine
+
+# Save and load times for sparse and dense tapes, for the run length encoding on its own
+# and for whole files in the text and binary formats.
+def benchmarkSaveLoad(repeat):
+    folder = tempfile.mkdtemp()
+    for name, machine in (('sparse', sparseMachine()), ('dense', denseMachine()), ('beaver5', beaverMachine())):
+        report(name + ' encodeTape', bestTime(machine.encodeTape, repeat))
+        compressed, start = machine.encodeTape()
+        loader = engine.TuringMachine()
+        report(name + ' decodeTape', bestTime(lambda: loader.decodeTape(compressed, start), repeat))
+        for extension in ('.tmd2', engine.BINARY_EXTENSION):
+            filename = os.path.join(folder, name + extension)
+            report(name + ' save ' + extension, bestTime(lambda: machine.saveFile(filename), repeat),
+                   str(os.path.getsize(filename)) + ' bytes')
+            report(name + ' load ' + extension, bestTime(lambda: loader.loadFile(filename), repeat))
+            os.remove(filename)
+    os.rmdir(folder)
+
+# The cost of polling during runFast, by step count and by time, and how long a run
+# takes to stop after the poll function asks it to.
+def benchmarkPolling(repeat):
+    machines = (('beaver5', beaverMachine, None), ('counter', counterMachine, COUNTER_STEPS))
+    modes = (('no poll', None, {}),
+             ('every ' + str(engine.POLL_STEPS) + ' steps', lambda: False, {}),
+             ('every ' + str(engine.POLL_INTERVAL) + 's', lambda: False, {'pollInterval': engine.POLL_INTERVAL}))
+    for name, create, maxSteps in machines:
+        # The machines are run from the start each time, with the setup left out of the timing.
+        setups = [create() for _ in range(repeat)]
+        for machine in setups:
+            machine.resetState('A', 'READ')
+            machine.clearTape()
+        base = None
+        for mode, poll, options in modes:
+            best = float('inf')
+            for machine in setups:
+                machine.resetState('A', 'READ')
+                machine.clearTape()
+                startTime = time.perf_counter()
+                machine.runFast(poll, maxSteps, False, **options)
+                best = min(best, time.perf_counter() - startTime)
+            if base == None:
+                base = best
+                report(name + ' ' + mode, best)
+            else:
+                report(name + ' ' + mode, best, 'overhead {0:+.1f}%'.format((best - base) / base * 100))
+
+        # The rest only applies to the counter, which runs long enough to be drawn and
+        # stopped part way through.
+        if maxSteps == None:
+            continue
+
+        # The counter run the way RUN mode runs it, next to the same run polled by time
+        # without a screen.
+        consoleBest = timeConsoleRun(maxSteps, repeat)
+        report(name + ' in console', consoleBest, 'overhead {0:+.1f}% on every {1}s, {2:.0f} steps/s'.format(
+            (consoleBest - best) / best * 100, engine.POLL_INTERVAL, maxSteps / consoleBest))
+
+        # Halt latency.
+        for mode, _, options in modes[1:]:
+            worst = 0
+            for machine in setups:
+                machine.resetState('A', 'READ')
+                machine.clearTape()
+                haltTime = time.perf_counter() + HALT_TIME
+                machine.runFast(lambda: time.perf_counter() >= haltTime, None, False, **options)
+                worst = max(worst, time.perf_counter() - haltTime)
+            report(name + ' halt latency ' + mode, worst)
+
+# Return the best time for running the counter for the steps passed in the console, on a
+# background thread with the tape and state redrawn RUN_FRAME_RATE times a second while it
+# runs, as in RUN mode.
+def timeConsoleRun(steps, repeat):
+    times = []
+    def measure(console):
+        machine = console['machine']
+        machine.stateTable.update(COUNTER_TABLE)
+        machine.compileStateTable()
+        frameTime = 1 / console['RUN_FRAME_RATE']
+        for _ in range(repeat):
+            machine.resetState('A', 'READ')
+            machine.clearTape()
+            thread = threading.Thread(target=machine.runFast, args=(lambda: False, steps, False),
+                                      kwargs={'pollInterval': engine.POLL_INTERVAL})
+            startTime = time.perf_counter()
+            thread.start()
+            while True:
+                thread.join(frameTime)
+                if not thread.is_alive():
+                    break
+                console['drawRunProgress']()
+                console['updateScreen']()
+            times.append(time.perf_counter() - startTime)
+        if console['runShownState'] != None:
+            console['drawPanelState'](console['runShownState'])
+            console['runShownState'] = None
+    withConsole(measure)
+    return min(times)
+
+# Run the console without a screen and call function with its globals once it is waiting
+# for events. The console is closed when function returns.
+def withConsole(function):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    folder = os.path.dirname(os.path.abspath(__file__))
+    def run():
+        try:
+            while not 'done' in vars(sys.modules.get('Tmd2Console', sys)):
+                time.sleep(0.1)
+            time.sleep(0.5)
+            function(vars(sys.modules['Tmd2Console']))
+        finally:
+            pygame.event.post(pygame.event.Event(pygame.QUIT))
+    threading.Thread(target=run, daemon=True).start()
+    workingFolder = os.getcwd()
+    os.chdir(folder)
+    try:
+        runpy.run_path(os.path.join(folder, 'Tmd2Console.py'), run_name='Tmd2Console')
+    finally:
+        os.chdir(workingFolder)
+
+# Drawing the tape in the console, as it is redrawn after every move: at one position, moving
+# one cell at a time and with nothing cached or already on the tape strip.
+def benchmarkDrawTape(repeat):
+    def measure(console):
+        machine = console['machine']
+        for position in range(-500, 500):
+            machine.tape[position] = position % 7
+        def draw(move, cold):
+            machine.tapeHead = 0
+            for _ in range(DRAW_TAPE_CALLS):
+                if cold:
+                    console['getCellImage'].cache_clear()
+                    console['getCellNumberImage'].cache_clear()
+                    console['clearTapeStrip']()
+                machine.tapeHead += move
+                console['drawTape']()
+                console['updateScreen']()
+        for name, move, cold in (('still', 0, False), ('moving', 1, False), ('uncached', 0, True)):
+            report('drawTape ' + name, bestTime(lambda: draw(move, cold), repeat) / DRAW_TAPE_CALLS)
+        machine.tapeHead = 0
+    withConsole(measure)
+
+# Drawing the minimap under the tape for a used tape of 100000 cells and of TAPE_CELLS
+# cells, from scratch and when nothing has changed.
+def benchmarkMinimap(repeat):
+    def measure(console):
+        machine = console['machine']
+        rand = random.Random(3)
+        for cells in (100000, TAPE_CELLS):
+            machine.clearTape()
+            machine.tape.setCells(-cells // 2, bytes(rand.randrange(6) for _ in range(cells)))
+            def draw():
+                console['minimapKey'] = None
+                console['minimapCells'] = None
+                console['drawMinimap']()
+            report('minimap ' + str(cells) + ' cells', bestTime(draw, repeat))
+            report('minimap ' + str(cells) + ' cells unchanged', bestTime(console['drawMinimap'], repeat))
+        machine.clearTape()
+    withConsole(measure)
+
+# One frame of a DEMO at full speed, running the steps due and drawing the tape, minimap and
+# transition, on beaver5 from part way through its run.
+def benchmarkDemo(repeat):
+    def measure(console):
+        machine = console['machine']
+        machine.loadFile(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'beaver5.tmd2'))
+        machine.clearTape()
+        machine.compileStateTable()
+        machine.runFast(maxSteps=DEMO_START_STEPS)
+        console['setDemoRate'](console['DEMO_MAX_RATE'])
+        def frames():
+            for _ in range(DEMO_FRAMES):
+                console['demoTime'] -= 1 / console['scheduler'].FRAME_RATE
+                console['demoFrame']()
+                console['updateScreen']()
+        report('demo frame', bestTime(frames, repeat) / DEMO_FRAMES,
+               str(console['DEMO_MAX_RATE'] // 4) + ' steps/s')
+        console['showDemoTransition'](False)
+        console['setDemoRate'](1)
+    withConsole(measure)
+
+# Time from starting Python to the console's first frame, with and without the glyph cache,
+# next to the time to start Python and import pygame on its own. Each start is in a fresh
+# process, so nothing is left over from the last one.
+def benchmarkStartup(repeat):
+    folder = os.path.dirname(os.path.abspath(__file__))
+    environment = dict(os.environ, SDL_VIDEODRIVER='dummy', PYGAME_HIDE_SUPPORT_PROMPT='1')
+    def start(script):
+        startTime = time.perf_counter()
+        subprocess.run([sys.executable, '-c', script], cwd=folder, env=environment,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        return time.perf_counter() - startTime
+    cacheName = os.path.join(folder, GLYPH_CACHE)
+    def startCold():
+        if os.path.exists(cacheName):
+            os.remove(cacheName)
+        return start(FIRST_FRAME_SCRIPT)
+    cases = (('import pygame', lambda: start('import pygame')),
+             ('first frame no glyph cache', startCold),
+             ('first frame glyph cache', lambda: start(FIRST_FRAME_SCRIPT)))
+
+    # Keep the console's own glyph cache out of the way and put it back afterwards.
+    backupName = cacheName + '.benchmark'
+    if os.path.exists(cacheName):
+        os.replace(cacheName, backupName)
+    try:
+        for name, function in cases:
+            report(name, min(function() for _ in range(repeat)))
+    finally:
+        if os.path.exists(backupName):
+            os.replace(backupName, cacheName)
+        elif os.path.exists(cacheName):
+            os.remove(cacheName)
+
+# Highlighting a button as the mouse moves over it and taking the highlight off the last
+# one, as loaded from the image files and from the atlas in the display format.
+def benchmarkButtons(repeat):
+    def measure(console):
+        buttons = [button for button in console['buttons'] if button['image'] in console['buttonImages'].values()]
+        def highlight():
+            for _ in range(BUTTON_CALLS):
+                for last, button in zip(buttons, buttons[1:]):
+                    console['showButton'](button, True)
+                    console['showButton'](last)
+                console['updateScreen']()
+        atlasImages = [(button['image'], button['imageLight']) for button in buttons]
+        fileNames = {id(image): fileName for fileName, image in console['buttonImages'].items()}
+        for button in buttons:
+            button['image'] = console['pygame'].image.load(fileNames[id(button['image'])])
+            button['imageLight'] = console['pygame'].image.load(fileNames[id(button['imageLight'])])
+        calls = BUTTON_CALLS * (len(buttons) - 1)
+        report('mouse-over image files', bestTime(highlight, repeat) / calls)
+        for button, (image, imageLight) in zip(buttons, atlasImages):
+            button['image'] = image
+            button['imageLight'] = imageLight
+        report('mouse-over atlas', bestTime(highlight, repeat) / calls)
+    withConsole(measure)
+
+# Write made up tables to the directory passed in the form of the scanned samples. The
+# symbols are in a different font from the starting templates, with their size, angle and
+# position varied, and a few specks of noise.
+def writeSamples(folder):
+    import pygame
+    import glyphmatch
+    rand = random.Random(1)
+    width, height = SYNTHETIC_SIZE
+    cellWidth = width // 18
+    cellHeight = height // 10
+    for sample in range(SYNTHETIC_SAMPLES):
+        table = pygame.Surface(SYNTHETIC_SIZE)
+        table.fill((255, 255, 255))
+        font = pygame.font.Font(None, int(cellHeight * rand.uniform(0.8, 1.0)))
+        values = ''
+        for index in range(144):
+            value = rand.choice(glyphmatch.SYMBOLS + '__')
+            values += value + ('\n' if index % 18 == 17 else '')
+            if value == '_':
+                continue
+            image = font.render(value, True, (0, 0, 0))
+            image = pygame.transform.rotozoom(image, rand.uniform(-5, 5), rand.uniform(0.9, 1.1))
+            row = index // 18
+            column = index % 18
+            center = ((column // 6) * (width // 3) + (column % 6 + 0.5) * cellWidth + rand.randint(-5, 5),
+                      (row // 4) * (height // 2) + (row % 4 + 1.5) * cellHeight + rand.randint(-5, 5))
+            table.blit(image, image.get_rect(center=center))
+        for _ in range(200):
+            table.fill((0, 0, 0), (rand.randrange(width), rand.randrange(height), 2, 2))
+        name = os.path.join(folder, 'table{0}'.format(sample))
+        pygame.image.save(table, name + '.png')
+        with open(name + '.txt', 'w') as f:
+            f.write(values)
+
+# Matching all of the cells of each sample table against the glyph templates, with how many
+# cells were matched correctly and how many were not trusted and would be passed on to
+# Tesseract. The tables in OCR_SAMPLES are used if there are any, otherwise made up ones,
+# and the results say which.
+def benchmarkTemplates(repeat):
+    import pygame
+    pygame.font.init()
+    if os.path.isdir(OCR_SAMPLES) and any(name.endswith('.png') for name in os.listdir(OCR_SAMPLES)):
+        matchSamples(OCR_SAMPLES, 'scanned', repeat)
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            writeSamples(folder)
+            matchSamples(folder, 'synthetic', repeat)
+
+# Match the sample tables in the folder passed for benchmarkTemplates. The kind of sample
+# is shown with each result.
+def matchSamples(folder, kind, repeat):
+    import pygame
+    import glyphmatch
+    correct = 0
+    unsure = 0
+    cells = 0
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith('.png'):
+            continue
+        image = pygame.surfarray.array3d(pygame.image.load(os.path.join(folder, name)))[:, :, 0].T.copy()
+        with open(os.path.join(folder, name[:-4] + '.txt')) as f:
+            expected = [' ' if value == '_' else value for row in f.read().split() for value in row]
+        result = []
+        def match():
+            result[:] = glyphmatch.matchCells(glyphmatch.tableCells(image))
+        report('match ' + kind + ' ' + name, bestTime(match, repeat))
+        values, confidence = result
+        for i in range(144):
+            cells += 1
+            correct += values[i] == expected[i]
+            unsure += confidence[i] < glyphmatch.CONFIDENCE
+    print('{0}: {1} of {2} cells correct, {3} passed on to Tesseract'.format(kind, correct, cells, unsure))
+
+# The benchmarks by name.
+BENCHMARKS = {
+    'saveload': benchmarkSaveLoad,
+    'polling': benchmarkPolling,
+    'drawtape': benchmarkDrawTape,
+    'minimap': benchmarkMinimap,
+    'demo': benchmarkDemo,
+    'startup': benchmarkStartup,
+    'buttons': benchmarkButtons,
+    'templates': benchmarkTemplates,
+}
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Run TMD-2 benchmarks.')
+    parser.add_argument('names', nargs='*', help='benchmarks to run: ' + ', '.join(BENCHMARKS) + ' (default all)')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='number of times each case is timed')
+    options = parser.parse_args(arguments)
+    for name in options.names:
+        if not name in BENCHMARKS:
+            parser.error('unknown benchmark ' + name)
+
+    for name in options.names or BENCHMARKS:
+        print(name)
+        BENCHMARKS[name](options.repeat)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,9 @@
 import pygame
 import math
 import cv2
+import glyphs
 import ocr
+import scheduler
 from picamera import PiCamera
 
 pygame.init()
@@ -14,6 +16,9 @@ SCREEN_SIZE = SCREEN_WIDTH,SCREEN_HEIGHT = 800, 480
 # Define the corner boxes.
 CORNER_RADIUS = 30
 
+# Frame rate for the live camera preview. Otherwise the screen only changes on an event.
+PREVIEW_FRAME_RATE = 10
+
 # Get ready to take a picture.
 camera = PiCamera()
 camera.rotation = 180
@@ -31,7 +36,7 @@ DARK_PURPLE = 200, 0, 200
 
 # Cache the panel label symbols and positions needed.
 PANEL_LABEL_FONT_SIZE = 25
-panelLabelFont = pygame.font.SysFont('arialbold', PANEL_LABEL_FONT_SIZE)
+panelLabelFont = glyphs.getFont('arialbold', PANEL_LABEL_FONT_SIZE)
 panelLabelSymbols = {
     'CANCEL':panelLabelFont.render('CANCEL', True, DARK_PURPLE, WHITE),
     'START':panelLabelFont.render('START', True, DARK_PURPLE, WHITE),
@@ -222,7 +227,11 @@ def getImageStateTable(screen):
         pygame.display.flip()
         
         # Check the event queue. 
-        for event in pygame.event.get():
+        if refresh:
+            events = scheduler.getEvents(PREVIEW_FRAME_RATE)
+        else:
+            events = scheduler.getEvents()
+        for event in events:
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     return False
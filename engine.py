@@ -0,0 +1,971 @@
+#
+# Turing machine engine for the TMD-2. Holds the tape and state transition table
+# and runs the machine one step at a time or at full speed. Has no pygame dependency
+# so that it can be used without a screen.
+#
+import ast
+import glob
+import mmap
+import os
+import re
+import struct
+import time
+import zlib
+
+# The state names in panel order.
+STATE_NAMES = 'ABCDEF'
+
+# Tape values are '0' - '5' plus 6 for the end symbol 'b'.
+NUMBER_SYMBOLS = 7
+
+# Special next state values in the compiled state table. SPECIAL_STATE marks transitions
+# that runFast cannot treat as a plain step.
+HALT_STATE = -1
+UNDEFINED_STATE = -2
+SPECIAL_STATE = -3
+
+# Valid non blank symbols for each row of the state transition table.
+WRITE_SYMBOLS = '012345b'
+MOVE_SYMBOLS = 'LR'
+GOTO_SYMBOLS = 'ABCDEFH'
+
+# The tape is split into pages of PAGE_SIZE cells which are allocated when first visited.
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+BLANK_PAGE = bytes(PAGE_SIZE)
+
+# Older saves hold a fixed 100000 cell tape with cell 0 in the middle.
+LEGACY_TAPE_ORIGIN = 50000
+
+# The binary .tmd2v2 workspace format. The header is followed by the state table, 4 ASCII
+# characters per transition in panel order, then the used part of the tape, one byte per
+# cell, which is zlib compressed if that makes it smaller. Readers skip any header bytes
+# past the ones they know about, so fields can be added at the end. BINARY_STATS follows
+# the fixed part of the header and holds the step count and run time.
+BINARY_EXTENSION = '.tmd2v2'
+BINARY_MAGIC = b'TMD2'
+BINARY_VERSION = 2
+BINARY_HEADER = struct.Struct('<4sBBHBBBBqqQQ')
+BINARY_STATS = struct.Struct('<Qd')
+BINARY_ZLIB = 1
+BINARY_NO_TRANSITION = 255
+STEP_NAMES = ('READ', 'WRITE', 'MOVE', 'GOTO')
+
+# Binary files at least this big are memory mapped rather than read in.
+MMAP_SIZE = 1 << 20
+
+# How many steps runFast executes between calls to the poll function. Cycle checks are
+# made at the same points.
+POLL_STEPS = 100000
+
+# For polling by time, the usual number of seconds between polls and the fewest steps
+# between them. The number of steps starts at MIN_POLL_STEPS and is worked out again at
+# each poll from the speed the machine is running at.
+POLL_INTERVAL = 0.05
+MIN_POLL_STEPS = 1000
+
+# The values break conditions can look at, and for each comparison the range that the value
+# less the number in the condition has to be in for the condition to hold.
+BREAK_VALUES = ('head', 'ones', 'sigma')
+BREAK_COMPARISONS = {
+    '>=': (0, float('inf')),
+    '>': (1, float('inf')),
+    '<=': (float('-inf'), 0),
+    '<': (float('-inf'), -1),
+    '==': (0, 0),
+}
+
+# Single byte strings for each tape value, used to find runs of a symbol.
+SYMBOL_BYTES = [bytes([value]) for value in range(NUMBER_SYMBOLS)]
+
+# Run length encoding of the tape in text saves. Each cell is saved as a digit, and runs
+# of more than 5 of the same digit as [count]digit.
+RLE_DIGITS = b'0123456'
+RLE_TO_DIGITS = bytes.maketrans(bytes(range(NUMBER_SYMBOLS)), RLE_DIGITS)
+RLE_FROM_DIGITS = bytes.maketrans(RLE_DIGITS, bytes(range(NUMBER_SYMBOLS)))
+RLE_RUN = re.compile(rb'([0-6])\1{5,}')
+RLE_COUNT = re.compile(rb'\[([0-9]+)\]([0-6])')
+
+# How each tape value is shown in the text dump of the workspace.
+DUMP_CELLS = ['| ' + symbol + ' ' for symbol in WRITE_SYMBOLS]
+
+# Return the number of each symbol in the cells passed, indexed by tape value. Blank
+# cells are not counted.
+def countSymbols(cells):
+    counts = [0] * NUMBER_SYMBOLS
+    for value in range(1, NUMBER_SYMBOLS):
+        counts[value] = cells.count(SYMBOL_BYTES[value])
+    return counts
+
+# Expand the paths passed into a sorted list of workspace files. Each path can be a file, a
+# glob pattern or a directory, which is searched for files with the extensions passed.
+def findFiles(paths, extensions=('.tmd2', BINARY_EXTENSION)):
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for extension in extensions:
+                filenames += glob.glob(os.path.join(path, '*' + extension))
+        elif glob.has_magic(path):
+            filenames += glob.glob(path)
+        else:
+            filenames.append(path)
+    return sorted(set(filenames))
+
+# A tape that is unbounded in both directions. Cells are addressed by their cell
+# number, which can be negative, and read as blank (0) until they are written.
+class Tape():
+
+    def __init__(self):
+        # Allocated pages by page number.
+        self.pages = {}
+
+        # The number of each non blank symbol on the tape, indexed by tape value.
+        self.counts = [0] * NUMBER_SYMBOLS
+
+        # Every non blank cell lies between start and end (exclusive). Cells that are
+        # blanked again are not taken back out, so there can be blank cells at either end.
+        self.start = 0
+        self.end = 0
+
+        # Counts the changes made to the tape, so that anything showing it can tell when it
+        # has to be drawn again.
+        self.version = 0
+
+    def __getitem__(self, position):
+        page = self.pages.get(position >> PAGE_BITS)
+        if page == None:
+            return 0
+        return page[position & PAGE_MASK]
+
+    def __setitem__(self, position, value):
+        page = self.pages.get(position >> PAGE_BITS)
+        if page == None:
+            # Blank cells do not need a page.
+            if value == 0:
+                return
+            page = self.getPage(position >> PAGE_BITS)
+        offset = position & PAGE_MASK
+        if page[offset] != 0:
+            self.counts[page[offset]] -= 1
+        if value != 0:
+            self.counts[value] += 1
+            self.include(position, position + 1)
+        page[offset] = value
+        self.version += 1
+
+    # Return the page passed, allocating it if necessary.
+    def getPage(self, number):
+        page = self.pages.get(number)
+        if page == None:
+            page = bytearray(PAGE_SIZE)
+            self.pages[number] = page
+        return page
+
+    # Set all of the cells to blank and release the pages.
+    def clear(self):
+        self.pages.clear()
+        self.counts = [0] * NUMBER_SYMBOLS
+        self.start = 0
+        self.end = 0
+        self.version += 1
+
+    # Widen the extent to cover the cells from start up to but not including end.
+    def include(self, start, end):
+        if self.start == self.end:
+            self.start = start
+            self.end = end
+        else:
+            self.start = min(self.start, start)
+            self.end = max(self.end, end)
+
+    # Return the range of cells holding all of the non blank cells as (start, end), end exclusive.
+    def getExtent(self):
+        return (self.start, self.end)
+
+    # Return the number of non blank cells.
+    def getNonBlankCount(self):
+        return sum(self.counts)
+
+    # Update the counts and extent for a page that has been written to directly. Takes the
+    # counts for the page from before it was written and returns the new ones.
+    def recountPage(self, number, before):
+        page = self.pages.get(number)
+        if page == None:
+            after = [0] * NUMBER_SYMBOLS
+        else:
+            after = countSymbols(page)
+        for value in range(1, NUMBER_SYMBOLS):
+            self.counts[value] += after[value] - before[value]
+        if page != None and page != BLANK_PAGE:
+            pageStart = number << PAGE_BITS
+            self.include(pageStart + PAGE_SIZE - len(page.lstrip(SYMBOL_BYTES[0])),
+                         pageStart + len(page.rstrip(SYMBOL_BYTES[0])))
+        self.version += 1
+        return after
+
+    # Update the counts and extent for all of the pages in the dictionary passed, which
+    # maps page numbers to their counts from before they were written to directly. The
+    # dictionary is updated with the new counts.
+    def recountPages(self, counted):
+        for number, before in counted.items():
+            counted[number] = self.recountPage(number, before)
+
+    # Return a copy of the cells from start up to but not including end.
+    def getCells(self, start, end):
+        cells = bytearray(max(end - start, 0))
+        for number in range(start >> PAGE_BITS, ((end - 1) >> PAGE_BITS) + 1):
+            page = self.pages.get(number)
+            if page == None:
+                continue
+            pageStart = number << PAGE_BITS
+            low = max(start, pageStart)
+            high = min(end, pageStart + PAGE_SIZE)
+            cells[low-start:high-start] = page[low-pageStart:high-pageStart]
+        return cells
+
+    # Copy the cells passed onto the tape starting at cell start.
+    def setCells(self, start, cells):
+        end = start + len(cells)
+        low = start
+        while low < end:
+            number = low >> PAGE_BITS
+            pageStart = number << PAGE_BITS
+            high = min(end, pageStart + PAGE_SIZE)
+            allocated = number in self.pages
+            page = self.getPage(number)
+            before = countSymbols(page)
+            page[low-pageStart:high-pageStart] = cells[low-start:high-start]
+            # Blank cells do not need a page.
+            if not allocated and page == BLANK_PAGE:
+                del self.pages[number]
+            self.recountPage(number, before)
+            low = high
+
+    # Return the cells from the first non blank cell to the last as (start, cells). The tape
+    # is not changed, so the screen can call this while a run is writing to the tape in
+    # another thread.
+    def getUsedCells(self):
+        start, end = self.start, self.end
+        cells = self.getCells(start, end)
+        stripped = cells.lstrip(SYMBOL_BYTES[0])
+        start += len(cells) - len(stripped)
+        cells = stripped.rstrip(SYMBOL_BYTES[0])
+        if not cells:
+            start = 0
+        return start, cells
+
+class TuringMachine():
+
+    def __init__(self):
+        # Dictionary to hold the finite state table.
+        self.stateTable = {}
+        self.clearStateTable()
+
+        # Tape values will be stored here.
+        self.tape = Tape()
+        self.tapeHead = 0 # The read/write position on the tape
+
+        # Start of state machine running code.
+        self.currentState = 'A'
+        self.currentStep = 'READ'
+
+        # The current transition being processed.
+        self.currentTransition = None
+
+        # Keep track of the tape movement direction for the last transition.
+        self.lastMoveDirection = ' '
+
+        # Number of transitions executed since the machine was reset.
+        self.steps = 0
+
+        # Seconds spent in runFast since the machine was reset.
+        self.elapsed = 0.0
+
+        # Set when runFast finds a cycle: the step it was found at and its period.
+        self.cycleStep = 0
+        self.cyclePeriod = 0
+
+        # The state table compiled into flat integer arrays for runFast, indexed by state*7+symbol.
+        # Next states are stored as the index of the first entry of the next state's row.
+        self.compiledNextStates = []
+        self.compiledWriteSymbols = []
+        self.compiledMoveDeltas = []
+        self.compiledEndMarkers = []
+        self.compiledRunSkips = []
+        self.compiledPlainStates = []
+        self.compiledBreaks = []
+
+        # Breakpoints for runFast: state table keys ('A0' - 'F5') of transitions to stop at,
+        # a step count to stop at and conditions that stop the run when any of them turns
+        # true. The conditions are given as (value, comparison, number), with the value from
+        # BREAK_VALUES and the comparison from BREAK_COMPARISONS, e.g. ('ones', '>=', 100).
+        self.breakpoints = set()
+        self.breakStep = None
+        self.breakConditions = []
+
+    # Set the state transition table data structure to default values.
+    def clearStateTable(self):
+        for state in STATE_NAMES:
+            for value in ('0', '1', '2', '3', '4', '5'):
+                self.stateTable[state+value] = [value, ' ', ' ', ' ']
+
+    # Set the tape to all blanks (0) and move the tape head to cell 0.
+    def clearTape(self):
+        self.tape.clear()
+        self.tapeHead = 0
+
+    # Set the running state.
+    def resetState(self, state, step):
+        self.currentState = state
+        self.currentStep = step
+        self.steps = 0
+        self.elapsed = 0.0
+
+    # Return the transition for the symbol under the tape head in the current state.
+    def lookupTransition(self):
+        value = self.tape[self.tapeHead]
+        if value == 6:
+            return self.stateTable[self.currentState+'5']
+        else:
+            return self.stateTable[self.currentState+str(value)]
+
+    # READ step. Determine the transition tuple for the symbol at the tape head position.
+    # Returns False if the transition is not defined.
+    def readStep(self):
+        self.currentTransition = self.lookupTransition()
+        if self.currentTransition[1] == ' ' or self.currentTransition[2] == ' ' or self.currentTransition[3] == ' ':
+            return False
+        self.currentStep = 'WRITE'
+        return True
+
+    # WRITE step. Update the tape with the new value. If is 'b' don't write.
+    def writeStep(self):
+        if self.currentTransition[1] != 'b':
+            self.tape[self.tapeHead] = int(self.currentTransition[1])
+        self.currentStep = 'MOVE'
+
+    # MOVE step. Returns False if the tape could not be moved because of a boundary.
+    def moveStep(self):
+        # Cannot go past a boundary.
+        if self.currentTransition[0] == 'b' and self.currentTransition[2] == self.lastMoveDirection:
+            return False
+
+        # Move the tape.
+        if self.currentTransition[2] != 'R':
+            self.tapeHead += 1
+        else:
+            self.tapeHead -= 1
+
+        # Record the last move direction.
+        self.lastMoveDirection = self.currentTransition[2]
+        self.currentStep = 'GOTO'
+        self.steps += 1
+        return True
+
+    # GOTO step. Set the new state. Returns False if the machine halted.
+    def gotoStep(self):
+        self.currentStep = 'READ'
+        if self.currentTransition[3] == 'H':
+            return False
+        self.currentState = self.currentTransition[3]
+        return True
+
+    # Translate the state transition table into the flat integer arrays used by runFast.
+    # Transitions with blank cells are marked as undefined and only reported if they are reached.
+    # Transitions that rewrite the symbol they read, stay in the same state and move are marked
+    # as run skips so runFast can sweep across a run of that symbol in one go. Breakpoints are
+    # compiled in too, so the table has to be compiled again after they change.
+    def compileStateTable(self):
+        nextStates = [UNDEFINED_STATE] * (len(STATE_NAMES) * NUMBER_SYMBOLS)
+        writeValues = [0] * len(nextStates)
+        moveDeltas = [0] * len(nextStates)
+        endMarkers = [False] * len(nextStates)
+
+        for stateIndex, state in enumerate(STATE_NAMES):
+            for symbol in range(0, NUMBER_SYMBOLS):
+                # Tape values 5 and 6 ('b') both use the last column.
+                transition = self.stateTable[state+str(min(symbol, 5))]
+                index = stateIndex * NUMBER_SYMBOLS + symbol
+                endMarkers[index] = transition[0] == 'b'
+                if transition[1] == ' ' or transition[2] == ' ' or transition[3] == ' ':
+                    continue
+
+                # Check each symbol now so the run loop does not have to.
+                if transition[1] == 'b':
+                    # Do not write over a 'b'.
+                    writeValues[index] = symbol
+                elif transition[1] in WRITE_SYMBOLS:
+                    writeValues[index] = int(transition[1])
+                else:
+                    raise ValueError('Transition ' + state + transition[0] + ' has an invalid WRITE symbol.')
+                if transition[2] == 'L':
+                    moveDeltas[index] = 1
+                elif transition[2] == 'R':
+                    moveDeltas[index] = -1
+                else:
+                    raise ValueError('Transition ' + state + transition[0] + ' has an invalid MOVE symbol.')
+                if transition[3] == 'H':
+                    nextStates[index] = HALT_STATE
+                elif transition[3] in STATE_NAMES:
+                    nextStates[index] = STATE_NAMES.index(transition[3]) * NUMBER_SYMBOLS
+                else:
+                    raise ValueError('Transition ' + state + transition[0] + ' has an invalid GOTO symbol.')
+
+        runSkips = [False] * len(nextStates)
+        breaks = [False] * len(nextStates)
+        plainStates = list(nextStates)
+        for index in range(0, len(nextStates)):
+            state = index - index % NUMBER_SYMBOLS
+            symbol = index % NUMBER_SYMBOLS
+            runSkips[index] = (nextStates[index] == state and writeValues[index] == symbol
+                               and not endMarkers[index])
+            breaks[index] = STATE_NAMES[state // NUMBER_SYMBOLS] + str(min(symbol, 5)) in self.breakpoints
+            if nextStates[index] < 0 or runSkips[index] or endMarkers[index] or breaks[index]:
+                plainStates[index] = SPECIAL_STATE
+
+        self.compiledNextStates = nextStates
+        self.compiledWriteSymbols = writeValues
+        self.compiledMoveDeltas = moveDeltas
+        self.compiledEndMarkers = endMarkers
+        self.compiledRunSkips = runSkips
+        self.compiledPlainStates = plainStates
+        self.compiledBreaks = breaks
+
+    # Run the compiled state table until the machine halts. The optional poll function is
+    # called every pollSteps steps, or about every pollInterval seconds if that is set, and
+    # stops the run if it returns True. The head, state, step count, run time and tape
+    # counts are brought up to date before each poll so that the run can be shown while it
+    # goes, from another thread if need be.
+    # If useBreakpoints is set the run also stops before any transition in breakpoints, except
+    # the one it starts on so that it can be carried on from a breakpoint, on reaching
+    # breakStep steps and at the first step where any of breakConditions turns true.
+    # Returns 'E' for an undefined transition, 'L' if the machine reached maxSteps steps,
+    # 'C' if detectCycles is set and the machine was found to be in a cycle (see cycleStep
+    # and cyclePeriod), 'B' for a breakpoint, otherwise 'H'.
+    def runFast(self, poll=None, maxSteps=None, detectCycles=True, pollSteps=POLL_STEPS, pollInterval=None,
+                useBreakpoints=True):
+        startTime = time.perf_counter()
+        startElapsed = self.elapsed
+
+        # Keep everything the loop touches in locals.
+        plainStates = self.compiledPlainStates
+        nextStates = self.compiledNextStates
+        writeValues = self.compiledWriteSymbols
+        moveDeltas = self.compiledMoveDeltas
+        endMarkers = self.compiledEndMarkers
+        runSkips = self.compiledRunSkips
+        breaks = self.compiledBreaks
+        tape = self.tape
+        pages = tape.pages
+        getPage = tape.getPage
+
+        # The head is tracked as an offset into the current page.
+        pageNumber = self.tapeHead >> PAGE_BITS
+        page = getPage(pageNumber)
+        offset = self.tapeHead & PAGE_MASK
+        state = STATE_NAMES.index(self.currentState) * NUMBER_SYMBOLS
+
+        # The loop writes straight into the pages, so the symbol counts for each page are
+        # taken as the head first reaches it and the tape counts are updated from them later.
+        counted = {pageNumber: countSymbols(page)}
+        if self.lastMoveDirection == 'L':
+            lastDelta = 1
+        elif self.lastMoveDirection == 'R':
+            lastDelta = -1
+        else:
+            lastDelta = 0
+
+        steps = self.steps
+        if maxSteps == None:
+            maxSteps = float('inf')
+        if pollInterval != None:
+            pollSteps = MIN_POLL_STEPS
+        pollTime = startTime
+        pollStart = steps
+
+        # A step breakpoint that has not been reached yet stops the run like maxSteps does.
+        firstSteps = steps
+        breakStep = float('inf')
+        if useBreakpoints:
+            if self.breakStep != None and self.breakStep > steps:
+                breakStep = self.breakStep
+        else:
+            breaks = [False] * len(breaks)
+        stopSteps = min(maxSteps, breakStep)
+
+        # The break conditions are checked again only once enough steps have gone by for
+        # them to have changed.
+        nextCheck = float('inf')
+        if useBreakpoints and self.breakConditions:
+            conditionWas, untilChange = self.checkBreakConditions()
+            # The tape counts only need bringing up to date for conditions on them.
+            countConditions = any(name != 'head' for name, _, _ in self.breakConditions)
+            nextCheck = steps + untilChange
+        nextPollSteps = steps + pollSteps
+        nextPoll = min(nextPollSteps, nextCheck, stopSteps)
+
+        # Cycle detection compares the configuration at each poll with a saved one. The saved
+        # configuration is replaced after 1, 2, 4, 8... polls so that cycles of any length are
+        # caught (Brent's method) without adding anything to the loop between polls.
+        reference = None
+        referenceSteps = 0
+        checks = 0
+        checkLimit = 1
+        while True:
+            # Periodically give the caller a chance to stop the run.
+            if steps >= nextPoll:
+                if steps >= nextCheck:
+                    # Only stop as the conditions turn true, so a run carried on from here
+                    # does not stop again straight away.
+                    if countConditions:
+                        tape.recountPages(counted)
+                        counted = {pageNumber: counted[pageNumber]}
+                    self.tapeHead = (pageNumber << PAGE_BITS) + offset
+                    conditionIs, untilChange = self.checkBreakConditions()
+                    if conditionIs and not conditionWas:
+                        self.currentStep = 'READ'
+                        result = 'B'
+                        break
+                    conditionWas = conditionIs
+                    nextCheck = steps + untilChange
+                if steps >= stopSteps:
+                    self.currentStep = 'READ'
+                    result = 'B' if steps >= breakStep else 'L'
+                    break
+                if steps >= nextPollSteps:
+                    if poll != None:
+                        tape.recountPages(counted)
+                        counted = {pageNumber: counted[pageNumber]}
+                        self.tapeHead = (pageNumber << PAGE_BITS) + offset
+                        self.currentState = STATE_NAMES[state // NUMBER_SYMBOLS]
+                        self.steps = steps
+                        self.elapsed = startElapsed + time.perf_counter() - startTime
+                        if poll():
+                            self.currentStep = 'READ'
+                            result = 'H'
+                            break
+                    if detectCycles:
+                        # Only look at the tape if the state matches or a new reference is due.
+                        checks += 1
+                        if checks == checkLimit or (reference != None and reference[0] == state and reference[1] == lastDelta):
+                            tape.recountPages(counted)
+                            counted = {pageNumber: counted[pageNumber]}
+                            fingerprint = self.getFingerprint((pageNumber << PAGE_BITS) + offset, state, lastDelta)
+                            if fingerprint == reference:
+                                self.currentStep = 'READ'
+                                result = 'C'
+                                break
+                            if checks == checkLimit:
+                                reference = fingerprint
+                                referenceSteps = steps
+                                checks = 0
+                                checkLimit *= 2
+                    if pollInterval != None:
+                        # Set the steps to the next poll from the speed since the last one.
+                        # They at most double each time, so a machine that has been sweeping
+                        # quickly over runs of a symbol and then slows down is not left
+                        # unpolled for long.
+                        now = time.perf_counter()
+                        if now > pollTime:
+                            rate = (steps - pollStart) / (now - pollTime)
+                            pollSteps = max(MIN_POLL_STEPS, min(pollSteps * 2, int(rate * pollInterval)))
+                        pollTime = now
+                        pollStart = steps
+                    nextPollSteps = steps + pollSteps
+                nextPoll = min(nextPollSteps, nextCheck, stopSteps)
+
+            # Read.
+            value = page[offset]
+            index = state + value
+            nextState = plainStates[index]
+
+            if nextState < 0:
+                nextState = nextStates[index]
+                delta = moveDeltas[index]
+
+                # Stop before a breakpoint transition.
+                if breaks[index] and steps != firstSteps:
+                    self.currentStep = 'READ'
+                    result = 'B'
+                    break
+
+                # Check for invalid state transition table.
+                if nextState == UNDEFINED_STATE:
+                    self.currentStep = 'READ'
+                    result = 'E'
+                    break
+
+                # Sweep across the run of this symbol without stopping at each cell. The run
+                # ends at the first different symbol or at the next poll, whichever is first.
+                # Breakpoint transitions are taken one step at a time.
+                if runSkips[index] and not breaks[index]:
+                    if delta > 0:
+                        edge = PAGE_SIZE - offset
+                        count = edge - len(page[offset:].lstrip(SYMBOL_BYTES[value]))
+                    else:
+                        edge = offset + 1
+                        count = edge - len(page[:offset+1].rstrip(SYMBOL_BYTES[value]))
+                    if count == edge and value == 0:
+                        # Pages that have not been allocated yet are all blank.
+                        number = pageNumber + delta
+                        while count < nextPoll - steps and not number in pages:
+                            count += PAGE_SIZE
+                            number += delta
+                    count = min(count, nextPoll - steps)
+                    offset += count * delta
+                    if offset >> PAGE_BITS:
+                        # Moved off the current page. Long sweeps over blank tape would
+                        # otherwise leave a trail of empty pages behind.
+                        if page == BLANK_PAGE:
+                            del pages[pageNumber]
+                        head = (pageNumber << PAGE_BITS) + offset
+                        pageNumber = head >> PAGE_BITS
+                        page = getPage(pageNumber)
+                        offset = head & PAGE_MASK
+                        if not pageNumber in counted:
+                            counted[pageNumber] = countSymbols(page)
+                    lastDelta = delta
+                    steps += count
+                    continue
+
+                # Write.
+                page[offset] = writeValues[index]
+
+                # Cannot go past a boundary.
+                if endMarkers[index] and delta == lastDelta:
+                    self.currentStep = 'MOVE'
+                    result = 'H'
+                    break
+
+                # Goto. Stop once the halting transition has moved the tape.
+                if nextState == HALT_STATE:
+                    offset += delta
+                    if offset >> PAGE_BITS:
+                        pageNumber += delta
+                        page = getPage(pageNumber)
+                        offset &= PAGE_MASK
+                    lastDelta = delta
+                    steps += 1
+                    self.currentStep = 'GOTO'
+                    result = 'H'
+                    break
+
+            # Write.
+            page[offset] = writeValues[index]
+
+            # Move.
+            delta = moveDeltas[index]
+            offset += delta
+            if offset >> PAGE_BITS:
+                # Moved off the current page.
+                pageNumber += delta
+                page = getPage(pageNumber)
+                offset &= PAGE_MASK
+                if not pageNumber in counted:
+                    counted[pageNumber] = countSymbols(page)
+            lastDelta = delta
+            steps += 1
+
+            # Goto. Set the new state.
+            state = nextState
+
+        # Copy the machine state back out of the locals.
+        tape.recountPages(counted)
+        self.tapeHead = (pageNumber << PAGE_BITS) + offset
+        self.steps = steps
+        self.currentState = STATE_NAMES[state // NUMBER_SYMBOLS]
+        if lastDelta == 1:
+            self.lastMoveDirection = 'L'
+        elif lastDelta == -1:
+            self.lastMoveDirection = 'R'
+        if self.currentStep == 'READ' and result != 'E':
+            self.currentTransition = None
+        else:
+            self.currentTransition = self.stateTable[self.currentState+str(min(value, 5))]
+        self.elapsed = startElapsed + time.perf_counter() - startTime
+        if result == 'C':
+            self.cycleStep = steps
+            self.cyclePeriod = self.findCyclePeriod(steps - referenceSteps, poll)
+        return result
+
+    # Return a fingerprint of the configuration for cycle detection. The head position is
+    # taken relative to the first non blank cell, so a machine that repeats the same
+    # pattern further along the tape counts as cycling too. The cells themselves are kept
+    # rather than a hash of them so that a collision can never stop a halting machine.
+    def getFingerprint(self, head, state, lastDelta):
+        start, cells = self.tape.getUsedCells()
+        if not cells:
+            start = head
+        return (state, lastDelta, head - start, cells)
+
+    # Return the value passed from BREAK_VALUES for the machine as it is now.
+    def getBreakValue(self, name):
+        if name == 'head':
+            return self.tapeHead
+        if name == 'ones':
+            return self.tape.counts[1]
+        return self.tape.getNonBlankCount()
+
+    # Check the break conditions against the machine as it is now. Returns whether any of
+    # them hold and the fewest steps before that could change. Each value changes by at most
+    # one a step, so a condition cannot change before its value has had time to cross the
+    # edge of its range, and all of the conditions that hold have to stop holding before
+    # they all fail.
+    def checkBreakConditions(self):
+        holds = False
+        untilTrue = float('inf')
+        untilFalse = 0
+        for name, comparison, number in self.breakConditions:
+            difference = self.getBreakValue(name) - number
+            low, high = BREAK_COMPARISONS[comparison]
+            if low <= difference <= high:
+                holds = True
+                untilFalse = max(untilFalse, min(difference - low, high - difference) + 1)
+            elif difference < low:
+                untilTrue = min(untilTrue, low - difference)
+            else:
+                untilTrue = min(untilTrue, difference - high)
+        if holds:
+            return True, untilFalse
+        return False, untilTrue
+
+    # Find the shortest period of a cycle that is known to repeat every length steps. Each
+    # prime factor is divided out for as long as the machine still repeats after the
+    # shorter period. The machine is put back as it was when the cycle was found, so that
+    # its step count matches cycleStep.
+    def findCyclePeriod(self, length, poll):
+        factors = []
+        remaining = length
+        factor = 2
+        while factor * factor <= remaining:
+            if remaining % factor == 0:
+                factors.append(factor)
+                while remaining % factor == 0:
+                    remaining //= factor
+            factor += 1
+        if remaining > 1:
+            factors.append(remaining)
+
+        # Keep the configuration to put back after the search.
+        start, end = self.tape.getExtent()
+        cells = self.tape.getCells(start, end)
+        saved = (self.tapeHead, self.currentState, self.currentStep, self.currentTransition,
+                 self.lastMoveDirection, self.steps)
+
+        period = length
+        try:
+            for factor in factors:
+                while period % factor == 0:
+                    fingerprint = self.getFingerprint(self.tapeHead, self.currentState, self.lastMoveDirection)
+                    if self.runFast(poll, self.steps + period // factor, False, useBreakpoints=False) != 'L':
+                        return period
+                    if self.getFingerprint(self.tapeHead, self.currentState, self.lastMoveDirection) != fingerprint:
+                        break
+                    period //= factor
+            return period
+        finally:
+            self.tape.clear()
+            self.tape.setCells(start, cells)
+            self.tape.include(start, end)
+            (self.tapeHead, self.currentState, self.currentStep, self.currentTransition,
+             self.lastMoveDirection, self.steps) = saved
+
+    # Run length encode the tape for saving. Returns the encoding and the cell number
+    # of the first encoded cell.
+    def encodeTape(self):
+        start, end = self.tape.getExtent()
+        digits = bytes(self.tape.getCells(start, end)).translate(RLE_TO_DIGITS)
+        compressed = RLE_RUN.sub(lambda run: b'[%d]%c' % (len(run.group()), run.group()[0]), digits)
+        return compressed.decode('ascii'), start
+
+    # Decode the run length encoding passed into the tape starting at cell start.
+    def decodeTape(self, compressed, start):
+        digits = RLE_COUNT.sub(lambda run: run.group(2) * int(run.group(1)), compressed.encode('ascii'))
+        if digits.translate(None, RLE_DIGITS):
+            raise ValueError('The saved tape is not a valid run length encoding.')
+        self.tape.clear()
+        self.tape.setCells(start, digits.translate(RLE_FROM_DIGITS))
+
+    # Return the tape and state machine as a dictionary for saving.
+    def saveWorkspace(self):
+        save = {}
+        save['tape'], save['tapestart'] = self.encodeTape()
+        save['table'] = self.stateTable
+        save['tapehead'] = self.tapeHead
+        save['state'] = self.currentState
+        save['step'] = self.currentStep
+        save['transition'] = self.currentTransition
+        save['steps'] = self.steps
+        save['elapsed'] = self.elapsed
+        return save
+
+    # Restore the tape and state machine from a saved dictionary.
+    def loadWorkspace(self, save):
+        if 'tapestart' in save:
+            self.decodeTape(save['tape'], save['tapestart'])
+            self.tapeHead = save['tapehead']
+        else:
+            # Fixed size tape with cell 0 in the middle.
+            self.decodeTape(save['tape'], -LEGACY_TAPE_ORIGIN)
+            self.tapeHead = save['tapehead'] - LEGACY_TAPE_ORIGIN
+        self.stateTable = save['table']
+        self.resetState(save['state'], save['step'])
+        self.currentTransition = save['transition']
+        self.steps = save.get('steps', 0)
+        self.elapsed = save.get('elapsed', 0.0)
+
+    # Load a workspace saved with saveFile. Text files from older versions are converted
+    # as they are read.
+    def loadFile(self, filename):
+        f = open(filename,"rb")
+        magic = f.read(len(BINARY_MAGIC))
+        f.seek(0)
+        if magic == BINARY_MAGIC:
+            try:
+                if os.fstat(f.fileno()).st_size >= MMAP_SIZE:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        self.loadBinary(data)
+                    finally:
+                        data.close()
+                else:
+                    self.loadBinary(f.read())
+            finally:
+                f.close()
+        else:
+            saveText = f.read().decode('ascii')
+            f.close()
+            self.loadWorkspace(ast.literal_eval(saveText))
+
+    # Restore the tape and state machine from the contents of a binary workspace file.
+    def loadBinary(self, data):
+        if len(data) < BINARY_HEADER.size:
+            raise ValueError('Workspace file is too short.')
+        (magic, version, flags, headerSize, stateIndex, stepIndex, lastMove, transition,
+         tapeHead, tapeStart, tapeLength, dataLength) = BINARY_HEADER.unpack_from(data)
+        if magic != BINARY_MAGIC:
+            raise ValueError('Not a TMD-2 workspace file.')
+        if version != BINARY_VERSION:
+            raise ValueError('Workspace file version ' + str(version) + ' is not supported.')
+        if (stateIndex >= len(STATE_NAMES) or stepIndex >= len(STEP_NAMES) or not chr(lastMove) in 'LR '
+                or (transition > 5 and transition != BINARY_NO_TRANSITION)):
+            raise ValueError('Workspace file has an invalid machine state.')
+
+        # State transition table.
+        tableEnd = headerSize + len(STATE_NAMES) * 6 * 4
+        if len(data) < tableEnd + dataLength:
+            raise ValueError('Workspace file is truncated.')
+        table = bytes(data[headerSize:tableEnd]).decode('ascii')
+        stateTable = {}
+        pos = 0
+        for state in STATE_NAMES:
+            for value in ('0', '1', '2', '3', '4', '5'):
+                stateTable[state+value] = list(table[pos:pos+4])
+                pos += 4
+
+        # Tape. Slicing a memory mapped file only reads the pages it covers.
+        with memoryview(data) as view:
+            cells = view[tableEnd:tableEnd+dataLength]
+            if flags & BINARY_ZLIB:
+                cells = zlib.decompress(cells)
+            if len(cells) != tapeLength:
+                raise ValueError('Workspace file tape is the wrong length.')
+            self.tape.clear()
+            self.tape.setCells(tapeStart, cells)
+            # A memory mapped file cannot be closed while a slice of it is still held.
+            cells = None
+
+        self.tapeHead = tapeHead
+        self.stateTable = stateTable
+        self.resetState(STATE_NAMES[stateIndex], STEP_NAMES[stepIndex])
+        self.lastMoveDirection = chr(lastMove)
+        if transition == BINARY_NO_TRANSITION:
+            self.currentTransition = None
+        else:
+            self.currentTransition = stateTable[self.currentState+str(transition)]
+        if headerSize >= BINARY_HEADER.size + BINARY_STATS.size:
+            self.steps, self.elapsed = BINARY_STATS.unpack_from(data, BINARY_HEADER.size)
+
+    # Return the workspace in the binary format.
+    def saveBinary(self):
+        start, cells = self.tape.getUsedCells()
+        if not cells:
+            start = 0
+        flags = 0
+        data = zlib.compress(cells)
+        if len(data) < len(cells):
+            flags |= BINARY_ZLIB
+        else:
+            data = cells
+
+        table = ''
+        for state in STATE_NAMES:
+            for value in ('0', '1', '2', '3', '4', '5'):
+                table += ''.join(self.stateTable[state+value])
+
+        if self.currentTransition == None:
+            transition = BINARY_NO_TRANSITION
+        elif self.currentTransition[0] == 'b':
+            transition = 5
+        else:
+            transition = int(self.currentTransition[0])
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, flags, BINARY_HEADER.size + BINARY_STATS.size,
+                                    STATE_NAMES.index(self.currentState), STEP_NAMES.index(self.currentStep),
+                                    ord(self.lastMoveDirection), transition, self.tapeHead, start, len(cells), len(data))
+        header += BINARY_STATS.pack(self.steps, self.elapsed)
+        return header + table.encode('ascii') + data
+
+    # Save the workspace to the file passed. Files ending in .tmd2v2 are saved in the
+    # binary format, anything else in the older text format.
+    def saveFile(self, filename):
+        if filename.endswith(BINARY_EXTENSION):
+            f = open(filename,"wb")
+            f.write( self.saveBinary() )
+        else:
+            f = open(filename,"w")
+            f.write( str(self.saveWorkspace()) )
+        f.close()
+
+    # Create a text version of the current tape and state machine information.
+    def dumpWorkspace(self):
+        # The tape from the first non blank (zero) cell to the last. A blank tape shows cell 0.
+        start, tape = self.tape.getUsedCells()
+        if not tape:
+            tape = bytearray(1)
+
+        # Build the output string here.
+        workspace = ""
+
+        # Show the range of non blank (zero) cells.
+        workspace += "Showing tape from cell {0} to cell {1}.\n".format(start, start+len(tape)-1)
+        for pos in range(0, len(workspace)-1):
+            workspace += '~'
+        workspace += '\n'
+
+        # Show the tape.
+        workspace += ''.join([DUMP_CELLS[value] for value in tape])
+        workspace += "|\n\nRun\n~~~\n"
+        workspace += 'Steps: ' + str(self.steps) + '\n'
+        workspace += 'Sigma: ' + str(self.tape.getNonBlankCount()) + '\n'
+        workspace += 'Time: {0:.3f}s\n'.format(self.elapsed)
+        workspace += "\nCounts\n~~~~~~\n"
+
+        # The symbol counts are kept by the tape. Blanks are only counted inside the range shown.
+        counts = list(self.tape.counts)
+        counts[0] = len(tape) - self.tape.getNonBlankCount()
+        for value in range(0, NUMBER_SYMBOLS):
+            workspace += WRITE_SYMBOLS[value] + ': ' + str(counts[value]) + '\n'
+
+        workspace += '\nState Transition Table\n~~~~~~~~~~~~~~~~~~~~~~\n'
+        for state in STATE_NAMES:
+            workspace += '            '+state+'\n'
+            for row in range(0, 4):
+                for col in range(0,6):
+                    value = self.stateTable[state+str(col)][row]
+                    if value == ' ':
+                        value = '-'
+                    workspace += '| ' + value + ' '
+                workspace += '|\n'
+            workspace += '\n'
+        return workspace
@@ -0,0 +1,198 @@
+#
+# Template matching for the symbols in a scanned state table.
+#
+# The table only ever holds the symbols below or blanks, so rather than asking Tesseract
+# about each one the cells are scaled to a small square and compared against a template
+# for each symbol. All of the cells are compared at once with a single matrix product, which
+# takes milliseconds for a whole table. The templates start out rendered from a font and
+# learn from the cells that Tesseract has to be asked about and is sure of, so they come to
+# look like the symbols on the table itself.
+#
+import os
+import zipfile
+
+import numpy as np
+import pygame
+
+import glyphs
+
+# The symbols that can appear in the table.
+SYMBOLS = '012345bLRABCDEFH'
+
+# Font the starting templates are rendered with.
+TEMPLATE_FONT = 'arialbold'
+TEMPLATE_FONT_SIZE = 100
+
+# Width and height in pixels the cells are scaled to for matching, and how many samples are
+# averaged along each side of a pixel when scaling.
+TEMPLATE_SIZE = 24
+SUPERSAMPLE = 3
+
+# Fraction of each side of a cell to ignore, so that what is left of the table lines does
+# not count as part of the symbol.
+CELL_MARGIN = 0.08
+
+# Rows and columns of a cell with less than this fraction of the black pixels of its
+# blackest row or column are left out of the box around the symbol, so that specks of
+# noise do not throw out its size.
+EDGE_INK = 0.1
+
+# Cells with less than this fraction of their pixels black are blank.
+BLANK_INK = 0.02
+
+# Matches scoring below this are not trusted.
+CONFIDENCE = 0.7
+
+# File the learned templates are kept in, next to this module.
+TEMPLATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'glyphs.templates.npz')
+
+# The learned templates. Sums of the scaled cells seen for each symbol, and how many there
+# were, starting with the rendered template. Loaded when first needed.
+templateSums = None
+templateCounts = None
+
+# The templates ready for matching, one row per symbol. Worked out again after learning.
+templates = None
+
+# Return the width and height of the panels and of the cells in the scanned table image
+# passed, as (panelWidth, panelHeight, cellWidth, cellHeight). The table is 3 panels across
+# and 2 down, each 6 cells across and 5 down.
+def tableGeometry(image):
+    imageHeight, imageWidth = image.shape
+    panelWidth = int(imageWidth / 3)
+    panelHeight = int(imageHeight / 2)
+    return panelWidth, panelHeight, int(panelWidth/6), int(panelHeight/5)
+
+# Return the top left corner of the cell at the index into ocr.scannedValues passed, in a
+# table with the geometry passed from tableGeometry. The top row of each panel holds its
+# state and is skipped.
+def cellPosition(index, geometry):
+    panelWidth, panelHeight, cellWidth, cellHeight = geometry
+    row = index // 18
+    column = index % 18
+    panelX = column // 6
+    panelY = row // 4
+    return panelX*panelWidth+(column%6)*cellWidth, panelY*panelHeight+(row%4+1)*cellHeight
+
+# Return the 144 cells of the scanned table image passed, a binary image with black symbols
+# on white. They come back as one array with the margins trimmed off, in the order of
+# ocr.scannedValues.
+def tableCells(image):
+    geometry = tableGeometry(image)
+    _, _, cellWidth, cellHeight = geometry
+    marginX = int(cellWidth*CELL_MARGIN)
+    marginY = int(cellHeight*CELL_MARGIN)
+    cells = []
+    for index in range(144):
+        x, y = cellPosition(index, geometry)
+        cells.append(image[y+marginY:y+cellHeight-marginY, x+marginX:x+cellWidth-marginX])
+    return np.stack(cells)
+
+# Scale the symbol in each of the cells passed, all the same size with black symbols on
+# white, to fill a square of TEMPLATE_SIZE pixels. The symbols keep their shape and are
+# centred. Returns one row per cell, shifted and scaled so that comparing two rows with a
+# dot product gives their correlation.
+def scaleCells(cells):
+    count, height, width = cells.shape
+    ink = cells < 128
+
+    # Find the box around the ink in every cell.
+    rows = ink.sum(axis=2)
+    columns = ink.sum(axis=1)
+    rows = (rows > 0) & (rows >= rows.max(axis=1, keepdims=True)*EDGE_INK)
+    columns = (columns > 0) & (columns >= columns.max(axis=1, keepdims=True)*EDGE_INK)
+    top = rows.argmax(axis=1)
+    bottom = height - rows[:, ::-1].argmax(axis=1)
+    left = columns.argmax(axis=1)
+    right = width - columns[:, ::-1].argmax(axis=1)
+    size = np.maximum(np.maximum(bottom-top, right-left), 1)
+
+    # Sample a square the size of the longer side of the box around its centre.
+    samples = TEMPLATE_SIZE*SUPERSAMPLE
+    steps = (np.arange(samples)+0.5)/samples-0.5
+    ys = np.floor((top+bottom)[:, None]/2+size[:, None]*steps).astype(int)
+    xs = np.floor((left+right)[:, None]/2+size[:, None]*steps).astype(int)
+    insideY = (ys >= 0) & (ys < height)
+    insideX = (xs >= 0) & (xs < width)
+    cellIndexes = np.arange(count)[:, None, None]
+    scaled = ink[cellIndexes, np.clip(ys, 0, height-1)[:, :, None], np.clip(xs, 0, width-1)[:, None, :]]
+    scaled &= insideY[:, :, None] & insideX[:, None, :]
+    scaled = scaled.reshape(count, TEMPLATE_SIZE, SUPERSAMPLE, TEMPLATE_SIZE, SUPERSAMPLE).mean(axis=(2, 4))
+
+    return normalise(scaled.reshape(count, -1))
+
+# Shift and scale each row passed to a mean of 0 and a length of 1.
+def normalise(vectors):
+    vectors = vectors - vectors.mean(axis=1, keepdims=True)
+    lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(lengths, 1e-9)
+
+# Render the starting template for each symbol. Needs pygame.font to be set up.
+def renderTemplates():
+    font = glyphs.getFont(TEMPLATE_FONT, TEMPLATE_FONT_SIZE)
+    cells = []
+    for symbol in SYMBOLS:
+        cell = pygame.Surface((TEMPLATE_FONT_SIZE*2, TEMPLATE_FONT_SIZE*2))
+        cell.fill((255, 255, 255))
+        image = font.render(symbol, True, (0, 0, 0), (255, 255, 255))
+        cell.blit(image, image.get_rect(center=cell.get_rect().center))
+        cells.append(pygame.surfarray.array3d(cell)[:, :, 0].T)
+    return scaleCells(np.stack(cells))
+
+# Load the learned templates, or render them if nothing has been learned yet.
+def loadTemplates():
+    global templateSums
+    global templateCounts
+    global templates
+    try:
+        with np.load(TEMPLATE_FILE) as saved:
+            templateSums = saved['sums']
+            templateCounts = saved['counts']
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        templateSums = renderTemplates()
+        templateCounts = np.ones(len(SYMBOLS))
+    if templateSums.shape != (len(SYMBOLS), TEMPLATE_SIZE*TEMPLATE_SIZE):
+        templateSums = renderTemplates()
+        templateCounts = np.ones(len(SYMBOLS))
+    templates = normalise(templateSums / templateCounts[:, None])
+
+# Add the cells passed to the templates for the symbols they are known to hold, and save
+# the templates. Values that are not a single symbol are skipped.
+def learnTemplates(cells, values):
+    global templates
+    if templates is None:
+        loadTemplates()
+    vectors = scaleCells(cells)
+    learned = False
+    for i in range(len(values)):
+        if len(values[i]) == 1 and values[i] in SYMBOLS:
+            symbol = SYMBOLS.index(values[i])
+            templateSums[symbol] += vectors[i]
+            templateCounts[symbol] += 1
+            learned = True
+    if not learned:
+        return
+    templates = normalise(templateSums / templateCounts[:, None])
+    try:
+        f = open(TEMPLATE_FILE + '.tmp', "wb")
+        np.savez(f, sums=templateSums, counts=templateCounts)
+        f.close()
+        os.replace(TEMPLATE_FILE + '.tmp', TEMPLATE_FILE)
+    except OSError:
+        pass
+
+# Match each of the cells passed against the templates. Returns the symbol for each cell,
+# ' ' for a blank one, and how closely each matched from -1 to 1. Blank cells count as an
+# exact match.
+def matchCells(cells):
+    if templates is None:
+        loadTemplates()
+    count = len(cells)
+    scores = scaleCells(cells) @ templates.T
+    best = scores.argmax(axis=1)
+    confidence = scores[np.arange(count), best]
+
+    blank = (cells < 128).reshape(count, -1).mean(axis=1) < BLANK_INK
+    values = [' ' if blank[i] else SYMBOLS[best[i]] for i in range(count)]
+    confidence[blank] = 1
+    return values, confidence
@@ -0,0 +1,136 @@
+#
+# Fonts, prerendered symbols and button images for the TMD-2 screens.
+#
+# Looking up a font by name makes pygame list every font on the system, which takes
+# seconds on the Pi, and the console renders about 80 symbols before it can show
+# anything. The first run saves the font files it found and the symbols it rendered to a
+# cache file, and later runs load them from there in one go. Fonts are only opened when
+# something is first drawn with them. The cache is built again whenever the symbols asked
+# for or the pygame version change.
+#
+# The button images are packed into one atlas and converted to the display format once, so
+# that drawing a button is a straight copy.
+#
+import functools
+import json
+import os
+import zlib
+
+import pygame
+
+# Changed whenever the layout of the cache file changes.
+CACHE_VERSION = 1
+
+# The font file for each font name, or None for the pygame default font. Filled in from the
+# cache file or as fonts are looked up.
+fontFiles = {}
+
+# Return the font with the name and size passed, in the same way as pygame.font.SysFont.
+@functools.lru_cache(maxsize=None)
+def getFont(name, size):
+    if name in fontFiles:
+        try:
+            return pygame.font.Font(fontFiles[name], size)
+        except OSError:
+            # The font has gone since the cache was made.
+            pass
+    fontFiles[name] = pygame.font.match_font(name)
+    return pygame.font.Font(fontFiles[name], size)
+
+# Return the symbols for each group passed. Groups are given as (font name, size, symbols),
+# where symbols maps each key to the (text, color, background) to render. The result maps
+# each group name to a dictionary of the rendered symbols by key, in the display format.
+# The display mode has to be set first.
+def loadSymbols(cacheName, groups):
+    # Describe everything that goes into the symbols the way it is stored in the cache.
+    request = []
+    for group in sorted(groups):
+        fontName, size, symbols = groups[group]
+        request.append([group, fontName, size, [[key, text, list(color), list(background)]
+                                                for key, (text, color, background) in symbols.items()]])
+    request = json.loads(json.dumps(request))
+
+    loaded = readCache(cacheName, request)
+    if loaded != None:
+        return loaded
+
+    result = {}
+    sizes = []
+    pixels = []
+    for group, fontName, size, symbols in request:
+        font = getFont(fontName, size)
+        result[group] = {}
+        for key, text, color, background in symbols:
+            image = font.render(text, True, color, background)
+            result[group][key] = image.convert()
+            sizes.append(image.get_size())
+            pixels.append(pygame.image.tostring(image, 'RGB'))
+    writeCache(cacheName, request, sizes, b''.join(pixels))
+    return result
+
+# Load the symbols from the cache file if it holds the ones asked for, otherwise return None.
+# The file is a line of JSON describing the symbols followed by their pixels compressed.
+def readCache(cacheName, request):
+    try:
+        f = open(cacheName, "rb")
+        header = json.loads(f.readline())
+        pixels = zlib.decompress(f.read())
+        f.close()
+    except (OSError, ValueError, zlib.error):
+        return None
+    if (header.get('version') != CACHE_VERSION or header.get('pygame') != pygame.version.ver
+            or header.get('request') != request):
+        return None
+
+    for name, fileName in header['fonts'].items():
+        fontFiles.setdefault(name, fileName)
+    result = {}
+    start = 0
+    sizes = iter(header['sizes'])
+    for group, _, _, symbols in request:
+        result[group] = {}
+        for key, _, _, _ in symbols:
+            width, height = next(sizes)
+            end = start + width * height * 3
+            result[group][key] = pygame.image.fromstring(pixels[start:end], (width, height), 'RGB').convert()
+            start = end
+    return result
+
+# Save the symbols to the cache file. The file is replaced in one go so it is never half
+# written, and a cache that cannot be written is simply left out.
+def writeCache(cacheName, request, sizes, pixels):
+    header = {'version': CACHE_VERSION, 'pygame': pygame.version.ver, 'fonts': fontFiles,
+              'request': request, 'sizes': sizes}
+    try:
+        f = open(cacheName + '.tmp', "wb")
+        f.write(json.dumps(header).encode('utf-8') + b'\n')
+        f.write(zlib.compress(pixels))
+        f.close()
+        os.replace(cacheName + '.tmp', cacheName)
+    except OSError:
+        pass
+
+# Load the images passed and pack them side by side into one surface in the display format.
+# Returns the images by file name as areas of that surface. The display mode has to be set
+# first.
+def loadAtlas(fileNames):
+    images = {}
+    for fileName in fileNames:
+        images[fileName] = pygame.image.load(fileName)
+    width = sum(image.get_width() for image in images.values())
+    height = max(image.get_height() for image in images.values())
+    if any(image.get_flags() & pygame.SRCALPHA for image in images.values()):
+        atlas = pygame.Surface((width, height), pygame.SRCALPHA)
+    else:
+        atlas = pygame.Surface((width, height))
+
+    rects = {}
+    x = 0
+    for fileName, image in images.items():
+        rects[fileName] = atlas.blit(image, (x, 0))
+        x += image.get_width()
+    if atlas.get_flags() & pygame.SRCALPHA:
+        atlas = atlas.convert_alpha()
+    else:
+        atlas = atlas.convert()
+    return {fileName: atlas.subsurface(rect) for fileName, rect in rects.items()}
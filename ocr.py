@@ -2,6 +2,8 @@ import pygame
 import pytesseract
 import cv2
 import numpy as np
+import glyphs
+import glyphmatch
 
 debug = True
 
@@ -24,6 +26,16 @@ WHITE = 255, 255, 255
 BLACK = 0, 0, 0
 PURPLE = 255, 128, 255
 
+# How the cells of the scanned image are read, one of the recognisers below.
+recogniser = 'templates'
+
+# Space around each cell in the cell OCR montage, as a fraction of the cell width.
+MONTAGE_GAP = 0.5
+
+# Cell OCR results Tesseract is at least this sure of (0 - 100) are used to teach the glyph
+# templates.
+LEARN_CONFIDENCE = 90
+
 # Globals. Will be used to iterate through the cells to fetch their values.
 scanImage = None
 imageWidth = 0
@@ -40,26 +52,94 @@ scanDone = False
 
 # Draw the title passed on the screen.
 def drawTitle(screen, title):
-    titleFont = pygame.font.SysFont('arialbold', 25)
+    titleFont = glyphs.getFont('arialbold', 25)
     screen.blit(titleFont.render(title, True, PURPLE, WHITE), (10,10))
 
+# Set the scanned image and work out the size of its panels and cells.
+def setScanImage(image):
+    global scanImage
+    global imageWidth
+    global imageHeight
+    global panelWidth
+    global panelHeight
+    global cellWidth
+    global cellHeight
+    scanImage = image
+    imageHeight,imageWidth = scanImage.shape
+    panelWidth, panelHeight, cellWidth, cellHeight = glyphmatch.tableGeometry(scanImage)
+
+# Return the symbols that belong in the cell at the index into scannedValues passed.
+def cellSymbols(index):
+    return [readSymbols, writeSymbols, moveSymbols, gotoSymbols][index // 18 % 4]
+
+# Return the top left corner in the scanned image of the cell at the index into
+# scannedValues passed.
+def cellPosition(index):
+    return glyphmatch.cellPosition(index, (panelWidth, panelHeight, cellWidth, cellHeight))
+
 #
-# Have Tesseract check the image passed for a single character.
-# Special case for periods to avoid the rather slow Tesseract call.
-# Return the character found.
+# Have Tesseract read the cells at the indexes into scannedValues passed in one go. Each
+# Tesseract call starts a new process, which is slow on the Pi, so rather than one call per
+# cell the cells are copied into a grid with plenty of white space around them and the
+# whole grid is read at once. The boxes Tesseract returns for each word are then matched
+# back to the cells. Cells with hardly any black in them are taken to be blank without
+# asking Tesseract. Return the characters found for each cell, with a space for a blank
+# cell and an empty string for a cell where nothing was found, and how sure Tesseract was
+# of each from 0 to 100.
 #
-def ocrCell(image, x, y, width, height):
-    customConfig = r'-c tessedit_char_whitelist=.012345bLRABCDEF --oem 1 --psm 10'
-    cell = image[y:y+height, x:x+width]
+def ocrCells(image, indexes):
+    customConfig = r'-c tessedit_char_whitelist=.012345bLRABCDEFHM --oem 1 --psm 6'
+    values = ['']*len(indexes)
+    confidences = [0]*len(indexes)
+    cells = []
+    for i in range(len(indexes)):
+        x, y = cellPosition(indexes[i])
+        cell = image[y:y+cellHeight, x:x+cellWidth]
+        count = cellWidth * cellHeight - cv2.countNonZero(cell)
+        if count < 1000:
+            values[i] = ' '
+            confidences[i] = 100
+        else:
+            cells.append(i)
+    if len(cells) == 0:
+        return values, confidences
+
+    # Copy the cells into the montage, 18 to a row as they are in the table.
+    gap = int(cellWidth*MONTAGE_GAP)
+    columns = min(len(cells), 18)
+    rows = (len(cells)+17) // 18
+    montageWidth = columns*(cellWidth+gap)+gap
+    montageHeight = rows*(cellHeight+gap)+gap
+    montage = np.full((montageHeight, montageWidth), 255, np.uint8)
+    for i in range(len(cells)):
+        x, y = cellPosition(indexes[cells[i]])
+        montageX = gap+(i%18)*(cellWidth+gap)
+        montageY = gap+(i//18)*(cellHeight+gap)
+        montage[montageY:montageY+cellHeight, montageX:montageX+cellWidth] = image[y:y+cellHeight, x:x+cellWidth]
     if debug:
-        cv2.imwrite('6 - cell.png', cell)
+        cv2.imwrite('6 montage.png', montage)
 
-    count = width * height - cv2.countNonZero(cell)
-    if count < 1000: 
-        cellValue = " "
-    else: 
-        cellValue = (pytesseract.image_to_string(cell, config=customConfig)).strip()
-    return cellValue
+    # Give each word found to the cell its box is centred in. A cell is only as sure as the
+    # least sure word in it.
+    words = pytesseract.image_to_data(montage, config=customConfig, output_type=pytesseract.Output.DICT)
+    found = [False]*len(cells)
+    for i in range(len(words['text'])):
+        text = words['text'][i].strip()
+        if text == '':
+            continue
+        centreX = words['left'][i]+words['width'][i] // 2
+        centreY = words['top'][i]+words['height'][i] // 2
+        column = (centreX-gap//2) // (cellWidth+gap)
+        row = (centreY-gap//2) // (cellHeight+gap)
+        cell = row*18+column
+        if 0 <= column < columns and 0 <= row < rows and cell < len(cells):
+            confidence = float(words['conf'][i])
+            if found[cell]:
+                confidence = min(confidence, confidences[cells[cell]])
+            values[cells[cell]] += text
+            confidences[cells[cell]] = confidence
+            found[cell] = True
+    return values, confidences
 
 # Return the sub image at the coordinates passed.
 def ocrCellImage(image, x, y, width, height):
@@ -89,9 +169,6 @@ def nextCellValue():
         else:
             cellY -= 2
         value = scannedValues[nextPanelY*72+nextPanelX*6+cellY*18+nextCellX]
-        if value == 'X':
-            # There was a problem with the word OCR so try cell OCR.
-            value = ocrCell(scanImage, nextPanelX*panelWidth+nextCellX*cellWidth, nextPanelY*panelHeight+nextCellY*cellHeight, cellWidth, cellHeight)
         if value == 'M':
             value = ' '
         nextCellX += 1
@@ -112,13 +189,6 @@ def nextCellValue():
 
 # Process the image passed and calculate the state transition values.
 def doOCR(originalImage, screen, boundingBox):
-    global scanImage
-    global imageWidth
-    global imageHeight
-    global panelWidth
-    global panelHeight
-    global cellWidth
-    global cellHeight
     global nextPanelX
     global nextPanelY
     global nextCellX
@@ -157,22 +227,54 @@ def doOCR(originalImage, screen, boundingBox):
         cv2.imwrite('5 dilated.png',dilatedImage)
     
     # Setup the globals so that a call to get each cell value can be made from the UI.
-    scanImage = dilatedImage
-    imageHeight,imageWidth = scanImage.shape
-    panelWidth = int(imageWidth / 3)
-    panelHeight = int(imageHeight / 2)
-    cellWidth = int(panelWidth/6)
-    cellHeight = int(panelHeight/5)
+    setScanImage(dilatedImage)
     nextPanelX = 0
     nextPanelY = 0
     nextCellX = 5
     nextCellY = 1
     scanDone = False
     
+    # Have the chosen recogniser read the cells. Any cells it is unsure of are marked X.
+    title = recognisers[recogniser](screen, title, boundingBox)
+
+    # Try cell OCR on all of the cells marked with Xs at once. The templates learn from the
+    # cells Tesseract is sure of that hold a symbol that belongs in their row.
+    fallback = [i for i in range(144) if scannedValues[i] == 'X']
+    if len(fallback) > 0:
+        title += ' .'
+        drawTitle(screen, title)
+        pygame.display.flip()
+        values, confidences = ocrCells(scanImage, fallback)
+        for i in range(len(fallback)):
+            scannedValues[fallback[i]] = values[i]
+        if debug:
+            print(values)
+        learn = [i for i in range(len(fallback))
+                 if confidences[i] >= LEARN_CONFIDENCE and values[i] in cellSymbols(fallback[i])]
+        if len(learn) > 0:
+            cells = glyphmatch.tableCells(scanImage)
+            glyphmatch.learnTemplates(cells[[fallback[i] for i in learn]], [values[i] for i in learn])
+
+    # Reset for UI calls.
+    nextPanelX = 0
+    nextPanelY = 0
+    nextCellX = 5
+    nextCellY = 1
+    scanDone = False
+
+# Read the cells of the scanned image by having Tesseract read each row as a word. Rows
+# that do not come out as 18 symbols are marked with Xs. Returns the title as updated.
+def readWords(screen, title, boundingBox):
+    global nextPanelX
+    global nextPanelY
+    global nextCellX
+    global nextCellY
+    global scanDone
+
     # Create a cell sized M surface.
     symbolM = pygame.Surface((cellWidth, cellHeight))
     symbolM.fill(WHITE)
-    symbolMFont = pygame.font.SysFont('arialbold', int(cellHeight*1.1))
+    symbolMFont = glyphs.getFont('arialbold', int(cellHeight*1.1))
     symbolMSurface = symbolMFont.render('M', True, BLACK, WHITE)
     symbolMWidth, symbolMHeight = symbolMSurface.get_rect().size
     symbolM.blit(symbolMSurface, (int((cellWidth-symbolMWidth)/2), (int((cellHeight-symbolMHeight)/2))))
@@ -255,14 +357,20 @@ def doOCR(originalImage, screen, boundingBox):
             # Missing or extra character. Force cell based OCR.
             for i in range(18):
                 scannedValues[nextValue] = 'X'
-                nextValue+=1     
-    
-    # Reset for UI calls.
-    nextPanelX = 0
-    nextPanelY = 0
-    nextCellX = 5
-    nextCellY = 1
-    scanDone = False
+                nextValue+=1
+    return title
 
-    
+# Read the cells of the scanned image by matching them against the glyph templates. Cells
+# that do not match well enough are marked with Xs. Returns the title as updated.
+def readTemplates(screen, title, boundingBox):
+    values, confidence = glyphmatch.matchCells(glyphmatch.tableCells(scanImage))
+    for i in range(144):
+        if confidence[i] < glyphmatch.CONFIDENCE:
+            values[i] = 'X'
+    scannedValues[:] = values
+    if debug:
+        print(values)
+    return title
 
+# The ways of reading the cells of the scanned image.
+recognisers = {'tesseract': readWords, 'templates': readTemplates}
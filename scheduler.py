@@ -0,0 +1,48 @@
+#
+# Shared event scheduling for the TMD-2 screens.
+#
+# The screens wait for events instead of spinning on pygame.event.get(), so an idle
+# console sleeps until the mouse moves, a key is pressed or a timer fires. Screens that
+# are animating pass a frame rate and get their events once a frame instead, and anything
+# that finishes in the background can call wake() to have the screen look again straight
+# away.
+#
+import threading
+import time
+
+import pygame
+
+# Longest time in milliseconds to sleep waiting for an event when nothing is happening.
+IDLE_TIMEOUT = 1000
+
+# Frame rate for screens that are animating.
+FRAME_RATE = 60
+
+# Posted by wake() so that a screen waiting for events wakes up.
+WAKEEVENT = pygame.USEREVENT+2
+
+# Set by wake() so that a screen waiting for its next frame wakes up.
+woken = threading.Event()
+
+# When the next frame is due when animating.
+nextFrame = 0
+
+# Return the events waiting to be handled. With no frame rate sleep until there is at
+# least one event or timeout milliseconds pass. With a frame rate sleep until the next
+# frame is due, then return whatever events came in meanwhile.
+def getEvents(frameRate=None, timeout=IDLE_TIMEOUT):
+    global nextFrame
+    if frameRate == None:
+        event = pygame.event.wait(timeout)
+        events = [] if event.type == pygame.NOEVENT else [event]
+    else:
+        woken.wait(max(0, nextFrame - time.perf_counter()))
+        nextFrame = time.perf_counter() + 1 / frameRate
+        events = []
+    woken.clear()
+    return events + pygame.event.get()
+
+# Wake up the screen waiting for events. Safe to call from any thread.
+def wake():
+    woken.set()
+    pygame.event.post(pygame.event.Event(WAKEEVENT))
@@ -30,7 +30,8 @@
    
 """
 
-import pygame, time
+import pygame
+import scheduler
 
 Uppercase = str.maketrans("abcdefghijklmnopqrstuvwxyz`1234567890-=[]\;\',./",
   'ABCDEFGHIJKLMNOPQRSTUVWXYZ~!@#$%^&*()_+{}|:"<>?')
@@ -42,6 +43,9 @@ WHITE = 255, 255, 255
 PURPLE = 255, 128, 255
 DARK_PURPLE = 200, 0, 200
 
+# Milliseconds between flashes of the text cursor.
+CURSOR_FLASH_TIME = 600
+
 #_keyWidth = 27 # default key width including borders
 #_keyHeight = 29 # default key height 
 
@@ -99,12 +103,10 @@ class VirtualKeyboard():
         # create a text input box with room for 2 lines of text. leave room for the escape key
         self.input = TextInput(self.screen,self.text,self.x,self.y+22,self.textW,self.textH)
 
-        counter = 0
-        # main event loop (hog all processes since we're on top, but someone might want
-        # to rewrite this to be more event based...
+        nextFlash = pygame.time.get_ticks() + CURSOR_FLASH_TIME
+        # main event loop, sleeping until there is an event or the cursor is due to flash
         while True:
-            time.sleep(0.1) # 10/second is often enough
-            events = pygame.event.get() 
+            events = scheduler.getEvents(timeout=max(1, nextFlash - pygame.time.get_ticks()))
             if events != None:
                 for e in events:
 # touch screen does not have these events...
@@ -133,10 +135,9 @@ class VirtualKeyboard():
                             # user click-dragged to a different key?
                             self.selectatmouse()
 
-            counter += 1
-            if counter > 5:                
+            if pygame.time.get_ticks() >= nextFlash:
                 self.input.flashcursor()
-                counter = 0
+                nextFlash = pygame.time.get_ticks() + CURSOR_FLASH_TIME
 ##            gtk.main_iteration(block=False)
 
     def unselectall(self, force = False):